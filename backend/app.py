@@ -1,27 +1,136 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from openai import OpenAI
+from typing import List, Optional
+import asyncio
+import codecs
 import os
 import logging
+import time
 import traceback
-import requests
 import json
-import re
+import tempfile
+import uuid
+from urllib.parse import quote
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from openai import RateLimitError
 
-# Configure logging with more details
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
-# Load environment variables
+# Load environment variables. Модули ниже читают настройки из окружения при импорте,
+# поэтому .env загружается до них
 load_dotenv()
 
+import batch
+import chunking
+import coalesce
+import dispatch
+import fileformats
+import jobs
+import logging_config
+import metrics
+import multitarget
+import prompts
+import ratelimit
+import state
+import transport
+import validation
+import warmup
+from translation_memory import TranslationMemory, TM_ENABLED, TM_DB_PATH
+from model_router import ModelRouter, classify
+from cache import TranslationCache, CACHE_ENABLED, make_key
+
+# Уровень и формат логов задаются LOG_LEVEL и LOG_FORMAT
+logging_config.configure_logging()
+logger = logging.getLogger(__name__)
+
 # Check if API key is available and log warning if not
 if not os.getenv("OPENROUTER_API_KEY"):
     logger.warning("OPENROUTER_API_KEY not found in environment variables")
 
-app = FastAPI()
+# Версия формата перевода в ключе кеша: при её изменении старые переводы не используются.
+# Складывается из выбранных шаблонов промптов (см. prompts), например "v2" или "v2+model=v1"
+PROMPT_VERSION = "+".join(
+    [prompts.PROMPT_TEMPLATE]
+    + [f"{model}={prompts.template_for(model)}" for model in sorted(prompts.PROMPT_TEMPLATES)]
+)
+
+translation_cache = None
+translation_memory = None
+job_queue = None
+state_store = None
+router_sync = None
+request_log = None
+request_log_task = None
+warmup_task = None
+# Фоновые обратные переводы (warmup.SPECULATIVE_REVERSE) по ключу кеша обратного направления;
+# ссылки держим, чтобы задачи не собрал GC
+speculative_tasks = {}
+
+# Статистика моделей живёт в памяти процесса; при общем хранилище она обменивается с другими воркерами
+model_router = ModelRouter()
+
+# Одинаковые одновременные переводы выполняются одним обращением к моделям
+inflight = coalesce.SingleFlight()
+
+@asynccontextmanager
+async def lifespan(app):
+    global translation_cache, translation_memory, job_queue, state_store, router_sync, request_log, request_log_task
+    global warmup_task
+    # Общий пул соединений живёт столько же, сколько приложение
+    await transport.startup()
+    # Квоты моделей и их статистика общие для всех воркеров (STATE_BACKEND)
+    state_store = state.open_state()
+    ratelimit.configure(state_store)
+    if state_store.shared:
+        router_sync = asyncio.ensure_future(model_router.run_sync(state_store))
+    if CACHE_ENABLED:
+        translation_cache = TranslationCache()
+    if TM_ENABLED:
+        try:
+            translation_memory = TranslationMemory()
+        except Exception as e:
+            logger.error(f"Failed to open translation memory {TM_DB_PATH}: {str(e)}. Translation memory disabled.")
+    if warmup.REQUEST_LOG_PATH:
+        try:
+            request_log = warmup.RequestLog()
+            request_log_task = asyncio.ensure_future(request_log.run())
+        except OSError as e:
+            logger.error(f"Failed to open request log {warmup.REQUEST_LOG_PATH}: {str(e)}. Request log disabled.")
+    # Прогрев идёт в фоне и не задерживает старт: первые запросы просто могут его опередить
+    if translation_cache is not None and warmup.WARMUP_LOG_PATH:
+        warmup_task = asyncio.ensure_future(warmup.run_periodic(warm_cache_once))
+    job_queue = jobs.JobQueue({"translate": run_translate_job, "batch": run_batch_job}, shared=state_store.shared)
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        job_queue = None
+        background = [warmup_task, request_log_task, *speculative_tasks.values()]
+        background = [task for task in background if task is not None]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        warmup_task = None
+        request_log_task = None
+        if request_log is not None:
+            request_log.close()
+            request_log = None
+        if translation_cache is not None:
+            translation_cache.close()
+            translation_cache = None
+        if translation_memory is not None:
+            translation_memory.close()
+            translation_memory = None
+        if router_sync is not None:
+            router_sync.cancel()
+            await asyncio.gather(router_sync, return_exceptions=True)
+            router_sync = None
+        await state_store.close()
+        await transport.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -32,6 +141,52 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """
+    Присваивает запросу идентификатор (X-Request-ID), который попадает во все логи,
+    и измеряет длительность запроса. Для потоковых ответов это время до первого байта
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = logging_config.request_id_var.set(request_id)
+    # Клиент для справедливой очереди ограничителя частоты
+    client_token = ratelimit.client_id_var.set(
+        request.headers.get("X-Client-ID") or (request.client.host if request.client else "unknown")
+    )
+    # Токены всех вызовов моделей за запрос, включая запасные модели
+    usage = metrics.new_request_usage()
+    usage_token = metrics.request_usage_var.set(usage)
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        # Потоковый ответ ещё не начался: расход SSE приходит в событии done, перевода файла - в логе
+        if not response.headers.get("content-type", "").startswith("text/event-stream") and \
+                not response.headers.get("content-disposition", "").startswith("attachment"):
+            response.headers["X-Upstream-Calls"] = str(usage["upstream_calls"])
+            response.headers["X-Prompt-Tokens"] = str(usage["prompt_tokens"])
+            response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
+            if usage["upstream_calls"]:
+                logger.info(f"Request usage: {usage}")
+        return response
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        # Имя обработчика вместо пути, чтобы /jobs/{job_id} не плодил метки
+        endpoint = request.scope.get("endpoint")
+        metrics.REQUEST_LATENCY.labels(
+            endpoint=endpoint.__name__ if endpoint else "unmatched", status=str(status)
+        ).observe(time.perf_counter() - started)
+        logging_config.request_id_var.reset(token)
+        ratelimit.client_id_var.reset(client_token)
+        metrics.request_usage_var.reset(usage_token)
+
+# Сколько символов потока накапливается перед первой отправкой клиенту:
+# на этом префиксе проверяется наличие метакомментариев
+STREAM_VALIDATION_CHARS = int(os.getenv("STREAM_VALIDATION_CHARS", "80"))
+
 # Модели для использования с запасными вариантами
 LLM_MODELS = [
     "deepseek/deepseek-chat:free",
@@ -41,177 +196,377 @@ LLM_MODELS = [
     "gryphe/mythomist-7b:free"
 ]
 
+TRANSLATION_MODES = ("auto", "single", "document")
+
 class TranslationRequest(BaseModel):
     text: str
     source_language: str
     target_language: str
+    # Стратегия обхода моделей: sequential, hedged или race (по умолчанию DISPATCH_STRATEGY)
+    strategy: Optional[str] = None
+    # auto - длинные тексты переводятся по фрагментам, single - одним запросом, document - всегда по фрагментам
+    mode: str = "auto"
 
-def is_valid_translation(source_text, translated_text, source_language, target_language):
+class BatchTranslationRequest(BaseModel):
+    segments: List[str]
+    source_language: str
+    target_language: str
+    strategy: Optional[str] = None
+
+class MultiTargetTranslationRequest(BaseModel):
+    text: str
+    source_language: str
+    target_languages: List[str]
+    strategy: Optional[str] = None
+
+class JobRequest(BaseModel):
+    # Либо text (перевод текста/документа), либо segments (пакетный перевод)
+    text: Optional[str] = None
+    segments: Optional[List[str]] = None
+    source_language: str
+    target_language: str
+    strategy: Optional[str] = None
+    # interactive - приоритетная полоса, bulk - фоновая
+    priority: str = "bulk"
+
+def validate_translation(source_text, translated_text, source_language, target_language):
     """
-    Проверяет, является ли перевод валидным:
-    - Не совпадает с исходным текстом
-    - Не содержит пояснений и комментариев переводчика
-    - Не пустой
-    """
-    # Удаляем лишние пробелы для сравнения
-    source_clean = re.sub(r'\s+', ' ', source_text.strip()).lower()
-    translated_clean = re.sub(r'\s+', ' ', translated_text.strip()).lower()
-    
-    # Проверка на идентичность текстов
-    if source_clean == translated_clean:
-        logger.warning(f"Translation output matches input exactly")
-        return False
-    
-    # Проверка на пустой результат
-    if not translated_clean:
-        logger.warning("Translation is empty")
-        return False
-    
-    # Проверка на наличие слов, указывающих на метакомментарии переводчика
-    meta_patterns = [
-        r'translation[:\s]',
-        r'translated[:\s]',
-        r'here is[:\s]',
-        r'перевод[:\s]',
-        r'\[.*?\]',  # Текст в квадратных скобках
-        r'\(.*?\)'   # Текст в круглых скобках
-    ]
-    
-    for pattern in meta_patterns:
-        if re.search(pattern, translated_clean, re.IGNORECASE):
-            logger.warning(f"Translation contains meta commentary matching pattern: {pattern}")
-            return False
-    
-    # Дополнительные проверки - используем эвристику "количество символов"
-    # Если языки используют разные алфавиты и перевод содержит оригинальные символы, это может быть проблемой
-    
-    # Если исходный язык использует кириллицу, а целевой латиницу (или наоборот)
-    cyrillic = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
-    latin = 'abcdefghijklmnopqrstuvwxyz'
-    
-    if source_language.lower() in ['russian', 'ukrainian', 'bulgarian', 'serbian'] and \
-       target_language.lower() in ['english', 'spanish', 'french', 'german', 'italian']:
-        # Проверяем, что в переводе мало кириллических символов
-        cyrillic_count = sum(1 for c in translated_clean if c.lower() in cyrillic)
-        if cyrillic_count > len(translated_clean) * 0.3:  # Если более 30% символов кириллические
-            logger.warning(f"Translation to {target_language} contains too many Cyrillic characters")
-            return False
-            
-    elif source_language.lower() in ['english', 'spanish', 'french', 'german', 'italian'] and \
-         target_language.lower() in ['russian', 'ukrainian', 'bulgarian', 'serbian']:
-        # Проверяем, что в переводе мало латинских символов
-        latin_count = sum(1 for c in translated_clean if c.lower() in latin)
-        if latin_count > len(translated_clean) * 0.3:  # Если более 30% символов латинские
-            logger.warning(f"Translation to {target_language} contains too many Latin characters")
-            return False
-            
-    return True
+    Возвращает причину, по которой перевод отклонён, или None (см. validation.check_translation)
+    """
+    with metrics.timed(metrics.VALIDATION_DURATION):
+        reason = validation.check_translation(source_text, translated_text, source_language, target_language)
+    if reason:
+        logger.warning(f"Invalid translation to {target_language}: {reason}")
+    return reason
 
-async def perform_translation(text, source_lang, target_lang, model, api_key, site_url, site_name):
+def is_valid_translation(source_text, translated_text, source_language, target_language):
     """
-    Выполняет перевод с помощью указанной модели
+    Проверяет, является ли перевод валидным
     """
-    # Улучшенный промпт со строгими ограничениями на вывод модели
-    prompt = f"""INSTRUCTION: Translate the following text from {source_lang} to {target_lang}. 
+    return validate_translation(source_text, translated_text, source_language, target_language) is None
 
-EXTREMELY IMPORTANT: You MUST return ONLY the translated text without ANY additional text. 
-- NO comments
-- NO notes
-- NO explanations
-- NO introductions
-- NO formatting marks
-- NO "here's the translation"
-- NOTHING except the plain translated text
+def openai_client(api_key):
+    """
+    Клиент OpenAI для вызовов моделей. Когда включён ограничитель частоты, ответы 429
+    обрабатывает он, поэтому собственные повторы SDK (с ожиданием Retry-After) отключены
+    """
+    if ratelimit.RATE_LIMIT_ENABLED:
+        return transport.get_openai_client(api_key, max_retries=0)
+    return transport.get_openai_client(api_key)
 
-TEXT TO TRANSLATE:
-{text}"""
+async def request_completion(messages, model, api_key, site_url, site_name):
+    """
+    Отправляет сообщения модели и возвращает (текст ответа, ошибка).
+    Вызов проходит через ограничитель частоты модели; время вызова и расход токенов попадают в метрики
+    """
+    cost = ratelimit.estimate_cost(messages)
+    if not await ratelimit.acquire(model, cost):
+        return None, f"Rate limited: local quota for {model} exhausted"
+    started = time.perf_counter()
+    content, error, usage = await _request_completion(messages, model, api_key, site_url, site_name)
+    metrics.UPSTREAM_LATENCY.labels(model=model, outcome="error" if error else "ok").observe(
+        time.perf_counter() - started
+    )
+    metrics.record_usage(model, usage, prompts.estimate_prompt_tokens(messages))
+    await ratelimit.settle(model, cost, usage)
+    return content, error
 
+async def _request_completion(messages, model, api_key, site_url, site_name):
+    """
+    Возвращает (текст ответа, ошибка, usage)
+    """
     try:
-        # Используем библиотеку OpenAI
+        # Используем асинхронный клиент OpenAI поверх общего пула соединений
         logger.debug(f"Using OpenAI client with model: {model}")
         try:
-            client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=api_key,
-            )
+            client = openai_client(api_key)
             
-            completion = client.chat.completions.create(
+            completion = await client.chat.completions.create(
                 extra_headers={
                     "HTTP-Referer": site_url,
                     "X-Title": site_name,
                 },
                 model=model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
+                messages=messages
             )
             
             # Получаем текст из ответа
-            translated_text = completion.choices[0].message.content
-            logger.info(f"Translation successful with OpenAI client")
-            
-            # Проверяем валидность перевода
-            if is_valid_translation(text, translated_text, source_lang, target_lang):
-                return translated_text, model, None
-            else:
-                return None, model, "Invalid translation: output too similar to input"
+            logger.info(f"Completion successful with OpenAI client")
+            return completion.choices[0].message.content, None, completion.usage
             
+        except RateLimitError as rate_error:
+            # Повтор через raw HTTP только усилил бы перегрузку
+            await ratelimit.penalize(model, rate_error.response.headers)
+            return None, f"Rate limited by OpenRouter: {str(rate_error)}", None
         except Exception as openai_error:
-            # Если получили ошибку с OpenAI клиентом, логируем и пробуем через requests
-            logger.warning(f"OpenAI client error: {str(openai_error)}. Trying with requests...")
+            # Если получили ошибку с OpenAI клиентом, логируем и пробуем напрямую через HTTP
+            logger.warning(f"OpenAI client error: {str(openai_error)}. Trying with raw HTTP...")
             
-            # Если клиент OpenAI не работает, используем requests напрямую
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": site_url,
-                    "X-Title": site_name,
-                },
-                json={
-                    "model": model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                },
-                timeout=30
+            # Запасной путь использует тот же пул соединений, что и клиент OpenAI
+            response = await transport.post_chat_completion(
+                {"model": model, "messages": messages},
+                api_key,
+                site_url,
+                site_name
             )
             
             if response.status_code == 200:
                 response_data = response.json()
-                logger.debug(f"API response data: {response_data}")
                 
                 if 'choices' in response_data and len(response_data['choices']) > 0:
                     if 'message' in response_data['choices'][0] and 'content' in response_data['choices'][0]['message']:
-                        translated_text = response_data['choices'][0]['message']['content']
-                        logger.info("Translation successful with requests")
-                        
-                        # Проверяем валидность перевода
-                        if is_valid_translation(text, translated_text, source_lang, target_lang):
-                            return translated_text, model, None
-                        else:
-                            return None, model, "Invalid translation: output too similar to input"
+                        logger.info("Completion successful with raw HTTP")
+                        return response_data['choices'][0]['message']['content'], None, response_data.get('usage')
                 
                 # Если не удалось найти текст перевода в ответе
                 error_msg = f"Unexpected response structure: {response_data}"
                 logger.error(error_msg)
-                return None, model, error_msg
+                return None, error_msg, None
+            elif response.status_code == 429:
+                await ratelimit.penalize(model, response.headers)
+                return None, f"Rate limited by OpenRouter: {response.text}", None
             else:
                 error_msg = f"OpenRouter API returned status code {response.status_code}: {response.text}"
                 logger.error(error_msg)
-                return None, model, error_msg
+                return None, error_msg, None
             
     except Exception as e:
         error_msg = f"Error during translation: {str(e)}"
         logger.error(error_msg)
-        return None, model, error_msg
+        return None, error_msg, None
+
+async def perform_translation(text, source_lang, target_lang, model, api_key, site_url, site_name, context=None,
+                              references=None):
+    """
+    Выполняет перевод с помощью указанной модели.
+    context - предшествующий текст документа, передаётся модели только для связности;
+    references - образцы перевода похожих предложений
+    """
+    # Шаблон промпта зависит от модели (см. prompts.PROMPT_TEMPLATES)
+    messages = prompts.build_messages(model, text, source_lang, target_lang, context, references)
+    translated_text, error = await request_completion(messages, model, api_key, site_url, site_name)
+    if error:
+        return None, model, error
+    
+    # Проверяем валидность перевода
+    reason = validate_translation(text, translated_text, source_lang, target_lang)
+    if reason:
+        return None, model, f"Invalid translation: {reason}"
+    return translated_text, model, None
+
+async def translate_with_models(text, source_language, target_language, strategy, api_key, site_url, site_name,
+                                context=None):
+    """
+    Переводит один текст: кеш -> память переводов -> порядок моделей от роутера -> обход моделей по стратегии.
+    Возвращает (результат или None, список ошибок)
+    """
+    # Повторяющиеся запросы отдаём из кеша без обращения к LLM
+    cache_key = make_key(text, source_language, target_language, PROMPT_VERSION)
+    if translation_cache is not None:
+        cached, tier = await translation_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Cache hit ({tier}) for {source_language} to {target_language}")
+            return {**cached, "cached": True, "cache_tier": tier}, []
+    
+    # Контекст меняет промпт, поэтому входит в ключ вместе с ключом кеша
+    return await inflight.do(
+        (cache_key, context),
+        lambda: _translate_uncached(
+            text, source_language, target_language, strategy, api_key, site_url, site_name, context, cache_key
+        )
+    )
+
+def recorded(attempt, pair):
+    """
+    Оборачивает попытку пакетного и многоязычного перевода: исход и задержка
+    каждого вызова модели уходят в роутер, как и в обычном переводе
+    """
+    async def wrapped(model):
+        started = time.perf_counter()
+        result = await attempt(model)
+        model_router.record(model, pair, time.perf_counter() - started, classify(result[2]))
+        return result
+    return wrapped
+
+async def _translate_uncached(text, source_language, target_language, strategy, api_key, site_url, site_name,
+                              context, cache_key):
+    """
+    Перевод, которого нет в кеше: память переводов и обход моделей
+    """
+    remembered, references = await memory_lookup(text, source_language, target_language, cache_key)
+    if remembered is not None:
+        return remembered, []
+    
+    pair = model_router.pair_key(source_language, target_language)
+    
+    async def attempt(model):
+        started = time.perf_counter()
+        result = await perform_translation(
+            text, 
+            source_language, 
+            target_language,
+            model, 
+            api_key, 
+            site_url, 
+            site_name,
+            context,
+            references
+        )
+        model_router.record(model, pair, time.perf_counter() - started, classify(result[2]))
+        return result
+    
+    # Порядок моделей выбирает роутер по живой статистике
+    translated_text, used_model, errors, report = await dispatch.dispatch(
+        model_router.order(LLM_MODELS, pair), attempt, strategy
+    )
+    logger.info(f"Dispatch report: {report}")
+    
+    if not translated_text:
+        return None, errors
+    
+    result = {"translated_text": translated_text, "model_used": used_model}
+    await store_translation(text, source_language, target_language, cache_key, result)
+    return {**result, "cached": False, "strategy": report["strategy"]}, errors
+
+async def memory_lookup(text, source_language, target_language, cache_key):
+    """
+    Текст, совпадающий с переведённым раньше, отдаём из памяти переводов, похожие предложения
+    передаём модели как образец. Возвращает (результат или None, образцы)
+    """
+    if translation_memory is None:
+        return None, None
+    remembered, references = await asyncio.to_thread(
+        translation_memory.lookup, text, source_language, target_language
+    )
+    if remembered is None:
+        return None, references
+    logger.info(f"Translation memory match for {source_language} to {target_language}")
+    result = {"translated_text": remembered, "model_used": "translation memory"}
+    if translation_cache is not None:
+        await translation_cache.set(cache_key, result)
+    return {**result, "cached": True, "cache_tier": "translation_memory"}, None
+
+async def store_translation(text, source_language, target_language, cache_key, result):
+    """Сохраняет новый перевод в кеш и память переводов"""
+    if translation_cache is not None:
+        await translation_cache.set(cache_key, result)
+    if translation_memory is not None:
+        await asyncio.to_thread(
+            translation_memory.add, text, result["translated_text"], source_language, target_language
+        )
+
+def after_translation(text, source_language, target_language, result):
+    """
+    Успешный перевод одного текста: запись в журнал запросов для прогрева и, для нового перевода,
+    обратное направление в кеш - его запросит кнопка смены языков в интерфейсе
+    """
+    if request_log is not None:
+        request_log.append(text, source_language, target_language)
+    if translation_cache is None or result.get("cached") or warmup.SPECULATIVE_REVERSE == "off":
+        return
+    # Объединённые запросы получают тот же результат, что и первый: обратное направление
+    # заказывает только первый из них, пока его задача не завершилась
+    reverse_key = make_key(result["translated_text"], target_language, source_language, PROMPT_VERSION)
+    if reverse_key in speculative_tasks:
+        return
+    if len(speculative_tasks) >= warmup.SPECULATIVE_PARALLELISM:
+        warmup.stats["reverse_skipped"] += 1
+        return
+    task = asyncio.ensure_future(
+        speculate_reverse(text, source_language, target_language, result["translated_text"], result["model_used"])
+    )
+    speculative_tasks[reverse_key] = task
+    task.add_done_callback(lambda done: speculative_tasks.pop(reverse_key, None))
+
+async def speculate_reverse(text, source_language, target_language, translated_text, model_used):
+    """Кладёт в кеш перевод translated_text обратно на исходный язык"""
+    # Фоновая работа не должна попадать в расход и очередь ограничителя клиента, запустившего перевод
+    ratelimit.client_id_var.set("background")
+    metrics.request_usage_var.set(metrics.new_request_usage())
+    try:
+        if warmup.SPECULATIVE_REVERSE == "seed":
+            # Исходный текст и есть перевод результата обратно: модель не нужна
+            await translation_cache.set(
+                make_key(translated_text, target_language, source_language, PROMPT_VERSION),
+                {"translated_text": text, "model_used": model_used}
+            )
+            warmup.stats["reverse_seeded"] += 1
+            return
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+        site_name = os.getenv("SITE_NAME", "LLM Translator")
+        result, _ = await translate_with_models(
+            translated_text, target_language, source_language, None, api_key, site_url, site_name
+        )
+        if result is not None and not result["cached"]:
+            warmup.stats["reverse_translated"] += 1
+    except Exception as e:
+        logger.warning(f"Speculative reverse translation failed: {str(e)}")
+
+async def warm_cache_once():
+    """Один проход прогрева кеша по журналу запросов (см. warmup)"""
+    entries = await asyncio.to_thread(warmup.top_entries, warmup.read_log(warmup.WARMUP_LOG_PATH))
+    # Модели вызывает один воркер; аренда живёт полпериода, но не меньше минуты
+    leader = await warmup.acquire_lease(state_store, max(60.0, warmup.WARMUP_INTERVAL / 2))
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+    site_name = os.getenv("SITE_NAME", "LLM Translator")
+    
+    async def lookup(text, source_language, target_language):
+        cached, _ = await translation_cache.load(make_key(text, source_language, target_language, PROMPT_VERSION))
+        return cached is not None
+    
+    async def translate_pair(source_language, target_language, texts):
+        request = BatchTranslationRequest(segments=texts, source_language=source_language,
+                                          target_language=target_language)
+        result = await translate_segments_batched(request, api_key, site_url, site_name)
+        return sum(1 for t in result["translations"] if t["translated_text"] is not None)
+    
+    stats = await warmup.warm_cache(entries, lookup, translate_pair, translate=leader and bool(api_key))
+    logger.info(f"Cache warm-up finished: {stats}")
+
+def raise_if_rate_limited(errors):
+    """
+    Если все модели отказали из-за квот, клиент получает 429 с временем повтора, а не 500
+    """
+    if errors and all(error.split(": ", 1)[-1].startswith("Rate limited") for error in errors):
+        retry_after = ratelimit.retry_after_hint(LLM_MODELS)
+        raise HTTPException(
+            status_code=429,
+            detail="All models are rate limited, retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+async def translate_document(request, api_key, site_url, site_name, on_progress=None):
+    """
+    Переводит длинный текст по фрагментам и собирает результат в исходном порядке
+    """
+    chunks = chunking.split_document(request.text)
+    logger.info(f"Document mode: {len(request.text)} chars split into {len(chunks)} chunks")
+    
+    async def translate_fn(text, context):
+        result, errors = await translate_with_models(
+            text, request.source_language, request.target_language, request.strategy,
+            api_key, site_url, site_name, context
+        )
+        if result is None:
+            return None, None, errors
+        return result["translated_text"], result["model_used"], errors
+    
+    translations, models, failed = await chunking.translate_chunks(chunks, translate_fn, on_progress=on_progress)
+    if failed:
+        logger.error(f"Document translation failed for chunks {failed} of {len(chunks)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get valid translation for {len(failed)} of {len(chunks)} chunks"
+        )
+    
+    return {
+        "translated_text": chunking.assemble(chunks, translations),
+        "model_used": ", ".join(sorted(set(models.values()))) or "none",
+        "cached": False,
+        "chunks": len(chunks),
+    }
 
 @app.post("/translate")
 async def translate_text(request: TranslationRequest):
@@ -229,35 +584,40 @@ async def translate_text(request: TranslationRequest):
         
         logger.info(f"Using site URL: {site_url}, site name: {site_name}")
         
-        # Попытка перевести текст, используя разные модели, если требуется
-        errors = []
+        if request.strategy and request.strategy.lower() not in dispatch.STRATEGIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown strategy: {request.strategy}. Available: {', '.join(dispatch.STRATEGIES)}"
+            )
+        if request.mode not in TRANSLATION_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown mode: {request.mode}. Available: {', '.join(TRANSLATION_MODES)}"
+            )
         
         # Если языки совпадают, не выполняем перевод
         if request.source_language.lower() == request.target_language.lower():
-            return {"translated_text": request.text, "model_used": "none (same language)"}
+            return {"translated_text": request.text, "model_used": "none (same language)", "cached": False}
         
-        for model in LLM_MODELS:
-            translated_text, used_model, error = await perform_translation(
-                request.text, 
-                request.source_language, 
-                request.target_language,
-                model, 
-                api_key, 
-                site_url, 
-                site_name
-            )
-            
-            if translated_text:
-                # Успешный перевод
-                return {"translated_text": translated_text, "model_used": used_model}
-            
-            # Сохраняем ошибку для логирования
-            errors.append(f"Model {model}: {error}")
-            logger.warning(f"Translation with {model} failed: {error}. Trying next model.")
+        # Длинные тексты переводим по фрагментам
+        if request.mode == "document" or (
+            request.mode == "auto" and len(request.text) > chunking.DOCUMENT_AUTO_CHARS
+        ):
+            return await translate_document(request, api_key, site_url, site_name)
+        
+        result, errors = await translate_with_models(
+            request.text, request.source_language, request.target_language, request.strategy,
+            api_key, site_url, site_name
+        )
+        if result:
+            # Успешный перевод
+            after_translation(request.text, request.source_language, request.target_language, result)
+            return result
         
         # Если все модели не смогли выполнить правильный перевод
         all_errors = "\n".join(errors)
         logger.error(f"All translation attempts failed:\n{all_errors}")
+        raise_if_rate_limited(errors)
         raise HTTPException(status_code=500, detail="Failed to get valid translation from any model")
         
     except HTTPException as he:
@@ -270,6 +630,686 @@ async def translate_text(request: TranslationRequest):
         logger.error(f"Traceback: {error_traceback}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_result(result):
+    """События delta и done для перевода, полученного не потоком (кеш, память, документ)"""
+    done = {key: value for key, value in result.items() if key != "translated_text"}
+    return sse_event("delta", {"text": result["translated_text"]}) + sse_event("done", done)
+
+async def stream_translation_events(request, api_key, site_url, site_name):
+    """
+    Генерирует server-sent events с переводом по мере его получения от модели.
+
+    События: model (начата попытка с моделью), delta (очередной фрагмент текста),
+    reset (уже отправленный текст нужно отбросить - модель не прошла проверку),
+    progress (переведено фрагментов документа), done (перевод завершён),
+    error (ни одна модель не справилась).
+    """
+    if request.source_language.lower() == request.target_language.lower():
+        yield sse_event("delta", {"text": request.text})
+        yield sse_event("done", {"model_used": "none (same language)", "cached": False})
+        return
+    
+    # Длинные тексты переводим по фрагментам, как /translate, и сообщаем о прогрессе
+    if request.mode == "document" or (
+        request.mode == "auto" and len(request.text) > chunking.DOCUMENT_AUTO_CHARS
+    ):
+        async for event in stream_document_events(request, api_key, site_url, site_name):
+            yield event
+        return
+    
+    cache_key = make_key(request.text, request.source_language, request.target_language, PROMPT_VERSION)
+    if translation_cache is not None:
+        cached, tier = await translation_cache.get(cache_key)
+        if cached is not None:
+            after_translation(request.text, request.source_language, request.target_language, {**cached, "cached": True})
+            yield sse_result({**cached, "cached": True, "cache_tier": tier})
+            return
+    
+    # Тот же текст уже переводится - ждём общий результат, как /translate
+    flight = inflight.lead((cache_key, None))
+    if flight is None:
+        result, errors = await inflight.do(
+            (cache_key, None),
+            lambda: _translate_uncached(
+                request.text, request.source_language, request.target_language, request.strategy,
+                api_key, site_url, site_name, None, cache_key
+            )
+        )
+        if result is None:
+            logger.error("Coalesced streaming translation failed")
+            yield sse_event("error", {"detail": "Failed to get valid translation from any model"})
+            return
+        after_translation(request.text, request.source_language, request.target_language, result)
+        yield sse_result(result)
+        return
+    
+    # Поток сам выполняет перевод и отдаёт результат запросам, присоединившимся к нему
+    result, errors = None, []
+    try:
+        remembered, references = await memory_lookup(
+            request.text, request.source_language, request.target_language, cache_key
+        )
+        if remembered is not None:
+            result = remembered
+            yield sse_result(result)
+            return
+        async for event in stream_from_models(request, api_key, site_url, site_name, references, errors):
+            if isinstance(event, dict):
+                result = event
+            else:
+                yield event
+        if result is None:
+            logger.error("All streaming translation attempts failed")
+            yield sse_event("error", {"detail": "Failed to get valid translation from any model"})
+            return
+        await store_translation(request.text, request.source_language, request.target_language, cache_key,
+                                {"translated_text": result["translated_text"], "model_used": result["model_used"]})
+        after_translation(request.text, request.source_language, request.target_language, result)
+        yield sse_event("done", {"model_used": result["model_used"], "cached": False,
+                                 "usage": metrics.request_usage_var.get()})
+    finally:
+        # Завершаем общий вызов и при обрыве соединения клиентом, иначе присоединившиеся ждали бы вечно
+        if not flight.done():
+            flight.set_result((result, errors))
+
+async def stream_from_models(request, api_key, site_url, site_name, references, errors):
+    """
+    Обходит модели в порядке роутера, отдавая события model/delta/reset. Последним
+    элементом отдаёт результат (словарь), если какая-то модель справилась; ошибки
+    попыток дописываются в errors
+    """
+    pair = model_router.pair_key(request.source_language, request.target_language)
+    client = openai_client(api_key)
+    
+    for model in model_router.order(LLM_MODELS, pair):
+        messages = prompts.build_messages(
+            model, request.text, request.source_language, request.target_language, None, references
+        )
+        cost = ratelimit.estimate_cost(messages)
+        if not await ratelimit.acquire(model, cost):
+            logger.warning(f"Streaming translation with {model} skipped: local rate limit")
+            errors.append(f"{model}: Rate limited: local quota for {model} exhausted")
+            continue
+        yield sse_event("model", {"model": model})
+        started = time.perf_counter()
+        parts = []
+        emitted = 0
+        error = None
+        usage = None
+        try:
+            stream = await client.chat.completions.create(
+                extra_headers={
+                    "HTTP-Referer": site_url,
+                    "X-Title": site_name,
+                },
+                model=model,
+                messages=messages,
+                stream=True
+            )
+            try:
+                async for chunk in stream:
+                    # OpenRouter присылает usage в последнем фрагменте потока
+                    usage = getattr(chunk, "usage", None) or usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    translated_text = "".join(parts)
+                    if not emitted:
+                        # Пока не набран префикс, ничего не отправляем клиенту
+                        if len(translated_text) < STREAM_VALIDATION_CHARS:
+                            continue
+                        pattern = validation.find_meta_commentary(translated_text, request.text)
+                        if pattern:
+                            # Прерываем поток сразу и переходим к следующей модели
+                            error = f"Invalid translation: meta commentary matching {pattern} in stream"
+                            break
+                    yield sse_event("delta", {"text": translated_text[emitted:]})
+                    emitted = len(translated_text)
+            finally:
+                await stream.close()
+        except RateLimitError as rate_error:
+            await ratelimit.penalize(model, rate_error.response.headers)
+            error = f"Rate limited by OpenRouter: {str(rate_error)}"
+        except Exception as e:
+            error = f"Error during streaming translation: {str(e)}"
+        
+        metrics.record_usage(model, usage, prompts.estimate_prompt_tokens(messages))
+        await ratelimit.settle(model, cost, usage)
+        translated_text = "".join(parts)
+        if not error:
+            reason = validate_translation(
+                request.text, translated_text, request.source_language, request.target_language
+            )
+            if reason:
+                error = f"Invalid translation: {reason}"
+        elapsed = time.perf_counter() - started
+        outcome = classify(error)
+        model_router.record(model, pair, elapsed, outcome)
+        metrics.UPSTREAM_LATENCY.labels(model=model, outcome=outcome).observe(elapsed)
+        
+        if error:
+            logger.warning(f"Streaming translation with {model} failed: {error}. Trying next model.")
+            errors.append(f"{model}: {error}")
+            if emitted:
+                yield sse_event("reset", {"model": model, "reason": error})
+            continue
+        
+        if emitted < len(translated_text):
+            yield sse_event("delta", {"text": translated_text[emitted:]})
+        yield {"translated_text": translated_text, "model_used": model, "cached": False}
+        return
+
+async def stream_document_events(request, api_key, site_url, site_name):
+    """События progress по мере перевода фрагментов документа, затем весь перевод одним delta"""
+    progress = asyncio.Queue()
+    
+    async def on_progress(done, total):
+        await progress.put((done, total))
+    
+    task = asyncio.ensure_future(translate_document(request, api_key, site_url, site_name, on_progress=on_progress))
+    try:
+        while not task.done():
+            waiter = asyncio.ensure_future(progress.get())
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if waiter.done():
+                done, total = waiter.result()
+                yield sse_event("progress", {"done": done, "total": total})
+            else:
+                waiter.cancel()
+        result = task.result()
+    except HTTPException as e:
+        logger.error(f"Streaming document translation failed: {e.detail}")
+        yield sse_event("error", {"detail": e.detail})
+        return
+    finally:
+        # Клиент отключился - фрагменты больше переводить незачем
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    yield sse_result(result)
+
+@app.post("/translate/stream")
+async def translate_stream(request: TranslationRequest):
+    """
+    Потоковый перевод через server-sent events
+    """
+    logger.info(f"Streaming translation request: {request.source_language} to {request.target_language}")
+    
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        logger.error("API key not found")
+        raise HTTPException(status_code=500, detail="API key not configured")
+    
+    site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+    site_name = os.getenv("SITE_NAME", "LLM Translator")
+    
+    if request.strategy and request.strategy.lower() not in dispatch.STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown strategy: {request.strategy}. Available: {', '.join(dispatch.STRATEGIES)}"
+        )
+    # Поток идёт от одной модели за раз: hedged и race до первого токена не реализованы
+    if request.strategy and request.strategy.lower() != "sequential":
+        raise HTTPException(
+            status_code=422,
+            detail=f"Strategy {request.strategy} is not supported for streaming. Available: sequential"
+        )
+    if request.mode not in TRANSLATION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown mode: {request.mode}. Available: {', '.join(TRANSLATION_MODES)}"
+        )
+    
+    return StreamingResponse(
+        stream_translation_events(request, api_key, site_url, site_name),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def translate_segments_batched(request, api_key, site_url, site_name, on_progress=None):
+    """
+    Переводит сегменты пакетного запроса: кеш по каждому сегменту, остальное - пакетами
+    """
+    translations = [
+        {"index": index, "translated_text": None, "model_used": None, "cached": False, "error": None}
+        for index in range(len(request.segments))
+    ]
+    
+    # Пустые сегменты и совпадающие языки не требуют перевода
+    same_language = request.source_language.lower() == request.target_language.lower()
+    pending = {}
+    keys = {}
+    for index, text in enumerate(request.segments):
+        if same_language or not text.strip():
+            translations[index].update(translated_text=text, model_used="none (same language)" if same_language else "none")
+            continue
+        keys[index] = make_key(text, request.source_language, request.target_language, PROMPT_VERSION)
+        if translation_cache is not None:
+            cached, _ = await translation_cache.get(keys[index])
+            if cached is not None:
+                translations[index].update(cached, cached=True)
+                continue
+        pending[index] = text
+    
+    stats = {"segments": len(request.segments), "cached": sum(1 for t in translations if t["cached"]),
+             "upstream_batches": 0, "rounds": 0}
+    
+    if pending:
+        pair = model_router.pair_key(request.source_language, request.target_language)
+        
+        async def complete(messages, model):
+            return await request_completion(messages, model, api_key, site_url, site_name)
+        
+        def validate(source, translated):
+            return is_valid_translation(source, translated, request.source_language, request.target_language)
+        
+        async def dispatch_fn(models, attempt):
+            return await dispatch.dispatch(models, recorded(attempt, pair), request.strategy)
+        
+        results, batch_stats = await batch.translate_segments(
+            pending, request.source_language, request.target_language,
+            complete, validate, model_router.order(LLM_MODELS, pair), dispatch_fn,
+            on_progress=on_progress
+        )
+        stats.update(batch_stats)
+        
+        for index in pending:
+            if index in results:
+                translated_text, model = results[index]
+                result = {"translated_text": translated_text, "model_used": model}
+                translations[index].update(result)
+                if translation_cache is not None:
+                    await translation_cache.set(keys[index], result)
+            else:
+                translations[index]["error"] = "Failed to get valid translation from any model"
+    
+    stats["failed"] = sum(1 for t in translations if t["error"])
+    logger.info(f"Batch translation finished: {stats}")
+    return {"translations": translations, "stats": stats}
+
+@app.post("/translate/batch")
+async def translate_batch(request: BatchTranslationRequest):
+    """
+    Переводит список сегментов, упаковывая их в небольшое число запросов к LLM
+    """
+    logger.info(f"Batch translation request: {len(request.segments)} segments, "
+                f"{request.source_language} to {request.target_language}")
+    
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        logger.error("API key not found")
+        raise HTTPException(status_code=500, detail="API key not configured")
+    
+    if len(request.segments) > batch.BATCH_MAX_REQUEST_SEGMENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many segments: {len(request.segments)} > {batch.BATCH_MAX_REQUEST_SEGMENTS}"
+        )
+    if request.strategy and request.strategy.lower() not in dispatch.STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown strategy: {request.strategy}. Available: {', '.join(dispatch.STRATEGIES)}"
+        )
+    
+    site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+    site_name = os.getenv("SITE_NAME", "LLM Translator")
+    
+    return await translate_segments_batched(request, api_key, site_url, site_name)
+
+async def translate_multi_target(request, api_key, site_url, site_name):
+    """
+    Переводит текст на несколько языков: кеш по каждому языку, остальное - общим промптом на все языки сразу
+    """
+    started = time.perf_counter()
+    # Повторяющиеся языки (без учёта регистра и пробелов) переводятся один раз, в написании первого упоминания
+    unique = {}
+    for language in request.target_languages:
+        if language.strip():
+            unique.setdefault(language.strip().lower(), language.strip())
+    targets = list(unique.values())
+    translations = {
+        language: {"target_language": language, "translated_text": None, "model_used": None, "cached": False,
+                   "elapsed_s": None, "error": None}
+        for language in targets
+    }
+    
+    pending = []
+    for language in targets:
+        if request.source_language.lower() == language.lower():
+            translations[language].update(translated_text=request.text, model_used="none (same language)", elapsed_s=0.0)
+            continue
+        if translation_cache is not None:
+            cached, _ = await translation_cache.get(
+                make_key(request.text, request.source_language, language, PROMPT_VERSION)
+            )
+            if cached is not None:
+                translations[language].update(cached, cached=True, elapsed_s=round(time.perf_counter() - started, 3))
+                continue
+        pending.append(language)
+    
+    stats = {"targets": len(targets), "cached": sum(1 for t in translations.values() if t["cached"]),
+             "combined_calls": 0, "retried": 0}
+    errors = []
+    
+    if pending:
+        # Общий вызов идёт на все языки сразу, порядок моделей берётся по первой языковой паре
+        pair = model_router.pair_key(request.source_language, pending[0])
+        
+        async def complete(messages, model):
+            return await request_completion(messages, model, api_key, site_url, site_name)
+        
+        def validate(language, translated):
+            return is_valid_translation(request.text, translated, request.source_language, language)
+        
+        async def dispatch_fn(models, attempt):
+            return await dispatch.dispatch(models, recorded(attempt, pair), request.strategy)
+        
+        async def translate_one(language):
+            # Обычный путь перевода: кеш, память переводов, объединение запросов, обход моделей
+            if len(request.text) > chunking.DOCUMENT_AUTO_CHARS:
+                single = TranslationRequest(text=request.text, source_language=request.source_language,
+                                            target_language=language, strategy=request.strategy)
+                try:
+                    result = await translate_document(single, api_key, site_url, site_name)
+                except HTTPException as e:
+                    return None, None, [str(e.detail)]
+                return result["translated_text"], result["model_used"], []
+            result, single_errors = await translate_with_models(
+                request.text, request.source_language, language, request.strategy, api_key, site_url, site_name
+            )
+            if result is None:
+                return None, None, single_errors
+            return result["translated_text"], result["model_used"], single_errors
+        
+        results, errors, multi_stats = await multitarget.translate_targets(
+            request.text, request.source_language, pending, complete, validate,
+            model_router.order(LLM_MODELS, pair), dispatch_fn, translate_one
+        )
+        stats.update(multi_stats)
+        
+        for language in pending:
+            if language in results:
+                translated_text, model, elapsed = results[language]
+                result = {"translated_text": translated_text, "model_used": model}
+                translations[language].update(result, elapsed_s=round(elapsed, 3))
+                if translation_cache is not None:
+                    await translation_cache.set(
+                        make_key(request.text, request.source_language, language, PROMPT_VERSION), result
+                    )
+            else:
+                translations[language]["error"] = "Failed to get valid translation from any model"
+    
+    failed = [language for language, t in translations.items() if t["error"]]
+    if failed and len(failed) == len(targets):
+        raise_if_rate_limited(errors)
+    stats.update(failed=len(failed), elapsed_s=round(time.perf_counter() - started, 3))
+    logger.info(f"Multi-target translation finished: {stats}")
+    return {"translations": list(translations.values()), "stats": stats}
+
+@app.post("/translate/multi")
+async def translate_multi(request: MultiTargetTranslationRequest):
+    """
+    Переводит один текст сразу на несколько языков
+    """
+    logger.info(f"Multi-target translation request: {request.source_language} to "
+                f"{len(request.target_languages)} languages")
+    
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        logger.error("API key not found")
+        raise HTTPException(status_code=500, detail="API key not configured")
+    
+    if not request.target_languages:
+        raise HTTPException(status_code=400, detail="At least one target language is required")
+    if len(request.target_languages) > multitarget.MULTI_MAX_TARGETS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many target languages: {len(request.target_languages)} > {multitarget.MULTI_MAX_TARGETS}"
+        )
+    if request.strategy and request.strategy.lower() not in dispatch.STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown strategy: {request.strategy}. Available: {', '.join(dispatch.STRATEGIES)}"
+        )
+    
+    site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+    site_name = os.getenv("SITE_NAME", "LLM Translator")
+    
+    return await translate_multi_target(request, api_key, site_url, site_name)
+
+async def spool_upload(request):
+    """
+    Принимает тело запроса по частям во временный файл, проверяя размер и кодировку UTF-8.
+    Небольшие файлы остаются в памяти, большие уходят на диск (см. fileformats.FILE_SPOOL_BYTES)
+    """
+    upload = tempfile.SpooledTemporaryFile(max_size=fileformats.FILE_SPOOL_BYTES, mode="w+",
+                                           encoding="utf-8", newline="")
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > fileformats.FILE_MAX_BYTES:
+                raise HTTPException(status_code=413,
+                                    detail=f"File too large: more than {fileformats.FILE_MAX_BYTES} bytes")
+            upload.write(decoder.decode(chunk))
+        upload.write(decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        upload.close()
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded text")
+    except BaseException:
+        upload.close()
+        raise
+    upload.seek(0)
+    return upload, received
+
+async def stream_file_translation(upload, parse, source_language, target_language, strategy,
+                                  api_key, site_url, site_name):
+    """
+    Переводит разобранный файл окнами сегментов и отдаёт результат по частям.
+    Сегмент, который не удалось перевести, остаётся в исходном виде
+    """
+    started = time.perf_counter()
+    stats = {}
+
+    async def translate_window(texts):
+        # Повторы внутри окна (одинаковые реплики, строки интерфейса) переводятся один раз
+        unique = list(dict.fromkeys(texts))
+        window = BatchTranslationRequest(segments=unique, source_language=source_language,
+                                         target_language=target_language, strategy=strategy)
+        result = await translate_segments_batched(window, api_key, site_url, site_name)
+        translated = {text: t["translated_text"] for text, t in zip(unique, result["translations"])}
+        return [translated[text] for text in texts]
+
+    try:
+        async for part in fileformats.translate_pieces(parse(upload), translate_window, stats):
+            yield part
+    except Exception as e:
+        # Ответ уже начат, статус изменить нельзя: клиент получит обрезанный файл
+        logger.error(f"File translation aborted: {str(e)}")
+        raise
+    finally:
+        upload.close()
+        stats.update(elapsed_s=round(time.perf_counter() - started, 3), usage=metrics.request_usage_var.get())
+        logger.info(f"File translation finished: {stats}")
+
+@app.post("/translate/file")
+async def translate_file(request: Request, source_language: str, target_language: str,
+                         filename: Optional[str] = None, file_format: Optional[str] = Query(None, alias="format"),
+                         strategy: Optional[str] = None):
+    """
+    Переводит загруженный файл (txt, md, srt, vtt, json, po) с сохранением формата.
+    Файл передаётся телом запроса как есть, параметры - в строке запроса; результат отдаётся потоком
+    """
+    logger.info(f"File translation request: {filename or 'unnamed'}, {source_language} to {target_language}")
+
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        logger.error("API key not found")
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    detected = fileformats.detect_format(filename, file_format)
+    if detected is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file format: {file_format or filename}. Available: {', '.join(fileformats.FORMATS)}"
+        )
+    if request.headers.get("content-length", "").isdigit() and \
+            int(request.headers["content-length"]) > fileformats.FILE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large: more than {fileformats.FILE_MAX_BYTES} bytes")
+    if strategy and strategy.lower() not in dispatch.STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown strategy: {strategy}. Available: {', '.join(dispatch.STRATEGIES)}"
+        )
+
+    site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+    site_name = os.getenv("SITE_NAME", "LLM Translator")
+
+    upload, size = await spool_upload(request)
+    logger.info(f"File received: {size} bytes, format {detected}")
+    parse, media_type = fileformats.FORMATS[detected]
+    download_name = fileformats.translated_filename(filename, target_language, detected)
+    return StreamingResponse(
+        stream_file_translation(upload, parse, source_language, target_language, strategy,
+                                api_key, site_url, site_name),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(download_name)}"}
+    )
+
+def _job_credentials():
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise RuntimeError("API key not configured")
+    site_url = os.getenv("SITE_URL", "http://llm-translator.example.com")
+    site_name = os.getenv("SITE_NAME", "LLM Translator")
+    return api_key, site_url, site_name
+
+async def run_translate_job(payload, progress):
+    """
+    Задание перевода текста: всегда через фрагменты, чтобы был виден прогресс
+    """
+    request = TranslationRequest(**payload)
+    if request.source_language.lower() == request.target_language.lower():
+        return {"translated_text": request.text, "model_used": "none (same language)", "cached": False}
+    return await translate_document(request, *_job_credentials(), on_progress=progress)
+
+async def run_batch_job(payload, progress):
+    request = BatchTranslationRequest(**payload)
+    return await translate_segments_batched(request, *_job_credentials(), on_progress=progress)
+
+def _job_view(job):
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "priority": job["lane"],
+        "status": job["status"],
+        "progress": {"done": job["progress_done"], "total": job["progress_total"]},
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: JobRequest):
+    """
+    Ставит перевод в очередь и сразу возвращает идентификатор задания
+    """
+    if (request.text is None) == (request.segments is None):
+        raise HTTPException(status_code=400, detail="Exactly one of 'text' or 'segments' must be provided")
+    if request.priority not in jobs.LANES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority: {request.priority}. Available: {', '.join(jobs.LANES)}"
+        )
+    if request.strategy and request.strategy.lower() not in dispatch.STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown strategy: {request.strategy}. Available: {', '.join(dispatch.STRATEGIES)}"
+        )
+    if request.segments is not None and len(request.segments) > batch.BATCH_MAX_REQUEST_SEGMENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many segments: {len(request.segments)} > {batch.BATCH_MAX_REQUEST_SEGMENTS}"
+        )
+    if not os.getenv("OPENROUTER_API_KEY"):
+        logger.error("API key not found")
+        raise HTTPException(status_code=500, detail="API key not configured")
+    
+    kind = "translate" if request.text is not None else "batch"
+    payload = request.model_dump(exclude={"priority", "segments" if kind == "translate" else "text"}, exclude_none=True)
+    try:
+        job_id = await job_queue.submit(kind, payload, request.priority)
+    except jobs.QueueFull as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    logger.info(f"Job {job_id} queued ({kind}, {request.priority})")
+    return {"job_id": job_id, "status": jobs.QUEUED}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_view(job)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != jobs.DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}, result is not available")
+    return json.loads(job["result"])
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    status = await job_queue.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if translation_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await translation_cache.get_stats()}
+
+@app.get("/memory/stats")
+async def memory_stats():
+    if translation_memory is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(translation_memory.get_stats)}
+
+@app.get("/warmup/stats")
+async def warmup_stats():
+    return warmup.get_stats()
+
+@app.get("/dispatch/stats")
+async def dispatch_stats():
+    return {**dispatch.get_stats(), "coalescing": inflight.get_stats()}
+
+@app.get("/router/stats")
+async def router_stats():
+    return model_router.get_stats()
+
+@app.get("/ratelimit/stats")
+async def ratelimit_stats():
+    return await ratelimit.get_stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Метрики в формате Prometheus
+    """
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
     # Check if API key is available
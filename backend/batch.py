@@ -0,0 +1,117 @@
+"""
+Пакетный перевод: много коротких сегментов упаковываются в несколько
+ограниченных по размеру промптов с пронумерованными разделителями.
+
+Ответ модели разбирается по идентификаторам, каждый сегмент проверяется
+отдельно, и повторно отправляются только сегменты, не прошедшие проверку.
+"""
+import asyncio
+import logging
+import os
+import re
+
+import prompts
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_CHARS = int(os.getenv("BATCH_MAX_CHARS", "4000"))
+BATCH_MAX_SEGMENTS = int(os.getenv("BATCH_MAX_SEGMENTS", "50"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+BATCH_MAX_ROUNDS = int(os.getenv("BATCH_MAX_ROUNDS", "3"))
+BATCH_MAX_REQUEST_SEGMENTS = int(os.getenv("BATCH_MAX_REQUEST_SEGMENTS", "5000"))
+
+_MARKER_RE = re.compile(r"<<<(\d+)>>>[ \t]*\n?(.*?)(?=<<<\d+>>>|\Z)", re.DOTALL)
+
+
+def pack_segments(items, max_chars=BATCH_MAX_CHARS, max_segments=BATCH_MAX_SEGMENTS):
+    """
+    Делит список (индекс, текст) на пакеты не длиннее max_chars символов
+    и не больше max_segments сегментов. Слишком длинный сегмент уходит отдельным пакетом.
+    """
+    batches, current, size = [], [], 0
+    for index, text in items:
+        if current and (size + len(text) > max_chars or len(current) >= max_segments):
+            batches.append(current)
+            current, size = [], 0
+        current.append((index, text))
+        size += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_response(content, expected=None):
+    """
+    Разбирает ответ модели в словарь {индекс: перевод}.
+    Если задан expected - индексы в порядке промпта, - маркеры ответа должны идти в том же
+    порядке без повторов и лишних номеров, иначе возвращается None: сегменты перепутаны
+    """
+    found = [(int(index), text.strip()) for index, text in _MARKER_RE.findall(content or "")]
+    if expected is not None:
+        positions = {index: position for position, index in enumerate(expected)}
+        order = [positions.get(index, -1) for index, _ in found]
+        if any(position < 0 for position in order) or any(a >= b for a, b in zip(order, order[1:])):
+            return None
+    return dict(found)
+
+
+async def translate_segments(segments, source_lang, target_lang, complete, validate, models, dispatch_fn,
+                             parallelism=BATCH_PARALLELISM, max_rounds=BATCH_MAX_ROUNDS, on_progress=None):
+    """
+    Переводит сегменты пакетами.
+
+    complete(messages, model) -> (content, error) - вызов модели;
+    validate(source, translated) -> bool - проверка одного сегмента;
+    dispatch_fn(models, attempt) - обход моделей (см. dispatch.dispatch);
+    on_progress(done, total) - необязательная корутина, вызывается после каждого пакета.
+
+    Возвращает (results, stats), где results - {индекс: (перевод, модель)}.
+    """
+    semaphore = asyncio.Semaphore(parallelism)
+    results = {}
+    stats = {"upstream_batches": 0, "rounds": 0}
+    pending = list(segments.items())
+
+    async def run_batch(batch):
+        async def attempt(model):
+            messages = prompts.build_batch_messages(model, batch, source_lang, target_lang)
+            content, error = await complete(messages, model)
+            if error:
+                return None, model, error
+            parsed = parse_batch_response(content, [index for index, _ in batch])
+            if parsed is None:
+                return None, model, "Invalid translation: batch markers out of order"
+            parsed = {
+                index: prompts.restore_markers(text, parsed[index]) for index, text in batch if index in parsed
+            }
+            valid = {
+                index: parsed[index] for index, text in batch
+                if index in parsed and validate(text, parsed[index])
+            }
+            if not valid:
+                return None, model, "Invalid translation: no valid segments in batch response"
+            return valid, model, None
+
+        async with semaphore:
+            stats["upstream_batches"] += 1
+            valid, model, errors, _ = await dispatch_fn(models, attempt)
+        if valid:
+            for index, text in valid.items():
+                results[index] = (text, model)
+            if on_progress is not None:
+                await on_progress(len(results), len(segments))
+        elif errors:
+            logger.warning(f"Batch of {len(batch)} segments failed: {errors[-1]}")
+
+    while pending and stats["rounds"] < max_rounds:
+        stats["rounds"] += 1
+        # В последнем раунде сегменты отправляются по одному, чтобы один сбойный
+        # сегмент не ломал разбор соседних
+        last_round = max_rounds > 1 and stats["rounds"] == max_rounds
+        batches = pack_segments(pending, max_segments=1 if last_round else BATCH_MAX_SEGMENTS)
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+        pending = [(index, text) for index, text in pending if index not in results]
+        if pending:
+            logger.info(f"Batch round {stats['rounds']}: {len(pending)} segments to re-issue")
+
+    return results, stats
@@ -0,0 +1,331 @@
+"""
+Кеш переводов с адресацией по содержимому.
+
+Ключ - хеш нормализованного текста, языковой пары и версии промпта.
+Первый уровень - LRU в памяти процесса с ограничением по байтам и TTL,
+второй (необязательный) - хранилище на диске, переживающее перезапуск контейнера.
+Второй уровень общий для всех воркеров: SQLite - на одной машине, Redis - на нескольких.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from state import REDIS_URL, STATE_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_DISK_BACKEND = os.getenv("CACHE_DISK_BACKEND", "sqlite").lower()
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "data/translation_cache.sqlite3")
+CACHE_DISK_MAX_ENTRIES = int(os.getenv("CACHE_DISK_MAX_ENTRIES", "200000"))
+
+# Записи SQLite, к которым обращались, обновляются пачкой раз в столько чтений (или секунд)
+DISK_TOUCH_BATCH = 200
+DISK_TOUCH_INTERVAL = 5.0
+# Число записей сравнивается с лимитом не реже, чем раз в столько записей; лишние удаляются с запасом в 10%
+DISK_EVICT_CHECK_EVERY = 1000
+# Память записи LRU сверх ключа и значения: кортеж, срок жизни, размер, узел OrderedDict
+# и ячейки хеш-таблиц (замерено tracemalloc для CPython 3.9-3.12)
+MEMORY_ENTRY_OVERHEAD = 300
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Убирает различия в пробелах, которые не влияют на перевод"""
+    return _WHITESPACE_RE.sub(" ", text.strip())
+
+
+def make_key(text, source_language, target_language, prompt_version):
+    """Ключ кеша: sha256 от версии промпта, языковой пары и нормализованного текста"""
+    raw = "\0".join([
+        prompt_version,
+        source_language.strip().lower(),
+        target_language.strip().lower(),
+        normalize_text(text),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _entry_size(key, value):
+    return (sys.getsizeof(key) + sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+            + MEMORY_ENTRY_OVERHEAD)
+
+
+class MemoryLRU:
+    """LRU в памяти процесса с ограничением по суммарному размеру и TTL записей"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, size, expires_at = item
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at=None):
+        size = _entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, size, expires_at or time.time() + self.ttl)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+
+class SQLiteTier:
+    """
+    Дисковый уровень кеша на SQLite. Вытесняет самые давно использованные записи.
+    Время обращения обновляется пачками, а лимит записей проверяется раз в DISK_EVICT_CHECK_EVERY
+    записей, поэтому чтение не пишет на диск, а запись не сортирует таблицу
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translations_accessed ON translations (accessed_at)")
+        self._conn.commit()
+        self._touched = {}  # key -> время последнего чтения, ещё не записанное в базу
+        self._touched_at = time.time()
+        self._writes = 0
+        # При маленьком лимите проверяем чаще, чтобы превышение оставалось в пределах 10%
+        self._evict_every = max(1, min(DISK_EVICT_CHECK_EVERY, max_entries // 10))
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            if row[1] < now:
+                # Просроченные записи удалит следующее вытеснение
+                return None, None
+            self._touched[key] = now
+            if len(self._touched) >= DISK_TOUCH_BATCH or now - self._touched_at >= DISK_TOUCH_INTERVAL:
+                self._flush_touched()
+        return json.loads(row[0]), row[1]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE translations SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()],
+            )
+            self._conn.commit()
+            self._touched.clear()
+        self._touched_at = time.time()
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now),
+            )
+            self._conn.commit()
+            self._touched.pop(key, None)
+            self._writes += 1
+            if self._writes % self._evict_every == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        """Удаляет просроченные записи и, если записей больше лимита, самые давно использованные"""
+        self._flush_touched()
+        self._conn.execute("DELETE FROM translations WHERE expires_at < ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        if count > self.max_entries:
+            excess = count - self.max_entries + self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM translations WHERE key IN ("
+                " SELECT key FROM translations ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+            logger.info(f"Disk cache evicted {excess} entries")
+        self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.close()
+
+
+class RedisTier:
+    """
+    Второй уровень кеша в Redis, общий для нескольких машин. Срок жизни записи задаёт TTL ключа,
+    а ограничение объёма - политика вытеснения самого Redis (maxmemory-policy), поэтому max_entries не используется
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_DISK_BACKEND=redis requires the redis package")
+        self.ttl = ttl
+        self._prefix = f"{STATE_KEY_PREFIX}cache:"
+        self._redis = redis.Redis.from_url(REDIS_URL)
+
+    def get(self, key):
+        with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(self._prefix + key)
+            pipe.ttl(self._prefix + key)
+            value, ttl = pipe.execute()
+        if value is None:
+            return None, None
+        return json.loads(value), time.time() + max(0, ttl)
+
+    def set(self, key, value):
+        self._redis.set(self._prefix + key, json.dumps(value, ensure_ascii=False), ex=max(1, int(self.ttl)))
+
+    def count(self):
+        return sum(1 for _ in self._redis.scan_iter(match=f"{self._prefix}*", count=1000))
+
+    def close(self):
+        self._redis.close()
+
+
+DISK_BACKENDS = {
+    "sqlite": SQLiteTier,
+    "redis": RedisTier,
+}
+
+
+class TranslationCache:
+    """Двухуровневый кеш: LRU в памяти + необязательный дисковый уровень"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, disk_backend=CACHE_DISK_BACKEND,
+                 db_path=CACHE_DB_PATH, disk_max_entries=CACHE_DISK_MAX_ENTRIES):
+        self.memory = MemoryLRU(max_bytes, ttl)
+        self.disk = None
+        self.stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "sets": 0}
+        if disk_backend in DISK_BACKENDS:
+            try:
+                self.disk = DISK_BACKENDS[disk_backend](db_path, ttl, disk_max_entries)
+            except Exception as e:
+                logger.error(f"Failed to open disk cache {db_path}: {str(e)}. Using memory cache only.")
+        elif disk_backend not in ("", "none"):
+            logger.warning(f"Unknown cache disk backend: {disk_backend}. Using memory cache only.")
+
+    async def get(self, key):
+        """Возвращает (значение, уровень) или (None, None)"""
+        value, tier = await self.load(key)
+        if value is None:
+            self.stats["misses"] += 1
+            metrics.CACHE_LOOKUPS.labels(result="miss").inc()
+            return None, None
+        self.stats[f"hits_{tier}"] += 1
+        metrics.CACHE_LOOKUPS.labels(result=tier).inc()
+        return value, tier
+
+    async def load(self, key):
+        """
+        Как get, но без учёта в статистике и метриках: для прогрева, который только
+        поднимает записи с диска в память и не должен менять долю попаданий
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        if self.disk is not None:
+            try:
+                value, expires_at = await asyncio.to_thread(self.disk.get, key)
+            except Exception as e:
+                # Недоступный дисковый уровень - промах, перевод всё равно выполнит модель
+                logger.warning(f"Disk cache read failed: {str(e)}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value, expires_at)
+                return value, "disk"
+        return None, None
+
+    async def set(self, key, value):
+        self.memory.set(key, value)
+        self.stats["sets"] += 1
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except Exception as e:
+                logger.warning(f"Disk cache write failed: {str(e)}")
+
+    async def get_stats(self):
+        hits = self.stats["hits_memory"] + self.stats["hits_disk"]
+        lookups = hits + self.stats["misses"]
+        stats = dict(self.stats)
+        stats.update({
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.bytes,
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_evictions": self.memory.evictions,
+            "disk_backend": type(self.disk).__name__ if self.disk is not None else None,
+            "disk_entries": await self._disk_count(),
+        })
+        return stats
+
+    async def _disk_count(self):
+        if self.disk is None:
+            return 0
+        try:
+            return await asyncio.to_thread(self.disk.count)
+        except Exception as e:
+            logger.warning(f"Disk cache count failed: {str(e)}")
+            return None
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
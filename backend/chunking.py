@@ -0,0 +1,135 @@
+"""
+Перевод длинных документов по частям.
+
+Текст делится по границам абзацев и предложений на фрагменты, укладывающиеся
+в бюджет токенов. Фрагменты переводятся параллельно (с ограничением), при
+ошибке повторно переводятся только неудавшиеся, а результат собирается в
+исходном порядке с сохранением разделителей между фрагментами.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_AUTO_CHARS = int(os.getenv("DOCUMENT_AUTO_CHARS", "6000"))
+DOCUMENT_CHUNK_TOKENS = int(os.getenv("DOCUMENT_CHUNK_TOKENS", "800"))
+DOCUMENT_PARALLELISM = int(os.getenv("DOCUMENT_PARALLELISM", "4"))
+DOCUMENT_MAX_ROUNDS = int(os.getenv("DOCUMENT_MAX_ROUNDS", "2"))
+DOCUMENT_OVERLAP_CHARS = int(os.getenv("DOCUMENT_OVERLAP_CHARS", "300"))
+
+# Грубая оценка: около 4 символов на токен для латиницы
+CHARS_PER_TOKEN = 4
+
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n\s*")
+_SENTENCE_RE = re.compile(r"(?<=[.!?。！？؟।])\s+")
+
+Chunk = namedtuple("Chunk", ["index", "text", "separator"])
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _split_keep(text, pattern):
+    """Делит текст по шаблону, возвращая пары (фрагмент, разделитель после него)"""
+    pieces, position = [], 0
+    for match in pattern.finditer(text):
+        pieces.append((text[position:match.start()], match.group(0)))
+        position = match.end()
+    pieces.append((text[position:], ""))
+    return pieces
+
+
+def _units(text, max_tokens):
+    """Минимальные единицы разбиения: абзацы, а для длинных абзацев - предложения"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    for paragraph, paragraph_sep in _split_keep(text, _PARAGRAPH_RE):
+        if estimate_tokens(paragraph) <= max_tokens:
+            yield paragraph, paragraph_sep
+            continue
+        sentences = _split_keep(paragraph, _SENTENCE_RE)
+        for i, (sentence, sentence_sep) in enumerate(sentences):
+            if i == len(sentences) - 1:
+                sentence_sep = paragraph_sep
+            # Предложение длиннее бюджета режем по символам
+            while len(sentence) > max_chars:
+                yield sentence[:max_chars], ""
+                sentence = sentence[max_chars:]
+            yield sentence, sentence_sep
+
+
+def split_document(text, max_tokens=DOCUMENT_CHUNK_TOKENS):
+    """Жадно собирает абзацы/предложения во фрагменты не больше max_tokens"""
+    chunks, parts, size = [], [], 0
+    for unit, separator in _units(text, max_tokens):
+        if parts and size + estimate_tokens(unit) > max_tokens:
+            body, last_sep = "".join(parts[:-1]), parts[-1]
+            chunks.append(Chunk(len(chunks), body, last_sep))
+            parts, size = [], 0
+        parts.extend([unit, separator])
+        size += estimate_tokens(unit + separator)
+    if parts:
+        chunks.append(Chunk(len(chunks), "".join(parts[:-1]), parts[-1]))
+    return chunks
+
+
+def overlap_context(chunk, max_chars=DOCUMENT_OVERLAP_CHARS):
+    """Хвост фрагмента по границе предложения - контекст для следующего фрагмента"""
+    if max_chars <= 0:
+        return None
+    tail = chunk.text[-max_chars:]
+    if len(chunk.text) > max_chars:
+        match = _SENTENCE_RE.search(tail)
+        if match:
+            tail = tail[match.end():]
+    return tail.strip() or None
+
+
+def assemble(chunks, translations):
+    return "".join(translations[chunk.index].strip() + chunk.separator for chunk in chunks)
+
+
+async def translate_chunks(chunks, translate_fn, overlap=True, parallelism=DOCUMENT_PARALLELISM,
+                           max_rounds=DOCUMENT_MAX_ROUNDS, on_progress=None):
+    """
+    Переводит фрагменты параллельно.
+
+    translate_fn(text, context) -> (перевод или None, модель, ошибки);
+    on_progress(done, total) - необязательная корутина, вызывается после каждого фрагмента.
+    Возвращает (translations, models, failed), где translations и models -
+    словари по индексу фрагмента, failed - индексы, которые не удалось перевести.
+    """
+    semaphore = asyncio.Semaphore(parallelism)
+    translations, models = {}, {}
+    contexts = {
+        chunk.index: overlap_context(chunks[chunk.index - 1]) if overlap and chunk.index > 0 else None
+        for chunk in chunks
+    }
+
+    async def run(chunk):
+        if not chunk.text.strip():
+            translations[chunk.index] = chunk.text
+            return
+        async with semaphore:
+            translated_text, model, errors = await translate_fn(chunk.text, contexts[chunk.index])
+        if translated_text:
+            translations[chunk.index] = translated_text
+            models[chunk.index] = model
+            if on_progress is not None:
+                await on_progress(len(translations), len(chunks))
+        else:
+            logger.warning(f"Chunk {chunk.index} failed: {errors[-1] if errors else 'unknown error'}")
+
+    pending = list(chunks)
+    for round_number in range(1, max_rounds + 1):
+        await asyncio.gather(*(run(chunk) for chunk in pending))
+        pending = [chunk for chunk in pending if chunk.index not in translations]
+        if not pending:
+            break
+        logger.info(f"Document round {round_number}: {len(pending)} chunks to retry")
+
+    return translations, models, [chunk.index for chunk in pending]
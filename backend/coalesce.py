@@ -0,0 +1,58 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight).
+
+Первый запрос с данным ключом запускает вызов, остальные, пришедшие до его
+завершения, ждут тот же результат (в том числе ошибку), не создавая новых
+обращений к моделям.
+"""
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}  # key -> asyncio.Task или asyncio.Future из lead
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, call):
+        """
+        Выполняет call() - корутинную функцию - один раз на ключ среди одновременных вызовов.
+        Отмена одного ожидающего не отменяет общий вызов для остальных
+        """
+        task = self._flights.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(call())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+            metrics.COALESCED.inc()
+            logger.info("Request coalesced with an in-flight translation")
+        return await asyncio.shield(task)
+
+    def lead(self, key):
+        """
+        Регистрирует вызов, который вызывающий выполняет сам (потоковый перевод отдаёт текст
+        по частям и не укладывается в do). Возвращает future, которое вызывающий обязан
+        завершить результатом, или None, если вызов с этим ключом уже идёт
+        """
+        if key in self._flights:
+            return None
+        self.leaders += 1
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+
+    def get_stats(self):
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
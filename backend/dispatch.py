@@ -0,0 +1,192 @@
+"""
+Стратегии обхода списка моделей:
+
+- sequential: модели пробуются по очереди (исходное поведение);
+- hedged: если текущая модель не ответила за задержку, основанную на p95,
+  параллельно запускается следующая;
+- race: все модели запускаются сразу, побеждает первый валидный ответ,
+  остальные запросы отменяются.
+
+Для каждой стратегии ведётся учёт задержек и числа upstream-вызовов,
+чтобы ограничивать хвостовые задержки без лишнего расхода токенов.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("sequential", "hedged", "race")
+
+DISPATCH_STRATEGY = os.getenv("DISPATCH_STRATEGY", "sequential").lower()
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "15"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+RACE_MAX_PARALLEL = int(os.getenv("RACE_MAX_PARALLEL", "0"))  # 0 - без ограничения
+
+if DISPATCH_STRATEGY not in STRATEGIES:
+    logger.warning(f"Unknown DISPATCH_STRATEGY={DISPATCH_STRATEGY}, using sequential")
+    DISPATCH_STRATEGY = "sequential"
+
+
+class LatencyWindow:
+    """Скользящее окно последних задержек для оценки перцентилей"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        self._samples.append(value)
+
+    def percentile(self, q):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class StrategyStats:
+    """Учёт задержек и стоимости (числа upstream-вызовов) для одной стратегии"""
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.upstream_calls = 0
+        self.cancelled_calls = 0
+        self.latency = LatencyWindow()
+
+    def record(self, report):
+        self.requests += 1
+        self.successes += int(report["success"])
+        self.upstream_calls += report["upstream_calls"]
+        self.cancelled_calls += report["cancelled_calls"]
+        self.latency.add(report["elapsed_s"])
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "upstream_calls": self.upstream_calls,
+            "cancelled_calls": self.cancelled_calls,
+            "calls_per_request": round(self.upstream_calls / self.requests, 3) if self.requests else 0.0,
+            "latency_p50_s": self.latency.percentile(50),
+            "latency_p95_s": self.latency.percentile(95),
+            "latency_p99_s": self.latency.percentile(99),
+        }
+
+
+# Задержки успешных upstream-вызовов, по ним считается задержка хеджирования
+upstream_latency = LatencyWindow(500)
+strategy_stats = {name: StrategyStats() for name in STRATEGIES}
+
+
+def hedge_delay():
+    """Задержка перед запуском следующей модели: p95 успешных вызовов в заданных пределах"""
+    if len(upstream_latency) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, upstream_latency.percentile(95)))
+
+
+async def dispatch(models, attempt, strategy=None):
+    """
+    Перебирает модели согласно стратегии.
+
+    attempt(model) - корутина, возвращающая (translated_text, model, error).
+    Возвращает (translated_text, model, errors, report).
+    """
+    strategy = (strategy or DISPATCH_STRATEGY).lower()
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown dispatch strategy: {strategy}")
+
+    if strategy == "sequential":
+        delay, max_parallel = None, 1
+    elif strategy == "hedged":
+        delay, max_parallel = hedge_delay(), len(models)
+    else:
+        delay, max_parallel = 0, RACE_MAX_PARALLEL or len(models)
+
+    started = time.perf_counter()
+    queue = list(models)
+    running = {}  # task -> (model, start time)
+    errors = []
+    upstream_calls = 0
+    winner = None
+
+    def launch():
+        nonlocal upstream_calls
+        model = queue.pop(0)
+        task = asyncio.ensure_future(attempt(model))
+        running[task] = (model, time.perf_counter())
+        upstream_calls += 1
+
+    try:
+        launch()
+        while running:
+            # Сразу запускаем модели, если позволяет стратегия (race)
+            while queue and delay == 0 and len(running) < max_parallel:
+                launch()
+            can_hedge = queue and delay is not None and len(running) < max_parallel
+            done, _ = await asyncio.wait(
+                running.keys(),
+                timeout=delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                # Текущие модели не успели ответить - хеджируем следующей
+                logger.info(f"No answer within {delay:.2f}s, hedging with {queue[0]}")
+                launch()
+                continue
+            for task in done:
+                model, task_started = running.pop(task)
+                translated_text, used_model, error = task.result()
+                if translated_text and winner is None:
+                    upstream_latency.add(time.perf_counter() - task_started)
+                    winner = (translated_text, used_model)
+                elif not translated_text:
+                    errors.append(f"Model {model}: {error}")
+                    logger.warning(f"Translation with {model} failed: {error}. Trying next model.")
+            if winner is not None:
+                break
+            # Место упавшей модели сразу занимает следующая, не дожидаясь задержки хеджирования
+            for _ in done:
+                if queue and len(running) < max_parallel:
+                    launch()
+    finally:
+        cancelled = list(running)
+        cancelled_calls = len(cancelled)
+        for task in cancelled:
+            task.cancel()
+        # Дожидаемся отмены проигравших, чтобы их соединения и ошибки не остались висеть
+        await asyncio.gather(*cancelled, return_exceptions=True)
+
+    report = {
+        "strategy": strategy,
+        "success": winner is not None,
+        "upstream_calls": upstream_calls,
+        "cancelled_calls": cancelled_calls,
+        "elapsed_s": round(time.perf_counter() - started, 4),
+    }
+    strategy_stats[strategy].record(report)
+    metrics.ATTEMPTS_PER_REQUEST.labels(strategy=strategy).observe(report["upstream_calls"])
+    if report["upstream_calls"] > 1:
+        metrics.FALLBACKS.labels(strategy=strategy).inc(report["upstream_calls"] - 1)
+    if winner is None:
+        return None, None, errors, report
+    return winner[0], winner[1], errors, report
+
+
+def get_stats():
+    return {
+        "default_strategy": DISPATCH_STRATEGY,
+        "hedge_delay_s": round(hedge_delay(), 3),
+        "strategies": {name: stats.snapshot() for name, stats in strategy_stats.items()},
+    }
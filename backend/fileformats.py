@@ -0,0 +1,370 @@
+"""
+Перевод файлов с сохранением формата.
+
+Файл разбирается потоково на части: служебные (разметка, ключи, тайминги
+субтитров) выводятся как есть, переводимые сегменты отправляются модели.
+Сегменты собираются в окна, окна переводятся параллельно (не больше
+FILE_PARALLELISM одновременно), а результат отдаётся клиенту по мере готовности
+в исходном порядке. В памяти одновременно находится только несколько окон,
+поэтому размер файла на неё не влияет.
+
+Часть файла - пара (текст, render): render равен None для служебного текста,
+иначе это функция render(перевод) -> строка для вывода. Если сегмент перевести
+не удалось, render получает None и выводит исходный текст (или пустой перевод
+там, где формат это допускает, как в PO).
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+
+import batch
+
+logger = logging.getLogger(__name__)
+
+FILE_MAX_BYTES = int(os.getenv("FILE_MAX_BYTES", str(20 * 1024 * 1024)))
+# Сегментов и символов в одном окне; окно переводится одним пакетным запросом
+FILE_WINDOW_SEGMENTS = int(os.getenv("FILE_WINDOW_SEGMENTS", str(batch.BATCH_MAX_SEGMENTS)))
+FILE_WINDOW_CHARS = int(os.getenv("FILE_WINDOW_CHARS", str(batch.BATCH_MAX_CHARS)))
+FILE_PARALLELISM = int(os.getenv("FILE_PARALLELISM", "4"))
+# Абзац обычного текста длиннее этого делится по строкам на несколько сегментов
+FILE_SEGMENT_CHARS = int(os.getenv("FILE_SEGMENT_CHARS", "2000"))
+# Файлы меньше этого размера разбираются в памяти, большие - из временного файла на диске
+FILE_SPOOL_BYTES = int(os.getenv("FILE_SPOOL_BYTES", str(1024 * 1024)))
+
+# Окно без переводимых сегментов (например, длинный блок кода) тоже отправляется, чтобы не копить его
+_WINDOW_MAX_PIECES = 1000
+_READ_CHARS = 64 * 1024
+
+_TEXT_RE = re.compile(r"[^\W\d_]")
+_URL_RE = re.compile(r"^\s*(?:[a-z][a-z0-9+.-]*://|mailto:|www\.)\S*\s*$", re.IGNORECASE)
+_EDGE_SPACE_RE = re.compile(r"^(\s*)(.*?)(\s*)$", re.DOTALL)
+
+
+def _has_text(text):
+    return bool(_TEXT_RE.search(text)) and not _URL_RE.match(text)
+
+
+def _plain(text):
+    """Части для фрагмента текста: пробелы по краям остаются как есть, середина переводится"""
+    if not _has_text(text):
+        yield text, None
+        return
+    leading, core, trailing = _EDGE_SPACE_RE.match(text).groups()
+    if leading:
+        yield leading, None
+    yield core, lambda translated: core if translated is None else translated
+    if trailing:
+        yield trailing, None
+
+
+def _is_blank(line):
+    return not line.strip()
+
+
+def parse_text(f):
+    """Обычный текст: абзацы, разделённые пустыми строками"""
+    paragraph, size = [], 0
+    for line in f:
+        if _is_blank(line):
+            yield from _plain("".join(paragraph))
+            paragraph, size = [], 0
+            yield line, None
+            continue
+        if paragraph and size + len(line) > FILE_SEGMENT_CHARS:
+            yield from _plain("".join(paragraph))
+            paragraph, size = [], 0
+        paragraph.append(line)
+        size += len(line)
+    yield from _plain("".join(paragraph))
+
+
+_MD_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_MD_PREFIX_RE = re.compile(r"^(\s*(?:#{1,6}\s+|>\s?|[-*+]\s+(?:\[[ xX]\]\s+)?|\d+[.)]\s+)*)")
+_MD_SKIP_RE = re.compile(
+    r"^\s*(?:<[^>]*>\s*|\[[^\]]+\]:\s*\S+.*|[-*_=](?:\s*[-*_=]){2,}\s*|\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)*\|?\s*)$"
+)
+
+
+def parse_markdown(f):
+    """
+    Markdown построчно: блоки кода, front matter, HTML-строки, ссылки-сноски и разделители
+    остаются как есть; у заголовков, цитат и списков переводится текст после маркера,
+    у таблиц - каждая ячейка отдельно
+    """
+    fence = None
+    front_matter = False
+    for number, line in enumerate(f):
+        if number == 0 and line.rstrip() == "---":
+            front_matter = True
+            yield line, None
+            continue
+        if front_matter:
+            front_matter = line.rstrip() not in ("---", "...")
+            yield line, None
+            continue
+        match = _MD_FENCE_RE.match(line)
+        if fence is not None:
+            if match and match.group(1) == fence:
+                fence = None
+            yield line, None
+            continue
+        if match:
+            fence = match.group(1)
+            yield line, None
+            continue
+        if _is_blank(line) or _MD_SKIP_RE.match(line):
+            yield line, None
+            continue
+        prefix = _MD_PREFIX_RE.match(line).group(1)
+        if prefix:
+            yield prefix, None
+        content = line[len(prefix):]
+        if content.lstrip().startswith("|"):
+            for cell in re.split(r"(\|)", content):
+                if cell == "|":
+                    yield cell, None
+                else:
+                    yield from _plain(cell)
+        else:
+            yield from _plain(content)
+
+
+def parse_subtitles(f):
+    """
+    SRT и WebVTT: номера реплик, тайминги, заголовок WEBVTT и блоки NOTE/STYLE остаются как есть,
+    текст реплики (все строки после тайминга) переводится одним сегментом
+    """
+    block = []
+    for line in f:
+        if not _is_blank(line):
+            block.append(line)
+            continue
+        yield from _subtitle_block(block)
+        block = []
+        yield line, None
+    yield from _subtitle_block(block)
+
+
+def _subtitle_block(block):
+    timing = next((i for i, line in enumerate(block) if "-->" in line), None)
+    if timing is None:
+        yield "".join(block), None
+        return
+    yield "".join(block[:timing + 1]), None
+    yield from _plain("".join(block[timing + 1:]))
+
+
+_JSON_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_JSON_SPACE_RE = re.compile(r"\s*")
+
+
+def _json_value(literal):
+    text = json.loads(literal)
+    if not _has_text(text):
+        return literal, None
+    return text, lambda translated: literal if translated is None else json.dumps(translated, ensure_ascii=False)
+
+
+def parse_json(f):
+    """
+    JSON (файлы локализации): переводятся строковые значения на любой глубине, ключи, числа
+    и форматирование остаются как есть. Файл читается кусками, целиком в память не загружается
+    """
+    carry = ""
+    # Строка, про которую ещё неизвестно, ключ это или значение: решает следующий значимый символ
+    pending, pending_space = None, ""
+    while True:
+        chunk = f.read(_READ_CHARS)
+        data, carry = carry + chunk, ""
+        position = 0
+        while position < len(data):
+            if pending is not None:
+                space = _JSON_SPACE_RE.match(data, position).group(0)
+                pending_space += space
+                position += len(space)
+                if position == len(data):
+                    break
+                yield (pending, None) if data[position] == ":" else _json_value(pending)
+                if pending_space:
+                    yield pending_space, None
+                pending, pending_space = None, ""
+                continue
+            quote = data.find('"', position)
+            if quote < 0:
+                yield data[position:], None
+                break
+            if quote > position:
+                yield data[position:quote], None
+            match = _JSON_STRING_RE.match(data, quote)
+            if match is None:
+                # Строка продолжается в следующем куске
+                carry = data[quote:]
+                break
+            pending = match.group(0)
+            position = match.end()
+        if not chunk:
+            break
+    if pending is not None:
+        yield _json_value(pending)
+        if pending_space:
+            yield pending_space, None
+    if carry:
+        raise ValueError("Unterminated string in JSON file")
+
+
+_PO_KEYWORD_RE = re.compile(r"^(msgctxt|msgid_plural|msgid|msgstr(?:\[(\d+)\])?)\s+(\".*\")\s*$")
+
+
+def _po_quote(text):
+    escaped = text.replace("\\", "\\\\").replace('"', '\\"').replace("\t", "\\t")
+    lines = escaped.split("\n")
+    if len(lines) == 1:
+        return f'"{escaped}"\n'
+    # Многострочный перевод записывается как в gettext: пустая первая строка и по строке на \n
+    parts = [line + "\\n" for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+    return '""\n' + "".join(f'"{part}"\n' for part in parts)
+
+
+def _po_entry(lines):
+    """Части одной записи PO: переводится msgid (и msgid_plural) в пустой msgstr"""
+    fields, current, first_msgstr = {}, None, None
+    try:
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            match = _PO_KEYWORD_RE.match(stripped)
+            if match:
+                current = match.group(1)
+                if current.startswith("msgstr") and first_msgstr is None:
+                    first_msgstr = i
+                fields[current] = json.loads(match.group(3))
+            elif stripped.startswith('"') and current is not None:
+                fields[current] += json.loads(stripped)
+            elif not stripped.startswith("#"):
+                raise ValueError(f"Unexpected line: {stripped[:40]}")
+    except ValueError as e:
+        logger.warning(f"Skipping unparsable PO entry: {e}")
+        yield "".join(lines), None
+        return
+    msgstrs = sorted(key for key in fields if key.startswith("msgstr"))
+    # Заголовок, уже переведённые и закомментированные записи не трогаем
+    if (first_msgstr is None or not fields.get("msgid") or any(fields[key] for key in msgstrs)
+            or not _has_text(fields["msgid"])):
+        yield "".join(lines), None
+        return
+    yield "".join(lines[:first_msgstr]), None
+    if "msgid_plural" not in fields:
+        yield fields["msgid"], lambda translated: "msgstr " + _po_quote(translated or "")
+        return
+    plural_forms = max(2, len(msgstrs))
+    yield fields["msgid"], lambda translated: "msgstr[0] " + _po_quote(translated or "")
+    yield fields["msgid_plural"], lambda translated: "".join(
+        f"msgstr[{n}] " + _po_quote(translated or "") for n in range(1, plural_forms)
+    )
+
+
+def parse_po(f):
+    """Файлы gettext (.po): записи разделены пустыми строками, комментарии и msgid сохраняются"""
+    entry = []
+    for line in f:
+        if not _is_blank(line):
+            entry.append(line if line.endswith("\n") else line + "\n")
+            continue
+        if entry:
+            yield from _po_entry(entry)
+            entry = []
+        yield line, None
+    if entry:
+        yield from _po_entry(entry)
+
+
+# Формат: (разбор, MIME-тип результата)
+FORMATS = {
+    "txt": (parse_text, "text/plain"),
+    "md": (parse_markdown, "text/markdown"),
+    "srt": (parse_subtitles, "application/x-subrip"),
+    "vtt": (parse_subtitles, "text/vtt"),
+    "json": (parse_json, "application/json"),
+    "po": (parse_po, "text/x-gettext-translation"),
+}
+
+_EXTENSIONS = {"text": "txt", "markdown": "md", "webvtt": "vtt", "pot": "po"}
+
+
+def detect_format(filename, file_format=None):
+    """Формат по явному параметру или расширению имени файла; None, если формат не поддерживается"""
+    name = (file_format or os.path.splitext(filename or "")[1].lstrip(".")).lower()
+    name = _EXTENSIONS.get(name, name)
+    return name if name in FORMATS else None
+
+
+def translated_filename(filename, target_lang, file_format):
+    stem, extension = os.path.splitext(os.path.basename(filename or "")) if filename else ("translation", "")
+    return f"{stem or 'translation'}.{target_lang.lower()}{extension or '.' + file_format}"
+
+
+async def translate_pieces(pieces, translate_window, stats=None):
+    """
+    Переводит части файла окнами и отдаёт результат по мере готовности, в исходном порядке.
+
+    pieces - итератор пар (текст, render); translate_window(тексты) -> список переводов
+    (None для сегмента, который не удалось перевести). Одновременно переводится
+    не больше FILE_PARALLELISM окон, разбор файла ждёт, пока освободится место.
+    """
+    stats = {} if stats is None else stats
+    stats.update(segments=0, windows=0, failed=0)
+    windows = asyncio.Queue(maxsize=FILE_PARALLELISM)
+
+    async def translate(texts):
+        return await translate_window(texts) if texts else []
+
+    async def produce():
+        try:
+            window, texts, size = [], [], 0
+            for text, render in pieces:
+                window.append((text, render))
+                if render is not None:
+                    texts.append(text)
+                    size += len(text)
+                if len(texts) >= FILE_WINDOW_SEGMENTS or size >= FILE_WINDOW_CHARS or len(window) >= _WINDOW_MAX_PIECES:
+                    await windows.put((window, asyncio.create_task(translate(texts))))
+                    stats["segments"] += len(texts)
+                    stats["windows"] += 1
+                    window, texts, size = [], [], 0
+            if window:
+                await windows.put((window, asyncio.create_task(translate(texts))))
+                stats["segments"] += len(texts)
+                stats["windows"] += 1
+        except Exception:
+            # Конец потока, чтобы отдающая сторона не ждала вечно; сама ошибка придёт через await producer
+            await windows.put(None)
+            raise
+        await windows.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await windows.get()
+            if item is None:
+                break
+            window, task = item
+            translations = iter(await task)
+            parts = []
+            for text, render in window:
+                if render is None:
+                    parts.append(text)
+                    continue
+                translated = next(translations)
+                if translated is None:
+                    stats["failed"] += 1
+                parts.append(render(translated))
+            yield "".join(parts)
+        # Ошибка разбора файла всплывает здесь
+        await producer
+    finally:
+        producer.cancel()
+        while not windows.empty():
+            item = windows.get_nowait()
+            if item is not None:
+                item[1].cancel()
@@ -0,0 +1,47 @@
+"""
+Запуск backend в нескольких процессах: gunicorn -c gunicorn.conf.py app:app
+
+Число воркеров задаёт BACKEND_WORKERS. Чтобы квоты моделей и их статистика
+были общими для воркеров, нужно общее хранилище STATE_BACKEND=sqlite
+(одна машина) или redis (несколько машин), см. state.py. С STATE_BACKEND=local
+запускается один воркер.
+"""
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("BACKEND_WORKERS", "1"))
+# С локальным состоянием каждый воркер при старте заново запустил бы незавершённые
+# задания, и они выполнились бы несколько раз - поэтому остаётся один воркер
+unshared_state = workers > 1 and os.getenv("STATE_BACKEND", "local").lower() == "local"
+if unshared_state:
+    workers = 1
+worker_class = "uvicorn.workers.UvicornWorker"
+# Потоковые ответы и долгие переводы не должны считаться зависшим воркером
+timeout = int(os.getenv("BACKEND_WORKER_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+
+# Метрики каждого воркера пишутся в общий каталог и суммируются на /metrics (см. metrics.py).
+# Переменная должна быть задана до импорта prometheus_client воркерами
+if workers > 1:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "llm_translator_metrics"))
+
+
+def on_starting(server):
+    if unshared_state:
+        server.log.error(f"BACKEND_WORKERS={os.getenv('BACKEND_WORKERS')} requires a shared STATE_BACKEND "
+                         f"(sqlite or redis), starting a single worker")
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        # Файлы прошлого запуска исказили бы счётчики
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
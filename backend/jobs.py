@@ -0,0 +1,303 @@
+"""
+Асинхронные задания для больших объёмов перевода.
+
+Очередь хранится в SQLite, поэтому задания переживают перезапуск: незавершённые
+задачи при старте возвращаются в очередь. Задания обрабатывает пул воркеров
+внутри процесса; интерактивная полоса имеет приоритет над пакетной, а часть
+воркеров зарезервирована только под интерактивные задания.
+
+Если backend запущен в нескольких процессах, они разбирают общую очередь.
+Выполняемое задание продлевает аренду (updated_at); задание, чья аренда
+истекла, считается брошенным упавшим процессом и возвращается в очередь.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "data/jobs.sqlite3")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_INTERACTIVE_WORKERS = int(os.getenv("JOBS_INTERACTIVE_WORKERS", "1"))
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "500"))
+JOBS_MAX_QUEUED_INTERACTIVE = int(os.getenv("JOBS_MAX_QUEUED_INTERACTIVE", "50"))
+JOBS_RETENTION = float(os.getenv("JOBS_RETENTION", str(24 * 3600)))
+# Задание без продления аренды дольше этого срока возвращается в очередь
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "60"))
+
+LANES = ("interactive", "bulk")
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Очередь переполнена, клиенту нужно повторить позже"""
+
+    def __init__(self, lane, queued):
+        super().__init__(f"Job queue for lane '{lane}' is full ({queued} queued)")
+        self.lane = lane
+        self.queued = queued
+
+
+class JobStore:
+    """Хранилище заданий в SQLite. Все методы синхронные и вызываются через asyncio.to_thread."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " lane TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " progress_done INTEGER NOT NULL DEFAULT 0,"
+            " progress_total INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, lane, created_at)")
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def requeue_unfinished(self, stale_before=None):
+        """
+        Задания, прерванные перезапуском, возвращаются в очередь.
+        Если задан stale_before - только те, чья аренда не продлевалась с этого момента
+        """
+        if stale_before is None:
+            stale_before = float("inf")
+        return self._execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+            (QUEUED, time.time(), RUNNING, stale_before),
+        ).rowcount
+
+    def count_queued(self, lane):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND lane = ?", (QUEUED, lane)
+            ).fetchone()[0]
+
+    def insert(self, job_id, kind, lane, payload):
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, lane, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, lane, QUEUED, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+
+    def claim_next(self, lanes):
+        """Атомарно забирает самое старое задание из первой непустой полосы"""
+        with self._lock:
+            for lane in lanes:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND lane = ? ORDER BY created_at LIMIT 1", (QUEUED, lane)
+                ).fetchone()
+                if row is None:
+                    continue
+                # Задание мог забрать другой процесс между SELECT и UPDATE
+                claimed = self._conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (RUNNING, time.time(), row["id"], QUEUED),
+                ).rowcount
+                self._conn.commit()
+                if claimed:
+                    return dict(row)
+        return None
+
+    def update(self, job_id, only_if_status=None, **fields):
+        """
+        Обновляет поля задания; с only_if_status (статус или кортеж статусов) - только если
+        статус задания один из них. Возвращает успех
+        """
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        if only_if_status is None:
+            return self._execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)).rowcount > 0
+        statuses = (only_if_status,) if isinstance(only_if_status, str) else tuple(only_if_status)
+        placeholders = ", ".join("?" for _ in statuses)
+        return self._execute(
+            f"UPDATE jobs SET {columns} WHERE id = ? AND status IN ({placeholders})",
+            (*fields.values(), job_id, *statuses)
+        ).rowcount > 0
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def purge(self, older_than):
+        placeholders = ", ".join("?" for _ in FINISHED)
+        return self._execute(
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?", (*FINISHED, older_than)
+        ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """
+    Очередь заданий с пулом воркеров.
+
+    handlers - словарь {kind: корутина handler(payload, progress)}, где
+    progress(done, total) - корутина для обновления прогресса задания.
+
+    shared - очередь разбирают несколько процессов, поэтому при старте в очередь
+    возвращаются только задания с истёкшей арендой, а не все выполняемые.
+    """
+
+    def __init__(self, handlers, path=JOBS_DB_PATH, workers=JOBS_WORKERS,
+                 interactive_workers=JOBS_INTERACTIVE_WORKERS, shared=False):
+        self.handlers = handlers
+        self.store = JobStore(path)
+        self.workers = workers
+        self.interactive_workers = interactive_workers
+        self.shared = shared
+        self._reclaimed_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = []
+        self._running = {}  # job_id -> asyncio.Task
+        self._stopping = False
+
+    async def start(self):
+        stale_before = time.time() - JOBS_LEASE_SECONDS if self.shared else None
+        requeued = await asyncio.to_thread(self.store.requeue_unfinished, stale_before)
+        purged = await asyncio.to_thread(self.store.purge, time.time() - JOBS_RETENTION)
+        if requeued or purged:
+            logger.info(f"Job queue restored: {requeued} jobs requeued, {purged} old jobs purged")
+        for i in range(self.interactive_workers):
+            self._worker_tasks.append(asyncio.ensure_future(self._worker(f"interactive-{i}", ("interactive",))))
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.ensure_future(self._worker(f"worker-{i}", LANES)))
+        self._wakeup.set()
+
+    async def stop(self):
+        # Флаг нужен, потому что отмена может совпасть с таймаутом ожидания и потеряться
+        self._stopping = True
+        self._wakeup.set()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self.store.close()
+
+    async def submit(self, kind, payload, lane):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+        # Ограничение глубины очереди: лучше сразу отказать, чем копить задания без предела
+        limit = JOBS_MAX_QUEUED_INTERACTIVE if lane == "interactive" else JOBS_MAX_QUEUED
+        queued = await asyncio.to_thread(self.store.count_queued, lane)
+        if queued >= limit:
+            raise QueueFull(lane, queued)
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.insert, job_id, kind, lane, payload)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id):
+        """Отменяет задание. Возвращает итоговый статус или None, если задания нет."""
+        job = await self.get(job_id)
+        if job is None:
+            return None
+        if job["status"] in FINISHED:
+            return job["status"]
+        # Задание могло завершиться после чтения: готовый результат отменой не затираем
+        if not await asyncio.to_thread(self.store.update, job_id, (QUEUED, RUNNING), status=CANCELLED):
+            job = await self.get(job_id)
+            return job["status"] if job is not None else None
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        return CANCELLED
+
+    async def _worker(self, name, lanes):
+        while not self._stopping:
+            job = await asyncio.to_thread(self.store.claim_next, lanes)
+            if job is None:
+                await self._reclaim_stale()
+                self._wakeup.clear()
+                try:
+                    # Таймаут страхует от пропущенного пробуждения
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Будим остальных воркеров: в очереди могут быть ещё задания
+            self._wakeup.set()
+            await self._run(name, job)
+
+    async def _reclaim_stale(self):
+        """Возвращает в очередь задания процессов, которые перестали продлевать аренду"""
+        if not self.shared or time.monotonic() - self._reclaimed_at < JOBS_LEASE_SECONDS:
+            return
+        self._reclaimed_at = time.monotonic()
+        requeued = await asyncio.to_thread(self.store.requeue_unfinished, time.time() - JOBS_LEASE_SECONDS)
+        if requeued:
+            logger.warning(f"Requeued {requeued} jobs with expired leases")
+            self._wakeup.set()
+
+    async def _heartbeat(self, job_id, task):
+        """Продлевает аренду задания; если задание отменили в другом процессе, отменяет его здесь"""
+        while True:
+            await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(self.store.update, job_id, only_if_status=RUNNING):
+                task.cancel()
+                return
+
+    async def _run(self, name, job):
+        job_id = job["id"]
+        logger.info(f"{name} started job {job_id} ({job['kind']}, {job['lane']})")
+
+        async def progress(done, total):
+            await asyncio.to_thread(self.store.update, job_id, progress_done=done, progress_total=total)
+
+        task = asyncio.ensure_future(self.handlers[job["kind"]](json.loads(job["payload"]), progress))
+        self._running[job_id] = task
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # Отменили сам воркер (остановка приложения) - задание вернётся в очередь при старте
+                task.cancel()
+                raise
+            logger.info(f"Job {job_id} cancelled")
+            return
+        except Exception as e:
+            # У HTTPException текст ошибки лежит в detail
+            error = str(getattr(e, "detail", None) or e)
+            logger.error(f"Job {job_id} failed: {error}")
+            await asyncio.to_thread(self.store.update, job_id, RUNNING, status=FAILED, error=error)
+            return
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job_id, None)
+        # Отменённое тем временем задание не перезаписывается результатом
+        await asyncio.to_thread(
+            self.store.update, job_id, RUNNING, status=DONE, result=json.dumps(result, ensure_ascii=False)
+        )
+        logger.info(f"Job {job_id} done")
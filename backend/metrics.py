@@ -0,0 +1,143 @@
+"""
+Метрики Prometheus для пути перевода. Отдаются на GET /metrics.
+
+При запуске в нескольких процессах (gunicorn, см. gunicorn.conf.py) задаётся
+PROMETHEUS_MULTIPROC_DIR: каждый процесс пишет метрики в свои файлы, а /metrics
+любого воркера отдаёт сумму по всем.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+REQUEST_LATENCY = Histogram(
+    "translator_request_duration_seconds",
+    "End-to-end HTTP request latency (time to first byte for streaming responses)",
+    ["endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "translator_requests_in_flight",
+    "HTTP requests currently being processed",
+    multiprocess_mode="livesum",
+)
+UPSTREAM_LATENCY = Histogram(
+    "translator_upstream_duration_seconds",
+    "Latency of a single OpenRouter completion call (outcome: ok, invalid, error)",
+    ["model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+VALIDATION_DURATION = Histogram(
+    "translator_validation_duration_seconds",
+    "Time spent validating a model answer",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+ATTEMPTS_PER_REQUEST = Histogram(
+    "translator_attempts_per_request",
+    "Upstream model calls started per translation",
+    ["strategy"],
+    buckets=(1, 2, 3, 4, 5, 10),
+)
+FALLBACKS = Counter(
+    "translator_fallbacks_total",
+    "Upstream calls beyond the first one for a translation",
+    ["strategy"],
+)
+CACHE_LOOKUPS = Counter(
+    "translator_cache_lookups_total",
+    "Translation cache lookups by result",
+    ["result"],
+)
+RATE_LIMITED = Counter(
+    "translator_rate_limited_total",
+    "Model calls refused by the local rate limiter (shed) or by OpenRouter with 429 (upstream)",
+    ["model", "reason"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "translator_rate_limit_wait_seconds",
+    "Time a model call waited in the rate limiter queue",
+    ["model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+COALESCED = Counter(
+    "translator_coalesced_requests_total",
+    "Translations that joined an identical in-flight translation instead of calling models",
+)
+TM_LOOKUPS = Counter(
+    "translator_tm_lookups_total",
+    "Translation memory lookups by result (direct, context, miss)",
+    ["result"],
+)
+TOKENS = Counter(
+    "translator_tokens_total",
+    "Tokens reported in completion usage",
+    ["model", "kind"],
+)
+
+
+def _cache_hit_ratio():
+    hits = total = 0.0
+    for sample in CACHE_LOOKUPS.collect()[0].samples:
+        if sample.name.endswith("_total"):
+            total += sample.value
+            if sample.labels["result"] != "miss":
+                hits += sample.value
+    return hits / total if total else 0.0
+
+
+# Вычисляемые gauge не работают в многопроцессном режиме; там долю попаданий считают по translator_cache_lookups_total
+if not MULTIPROCESS:
+    CACHE_HIT_RATIO = Gauge("translator_cache_hit_ratio", "Share of cache lookups that were hits")
+    CACHE_HIT_RATIO.set_function(_cache_hit_ratio)
+
+
+# Расход токенов текущего HTTP-запроса по всем вызовам моделей; словарь создаёт middleware
+request_usage_var = contextvars.ContextVar("request_usage", default=None)
+
+
+def new_request_usage():
+    return {"upstream_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_prompt_tokens": 0}
+
+
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+def record_usage(model, usage, estimated_prompt_tokens=0):
+    """
+    Учитывает токены из поля usage ответа (объект SDK или словарь) в метриках и в расходе
+    текущего запроса; estimated_prompt_tokens - локальная оценка промпта этого вызова
+    """
+    request_usage = request_usage_var.get()
+    if request_usage is not None:
+        request_usage["upstream_calls"] += 1
+        request_usage["estimated_prompt_tokens"] += estimated_prompt_tokens
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if value:
+            TOKENS.labels(model=model, kind=kind.split("_")[0]).inc(value)
+            if request_usage is not None:
+                request_usage[kind] += value
+
+
+def render():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,254 @@
+"""
+Адаптивный выбор порядка моделей.
+
+Для каждой модели (и для каждой пары модель + языковая пара) ведётся скользящая
+статистика: задержки, доля ошибок и доля ответов, отклонённых is_valid_translation.
+Кандидаты сортируются по ожидаемому времени до валидного ответа, а на модели,
+которые раз за разом падают, открывается circuit breaker с пробными запросами
+в состоянии half-open.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from validation import LANGUAGE_SCRIPTS
+
+logger = logging.getLogger(__name__)
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "100"))
+ROUTER_MIN_PAIR_SAMPLES = int(os.getenv("ROUTER_MIN_PAIR_SAMPLES", "5"))
+ROUTER_PRIOR_LATENCY = float(os.getenv("ROUTER_PRIOR_LATENCY", "5"))
+CB_FAILURE_THRESHOLD = int(os.getenv("CB_FAILURE_THRESHOLD", "3"))
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "30"))
+CB_MAX_OPEN_SECONDS = float(os.getenv("CB_MAX_OPEN_SECONDS", "600"))
+CB_PROBE_TIMEOUT = float(os.getenv("CB_PROBE_TIMEOUT", "60"))
+# Как часто статистика обменивается с другими воркерами через общее хранилище
+ROUTER_SYNC_INTERVAL = float(os.getenv("ROUTER_SYNC_INTERVAL", "1"))
+
+OK, INVALID, ERROR, THROTTLED = "ok", "invalid", "error", "throttled"
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def classify(error):
+    """Относит результат perform_translation к одной из категорий"""
+    if error is None:
+        return OK
+    if error.startswith("Invalid translation"):
+        return INVALID
+    # Ограничение частоты говорит о квоте, а не о качестве модели
+    if error.startswith("Rate limited"):
+        return THROTTLED
+    return ERROR
+
+
+class RollingStats:
+    """Скользящее окно исходов вызовов одной модели"""
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)  # (latency, outcome)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, latency, outcome):
+        self._samples.append((latency, outcome))
+
+    def rate(self, outcome):
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, o in self._samples if o == outcome) / len(self._samples)
+
+    def latency_percentile(self, q):
+        if not self._samples:
+            return None
+        ordered = sorted(latency for latency, _ in self._samples)
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+    def expected_time_to_valid(self):
+        """
+        Ожидаемое время до валидного ответа: средняя задержка попытки,
+        делённая на сглаженную вероятность успеха (априори 1 успех из 2 попыток).
+        """
+        n = len(self._samples)
+        successes = sum(1 for _, o in self._samples if o == OK)
+        mean_latency = (sum(latency for latency, _ in self._samples) + ROUTER_PRIOR_LATENCY) / (n + 1)
+        return mean_latency / ((successes + 1) / (n + 2))
+
+    def snapshot(self):
+        p50, p95 = self.latency_percentile(50), self.latency_percentile(95)
+        return {
+            "samples": len(self._samples),
+            "error_rate": round(self.rate(ERROR), 4),
+            "invalid_rate": round(self.rate(INVALID), 4),
+            "latency_p50_s": round(p50, 3) if p50 is not None else None,
+            "latency_p95_s": round(p95, 3) if p95 is not None else None,
+            "expected_time_to_valid_s": round(self.expected_time_to_valid(), 3),
+        }
+
+
+class CircuitBreaker:
+    """Circuit breaker модели: closed -> open -> half_open -> closed/open"""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_seconds = CB_OPEN_SECONDS
+        self.opened_at = 0.0
+        self.probe_started_at = None
+
+    def current_state(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probe_started_at = None
+        return self.state
+
+    def can_probe(self, now):
+        return self.probe_started_at is None or now - self.probe_started_at >= CB_PROBE_TIMEOUT
+
+    def record(self, outcome, now):
+        if outcome == OK:
+            if self.state != CLOSED:
+                logger.info("Circuit closed after successful probe")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.open_seconds = CB_OPEN_SECONDS
+            return
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            # Пробный запрос не удался - открываем снова с удвоенной паузой
+            self.open_seconds = min(self.open_seconds * 2, CB_MAX_OPEN_SECONDS)
+            self._open(now)
+        elif self.state == CLOSED and self.consecutive_failures >= CB_FAILURE_THRESHOLD:
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_started_at = None
+
+    def snapshot(self, now):
+        state = self.current_state(now)
+        return {
+            "state": state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_s": round(max(0.0, self.opened_at + self.open_seconds - now), 1) if state == OPEN else 0.0,
+        }
+
+
+class ModelRouter:
+    def __init__(self, window=ROUTER_WINDOW):
+        self.window = window
+        self.model_stats = {}
+        self.pair_stats = {}
+        self.breakers = {}
+        # Исходы, ещё не отправленные другим воркерам
+        self._outbox = []
+        self._store = None
+
+    @staticmethod
+    def pair_key(source_language, target_language):
+        """
+        Ключ языковой пары. Языки вне LANGUAGE_SCRIPTS сводятся к "other",
+        иначе произвольные строки из запросов раздували бы pair_stats без предела
+        """
+        def language(name):
+            name = name.strip().lower()
+            return name if name in LANGUAGE_SCRIPTS else "other"
+        return f"{language(source_language)}->{language(target_language)}"
+
+    def _stats(self, model, pair):
+        if model not in self.model_stats:
+            self.model_stats[model] = RollingStats(self.window)
+            self.breakers[model] = CircuitBreaker()
+        key = (model, pair)
+        if key not in self.pair_stats:
+            self.pair_stats[key] = RollingStats(self.window)
+        return self.model_stats[model], self.pair_stats[key], self.breakers[model]
+
+    def record(self, model, pair, latency, outcome):
+        if outcome == THROTTLED:
+            return
+        self._apply(model, pair, latency, outcome)
+        if self._store is not None:
+            self._outbox.append({"model": model, "pair": pair, "latency": latency, "outcome": outcome})
+
+    def _apply(self, model, pair, latency, outcome):
+        model_stats, pair_stats, breaker = self._stats(model, pair)
+        model_stats.add(latency, outcome)
+        pair_stats.add(latency, outcome)
+        previous = breaker.state
+        breaker.record(outcome, time.monotonic())
+        if breaker.state == OPEN and previous != OPEN:
+            logger.warning(f"Circuit opened for {model} for {breaker.open_seconds:.0f}s")
+
+    async def sync(self):
+        """Отправляет свои исходы в общее хранилище и применяет исходы других воркеров"""
+        events, self._outbox = self._outbox, []
+        await self._store.publish(events)
+        for event in await self._store.fetch_events():
+            self._apply(event["model"], event["pair"], event["latency"], event["outcome"])
+
+    async def run_sync(self, store, interval=ROUTER_SYNC_INTERVAL):
+        """Фоновая синхронизация статистики между воркерами; нужна только для общего хранилища"""
+        self._store = store
+        try:
+            while True:
+                try:
+                    await self.sync()
+                except Exception as e:
+                    logger.error(f"Router stats sync failed: {str(e)}")
+                await asyncio.sleep(interval)
+        finally:
+            self._store = None
+            self._outbox = []
+
+    def score(self, model, pair):
+        model_stats, pair_stats, _ = self._stats(model, pair)
+        stats = pair_stats if len(pair_stats) >= ROUTER_MIN_PAIR_SAMPLES else model_stats
+        return stats.expected_time_to_valid()
+
+    def order(self, models, pair):
+        """
+        Возвращает модели в порядке ожидаемого времени до валидного ответа.
+        Модели с открытым circuit breaker пропускаются; модель в half-open
+        ставится первой как пробный запрос. Если открыты все, возвращается
+        исходный список, чтобы запрос не отклонялся без попытки.
+        """
+        if not ROUTER_ENABLED:
+            return list(models)
+        now = time.monotonic()
+        probes, candidates = [], []
+        for index, model in enumerate(models):
+            _, _, breaker = self._stats(model, pair)
+            state = breaker.current_state(now)
+            if state == OPEN:
+                continue
+            if state == HALF_OPEN:
+                if breaker.can_probe(now):
+                    breaker.probe_started_at = now
+                    probes.append(model)
+                continue
+            candidates.append((self.score(model, pair), index, model))
+        ordered = probes + [model for _, _, model in sorted(candidates)]
+        if not ordered:
+            logger.warning("All model circuits are open, trying models in static order")
+            return list(models)
+        return ordered
+
+    def get_stats(self):
+        now = time.monotonic()
+        pairs = {}
+        for (model, pair), stats in self.pair_stats.items():
+            pairs.setdefault(pair, {})[model] = stats.snapshot()
+        return {
+            "enabled": ROUTER_ENABLED,
+            "models": {
+                model: {**stats.snapshot(), "circuit": self.breakers[model].snapshot(now)}
+                for model, stats in self.model_stats.items()
+            },
+            "pairs": pairs,
+        }
@@ -0,0 +1,91 @@
+"""
+Перевод одного текста сразу на несколько языков.
+
+Языки упаковываются в один промпт с пронумерованными разделителями (как
+сегменты в batch), поэтому исходный текст и инструкция отправляются модели
+один раз, а все переводы приходят за один вызов. Каждый язык проверяется
+отдельно; языки, не прошедшие проверку, переводятся повторно по одному,
+параллельно друг с другом.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import prompts
+from batch import parse_batch_response
+
+logger = logging.getLogger(__name__)
+
+MULTI_MAX_TARGETS = int(os.getenv("MULTI_MAX_TARGETS", "20"))
+# Ограничение объёма ответа одного вызова: длина текста, умноженная на число языков в нём.
+# Для длинного текста языки делятся на несколько вызовов, вплоть до одного языка на вызов
+MULTI_MAX_CHARS = int(os.getenv("MULTI_MAX_CHARS", "6000"))
+
+
+def group_targets(text, targets, max_chars=MULTI_MAX_CHARS):
+    """Делит список языков на группы, ответ на каждую из которых не длиннее max_chars символов"""
+    per_group = max(1, max_chars // max(1, len(text)))
+    return [targets[i:i + per_group] for i in range(0, len(targets), per_group)]
+
+
+async def translate_targets(text, source_lang, targets, complete, validate, models, dispatch_fn, translate_one):
+    """
+    Переводит text на языки targets.
+
+    complete(messages, model) -> (content, error) - вызов модели;
+    validate(language, translated) -> bool - проверка перевода на один язык;
+    dispatch_fn(models, attempt) - обход моделей (см. dispatch.dispatch);
+    translate_one(language) -> (перевод или None, модель, ошибки) - обычный перевод на один язык,
+    им переводятся языки, для которых общий ответ не прошёл проверку.
+
+    Возвращает (results, errors, stats), где results - {язык: (перевод, модель, секунды от начала)}.
+    """
+    started = time.perf_counter()
+    results = {}
+    errors = []
+    stats = {"combined_calls": 0, "retried": 0}
+
+    async def run_group(group):
+        async def attempt(model):
+            messages = prompts.build_multi_target_messages(model, text, source_lang, group)
+            content, error = await complete(messages, model)
+            if error:
+                return None, model, error
+            parsed = parse_batch_response(content, list(range(len(group))))
+            if parsed is None:
+                return None, model, "Invalid translation: multi-target markers out of order"
+            parsed = {index: prompts.restore_markers(text, translated) for index, translated in parsed.items()}
+            valid = {
+                language: parsed[index] for index, language in enumerate(group)
+                if index in parsed and validate(language, parsed[index])
+            }
+            if not valid:
+                return None, model, "Invalid translation: no valid languages in multi-target response"
+            return valid, model, None
+
+        stats["combined_calls"] += 1
+        valid, model, group_errors, _ = await dispatch_fn(models, attempt)
+        errors.extend(group_errors)
+        for language, translated in (valid or {}).items():
+            results[language] = (translated, model, time.perf_counter() - started)
+
+    async def run_single(language):
+        translated, model, single_errors = await translate_one(language)
+        errors.extend(single_errors)
+        if translated is not None:
+            results[language] = (translated, model, time.perf_counter() - started)
+
+    # Одиночный язык не нуждается в общем промпте и сразу идёт обычным путём
+    groups = group_targets(text, targets)
+    await asyncio.gather(*(
+        run_group(group) if len(group) > 1 else run_single(group[0]) for group in groups
+    ))
+
+    retry = [language for group in groups if len(group) > 1 for language in group if language not in results]
+    if retry:
+        logger.info(f"Multi-target: re-issuing {len(retry)} of {len(targets)} languages one by one")
+        stats["retried"] = len(retry)
+        await asyncio.gather(*(run_single(language) for language in retry))
+
+    return results, errors, stats
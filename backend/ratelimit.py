@@ -0,0 +1,313 @@
+"""
+Ограничение частоты обращений к моделям на стороне клиента.
+
+Для каждой модели ведутся два token bucket: запросы в минуту и токены в
+минуту (по оценке размера промпта, уточняется по usage ответа). Bucket лежат
+в общем хранилище (см. state), поэтому квота соблюдается всеми воркерами вместе. Запросы,
+которым не хватает квоты, ждут в очереди, причём очередь обслуживает клиентов
+по кругу, чтобы один клиент с пачкой запросов не занимал квоту целиком. Если
+ожидание заведомо больше RATE_LIMIT_MAX_WAIT или очередь переполнена, запрос
+сразу отклоняется, и dispatch переходит к следующей модели. Ответ 429 от
+OpenRouter блокирует модель на время из Retry-After / X-RateLimit-Reset.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+
+import metrics
+import prompts
+import state
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Бесплатные модели OpenRouter ограничены 20 запросами в минуту
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "20"))
+# 0 - без ограничения по токенам
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "0"))
+# Сколько запросов можно отправить подряд без паузы. Маленький запас равномерно
+# распределяет запросы по минуте и не упирается в скользящее окно квоты OpenRouter
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "1"))
+# Лимиты отдельных моделей: {"model": {"rpm": 10, "tpm": 40000}}
+RATE_LIMIT_MODELS = json.loads(os.getenv("RATE_LIMIT_MODELS", "{}"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "100"))
+# Пауза после 429 без заголовков о времени сброса
+RATE_LIMIT_DEFAULT_PENALTY = float(os.getenv("RATE_LIMIT_DEFAULT_PENALTY", "5"))
+# Пауза насоса очереди после ошибки общего хранилища
+RATE_LIMIT_PUMP_BACKOFF = float(os.getenv("RATE_LIMIT_PUMP_BACKOFF", "0.5"))
+
+# Клиент, от имени которого идёт запрос; выставляется middleware
+client_id_var = contextvars.ContextVar("client_id", default="background")
+
+
+def estimate_cost(messages):
+    """Оценка токенов запроса: промпт плюс ответ примерно той же длины, что и текст"""
+    return prompts.estimate_prompt_tokens(messages) + prompts.estimate_completion_tokens(messages)
+
+
+def retry_after_from_headers(headers):
+    """Секунды до снятия ограничения по заголовкам ответа 429 или None"""
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get("x-ratelimit-reset")
+    if reset:
+        try:
+            reset = float(reset)
+        except ValueError:
+            return None
+        # OpenRouter присылает время сброса в миллисекундах от эпохи
+        if reset > 1e11:
+            reset /= 1000
+        return max(0.0, reset - time.time())
+    return None
+
+
+def _bucket(records, name, rate, capacity, now):
+    """Запись token bucket с пополнением на текущий момент; rate=0 - запись только для блокировки"""
+    record = records.get(name)
+    if record is None:
+        record = {"tokens": capacity, "updated": now, "blocked": 0.0}
+        records[name] = record
+    if rate > 0:
+        record["tokens"] = min(capacity, record["tokens"] + max(0.0, now - record["updated"]) * rate)
+    record["updated"] = now
+    return record
+
+
+class ModelLimiter:
+    """
+    Квоты одной модели и очередь ожидающих запросов с круговым обслуживанием клиентов.
+    Сами token bucket лежат в общем хранилище (см. state), очередь - в памяти процесса
+    """
+
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        # (имя записи, пополнение в секунду, ёмкость)
+        self.requests = (f"ratelimit:{model}:requests", rpm / 60.0, min(rpm, max(1.0, RATE_LIMIT_BURST)))
+        self.tokens = (f"ratelimit:{model}:tokens", tpm / 60.0, tpm) if tpm > 0 else None
+        self.queues = OrderedDict()  # client -> deque[(future, cost)]
+        self.waiting = 0
+        self.last_wait = 0.0
+        self.stats = {"granted": 0, "queued": 0, "shed": 0, "upstream_429": 0}
+        self._pump = None
+
+    def _names(self):
+        return [self.requests[0]] + ([self.tokens[0]] if self.tokens is not None else [])
+
+    async def try_take(self, cost):
+        """Забирает квоту, если её хватает. Возвращает 0 или сколько секунд ещё ждать"""
+
+        def take(records, now):
+            requests = _bucket(records, *self.requests, now)
+            request_rate = self.requests[1]
+            wait = max(0.0, requests["blocked"] - now)
+            if request_rate > 0 and requests["tokens"] < 1:
+                wait = max(wait, (1 - requests["tokens"]) / request_rate)
+            tokens, need = None, 0
+            if self.tokens is not None:
+                _, token_rate, capacity = self.tokens
+                tokens = _bucket(records, *self.tokens, now)
+                # Запрос дороже всей ёмкости ждёт полного ведра, а не вечно
+                need = min(cost, capacity)
+                if tokens["tokens"] < need:
+                    wait = max(wait, (need - tokens["tokens"]) / token_rate)
+            if wait == 0:
+                if request_rate > 0:
+                    requests["tokens"] -= 1
+                if tokens is not None:
+                    tokens["tokens"] -= need
+            return wait
+
+        wait = await _store.transact(self._names(), take)
+        if wait == 0:
+            self.stats["granted"] += 1
+        return wait
+
+    def expected_wait(self, wait):
+        """Ожидание с учётом уже стоящих в очереди запросов"""
+        rate = self.requests[1]
+        return wait + (self.waiting / rate if rate > 0 else 0.0)
+
+    async def acquire(self, cost, client, max_wait):
+        """Возвращает True, если запрос можно отправлять, и False, если он отклонён"""
+        if not self.waiting:
+            wait = await self.try_take(cost)
+            if wait == 0:
+                return True
+        else:
+            wait = self.last_wait
+        if self.waiting >= RATE_LIMIT_MAX_QUEUE or self.expected_wait(wait) > max_wait:
+            self.stats["shed"] += 1
+            metrics.RATE_LIMITED.labels(model=self.model, reason="shed").inc()
+            return False
+
+        self.stats["queued"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(client, deque()).append((future, cost))
+        self.waiting += 1
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.ensure_future(self._run_pump())
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=max_wait)
+        except asyncio.TimeoutError:
+            # Отменённое ожидание насос очереди пропустит
+            self.stats["shed"] += 1
+            metrics.RATE_LIMITED.labels(model=self.model, reason="shed").inc()
+            return False
+        metrics.RATE_LIMIT_WAIT.labels(model=self.model).observe(time.monotonic() - started)
+        return True
+
+    async def _run_pump(self):
+        while self.queues:
+            try:
+                await self._pump_once()
+            except Exception as e:
+                # Сбой хранилища не должен останавливать насос: ждущие запросы иначе висели бы до таймаута
+                logger.error(f"Rate limiter queue for {self.model} failed: {str(e)}")
+                await asyncio.sleep(RATE_LIMIT_PUMP_BACKOFF)
+
+    async def _pump_once(self):
+        client, waiters = next(iter(self.queues.items()))
+        future, cost = waiters[0]
+        if future.done():
+            self._pop(client)
+            return
+        wait = await self.try_take(cost)
+        if future.done():
+            # Ожидание истекло, пока забиралась квота: квота уже списана, отдаём её следующему
+            self._pop(client)
+            if wait == 0:
+                await self._refund(cost)
+            return
+        if wait > 0:
+            self.last_wait = wait
+            await asyncio.sleep(wait)
+            return
+        self.last_wait = 0.0
+        self._pop(client)
+        future.set_result(True)
+        # Следующим обслуживается другой клиент
+        if client in self.queues:
+            self.queues.move_to_end(client)
+
+    def _pop(self, client):
+        waiters = self.queues[client]
+        waiters.popleft()
+        self.waiting -= 1
+        if not waiters:
+            del self.queues[client]
+
+    async def _refund(self, cost):
+        await self.settle(cost, 0, requests=-1)
+
+    async def penalize(self, seconds):
+        def block(records, now):
+            requests = _bucket(records, *self.requests, now)
+            requests["blocked"] = max(requests["blocked"], now + seconds)
+            requests["tokens"] = min(requests["tokens"], 0.0)
+
+        await _store.transact([self.requests[0]], block)
+        self.stats["upstream_429"] += 1
+        metrics.RATE_LIMITED.labels(model=self.model, reason="upstream").inc()
+
+    async def settle(self, estimated, actual, requests=0):
+        """Поправка расхода: токены по фактическому usage, запросы - при возврате квоты"""
+        names = ([self.tokens[0]] if self.tokens is not None and actual != estimated else [])
+        names += [self.requests[0]] if requests else []
+        if not names:
+            return
+
+        def adjust(records, now):
+            if requests:
+                record = _bucket(records, *self.requests, now)
+                record["tokens"] = min(self.requests[2], record["tokens"] - requests)
+            if self.tokens is not None and actual != estimated:
+                record = _bucket(records, *self.tokens, now)
+                record["tokens"] = min(self.tokens[2], record["tokens"] - (actual - estimated))
+
+        await _store.transact(names, adjust)
+
+    async def snapshot(self):
+        def read(records, now):
+            requests = _bucket(records, *self.requests, now)
+            tokens = _bucket(records, *self.tokens, now) if self.tokens is not None else None
+            return {
+                "blocked_for_s": round(max(0.0, requests["blocked"] - now), 1),
+                "requests_available": round(requests["tokens"], 1) if self.requests[1] > 0 else None,
+                "tokens_available": round(tokens["tokens"]) if tokens is not None else None,
+            }
+
+        return {**self.stats, "waiting": self.waiting, **await _store.transact(self._names(), read)}
+
+
+_store = state.LocalState()
+_limiters = {}
+
+
+def configure(store):
+    """Переносит token bucket в общее хранилище (см. state.open_state)"""
+    global _store
+    _store = store
+
+
+def get_limiter(model):
+    limiter = _limiters.get(model)
+    if limiter is None:
+        limits = RATE_LIMIT_MODELS.get(model, {})
+        limiter = ModelLimiter(model, float(limits.get("rpm", RATE_LIMIT_RPM)), float(limits.get("tpm", RATE_LIMIT_TPM)))
+        _limiters[model] = limiter
+    return limiter
+
+
+async def acquire(model, cost, max_wait=RATE_LIMIT_MAX_WAIT):
+    if not RATE_LIMIT_ENABLED:
+        return True
+    return await get_limiter(model).acquire(cost, client_id_var.get(), max_wait)
+
+
+async def penalize(model, headers):
+    """Учитывает ответ 429 от OpenRouter"""
+    seconds = retry_after_from_headers(headers)
+    if seconds is None:
+        seconds = RATE_LIMIT_DEFAULT_PENALTY
+    logger.warning(f"Upstream rate limit for {model}, pausing it for {seconds:.1f}s")
+    if RATE_LIMIT_ENABLED:
+        await get_limiter(model).penalize(seconds)
+
+
+async def settle(model, estimated, usage):
+    """Уточняет расход токенов по фактическому usage ответа"""
+    if not RATE_LIMIT_ENABLED or not usage:
+        return
+    actual = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+    if actual:
+        await get_limiter(model).settle(estimated, actual)
+
+
+def retry_after_hint(models):
+    """Через сколько секунд освободится квота хотя бы одной модели (по последним наблюдениям очереди)"""
+    waits = [get_limiter(model).expected_wait(get_limiter(model).last_wait) for model in models]
+    return max(1, math.ceil(min(waits))) if waits else 1
+
+
+async def get_stats():
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "shared": _store.shared,
+        "models": {model: await limiter.snapshot() for model, limiter in _limiters.items()},
+    }
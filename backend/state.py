@@ -0,0 +1,244 @@
+"""
+Общее состояние нескольких процессов backend.
+
+STATE_BACKEND выбирает хранилище:
+- local - память процесса (один воркер, поведение по умолчанию);
+- sqlite - файл SQLite, общий для воркеров на одной машине;
+- redis - Redis-совместимый сервер, общий для нескольких машин.
+
+Хранилище даёт две операции. transact(names, fn) атомарно читает записи,
+передаёт их функции fn и сохраняет изменённые - на ней построены token
+bucket ограничителя частоты. publish/fetch_events - журнал событий: каждый
+процесс пишет свои события (исходы вызовов моделей) и применяет к своей
+статистике события остальных процессов.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "local").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "data/state.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "llm_translator:")
+# Сколько последних событий хранится в журнале
+STATE_EVENTS_MAX = int(os.getenv("STATE_EVENTS_MAX", "10000"))
+# Записи ограничителя частоты, к которым не обращались столько секунд, удаляются
+STATE_RECORD_TTL = int(os.getenv("STATE_RECORD_TTL", "3600"))
+
+
+def new_origin():
+    """
+    Идентификатор хранилища в журнале событий: свои события повторно не применяются.
+    Создаётся при открытии хранилища, а не при импорте, чтобы не совпасть у процессов после fork
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LocalState:
+    """Состояние в памяти одного процесса"""
+
+    shared = False
+
+    def __init__(self):
+        self._records = {}
+
+    async def transact(self, names, fn):
+        records = {name: self._records.get(name) for name in names}
+        result = fn(records, time.time())
+        self._records.update((name, record) for name, record in records.items() if record is not None)
+        return result
+
+    async def publish(self, events):
+        pass
+
+    async def fetch_events(self):
+        return []
+
+    async def close(self):
+        pass
+
+
+class SQLiteState:
+    """Состояние в файле SQLite; атомарность между процессами даёт BEGIN IMMEDIATE"""
+
+    shared = True
+
+    def __init__(self, path=STATE_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state_records (name TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state_events ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._origin = new_origin()
+        # Читаем только события, опубликованные после запуска процесса: старые неудачи из
+        # журнала иначе заново открыли бы circuit breaker у каждого нового воркера
+        self._cursor = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM state_events").fetchone()[0]
+        self._published = 0
+
+    def _transact(self, names, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ", ".join("?" for _ in names)
+                rows = self._conn.execute(
+                    f"SELECT name, value FROM state_records WHERE name IN ({placeholders})", tuple(names)
+                ).fetchall()
+                records = {name: None for name in names}
+                records.update((name, json.loads(value)) for name, value in rows)
+                now = time.time()
+                result = fn(records, now)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO state_records (name, value, updated_at) VALUES (?, ?, ?)",
+                    [(name, json.dumps(record), now) for name, record in records.items() if record is not None],
+                )
+                self._conn.execute("DELETE FROM state_records WHERE updated_at < ?", (now - STATE_RECORD_TTL,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    async def transact(self, names, fn):
+        return await asyncio.to_thread(self._transact, names, fn)
+
+    def _publish(self, events):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT INTO state_events (origin, payload) VALUES (?, ?)",
+                [(self._origin, json.dumps(event)) for event in events],
+            )
+            self._published += len(events)
+            if self._published >= STATE_EVENTS_MAX // 10:
+                self._published = 0
+                self._conn.execute(
+                    "DELETE FROM state_events WHERE id <= (SELECT MAX(id) FROM state_events) - ?", (STATE_EVENTS_MAX,)
+                )
+            self._conn.execute("COMMIT")
+
+    async def publish(self, events):
+        if events:
+            await asyncio.to_thread(self._publish, events)
+
+    def _fetch_events(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, origin, payload FROM state_events WHERE id > ? ORDER BY id LIMIT ?",
+                (self._cursor, STATE_EVENTS_MAX),
+            ).fetchall()
+        if rows:
+            self._cursor = rows[-1][0]
+        return [json.loads(payload) for _, origin, payload in rows if origin != self._origin]
+
+    async def fetch_events(self):
+        return await asyncio.to_thread(self._fetch_events)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisState:
+    """Состояние в Redis-совместимом сервере; атомарность даёт WATCH/MULTI"""
+
+    shared = True
+
+    def __init__(self, url=REDIS_URL, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError:
+                raise RuntimeError("STATE_BACKEND=redis requires the redis package")
+            client = redis_asyncio.Redis.from_url(url)
+        self._redis = client
+        self._events_key = f"{STATE_KEY_PREFIX}events"
+        self._origin = new_origin()
+        # Позиция в журнале; при первом чтении ставится на последнее событие (аналог "$")
+        self._cursor = None
+
+    def _key(self, name):
+        return f"{STATE_KEY_PREFIX}{name}"
+
+    async def transact(self, names, fn):
+        from redis.exceptions import WatchError
+
+        keys = [self._key(name) for name in names]
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(*keys)
+                    values = [await pipe.get(key) for key in keys]
+                    records = {name: json.loads(value) if value else None for name, value in zip(names, values)}
+                    result = fn(records, time.time())
+                    pipe.multi()
+                    for name, record in records.items():
+                        if record is not None:
+                            pipe.set(self._key(name), json.dumps(record), ex=STATE_RECORD_TTL)
+                    await pipe.execute()
+                    return result
+                except WatchError:
+                    # Запись изменил другой процесс - повторяем с новыми значениями
+                    continue
+
+    async def publish(self, events):
+        if not events:
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(
+                    self._events_key,
+                    {"origin": self._origin, "payload": json.dumps(event)},
+                    maxlen=STATE_EVENTS_MAX,
+                    approximate=True,
+                )
+            await pipe.execute()
+
+    async def fetch_events(self):
+        if self._cursor is None:
+            # "$" работает только с блокирующим XREAD, поэтому последний id берём явно
+            last = await self._redis.xrevrange(self._events_key, count=1)
+            self._cursor = last[0][0] if last else "0-0"
+            return []
+        response = await self._redis.xread({self._events_key: self._cursor}, count=STATE_EVENTS_MAX)
+        events = []
+        for _, entries in response:
+            for entry_id, fields in entries:
+                self._cursor = entry_id
+                if fields[b"origin"].decode() != self._origin:
+                    events.append(json.loads(fields[b"payload"]))
+        return events
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+STATE_BACKENDS = {
+    "local": LocalState,
+    "sqlite": SQLiteState,
+    "redis": RedisState,
+}
+
+
+def open_state(backend=STATE_BACKEND):
+    if backend not in STATE_BACKENDS:
+        raise ValueError(f"Unknown STATE_BACKEND: {backend}. Available: {', '.join(STATE_BACKENDS)}")
+    store = STATE_BACKENDS[backend]()
+    logger.info(f"Shared state backend: {backend}")
+    return store
@@ -0,0 +1,278 @@
+"""
+Память переводов: пары предложений исходный текст/перевод по языковым парам
+с нечётким поиском.
+
+Пары хранятся в SQLite, поэтому объём ограничен диском, а не памятью. Для
+поиска каждое предложение получает MinHash-сигнатуру по символьным триграммам,
+сигнатура делится на полосы (LSH), и хеши полос лежат в индексированной
+таблице. Кандидаты, совпавшие хотя бы по одной полосе, сравниваются точно
+(difflib). Без обращения к модели отдаются только предложения, совпадающие с
+сохранёнными дословно (с точностью до пробелов): даже регистр и пунктуация
+меняют перевод ("C#" и "C++", вопрос и утверждение). Похожие предложения
+передаются модели как образец перевода. При переполнении вытесняются
+предложения, которые дольше всех не сохранялись и не находились.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from difflib import SequenceMatcher
+
+import numpy as np
+
+import metrics
+from cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+TM_ENABLED = os.getenv("TM_ENABLED", "true").lower() in ("1", "true", "yes")
+TM_DB_PATH = os.getenv("TM_DB_PATH", "data/translation_memory.sqlite3")
+# Сходство, начиная с которого сохранённый перевод передаётся модели как образец
+TM_CONTEXT_THRESHOLD = float(os.getenv("TM_CONTEXT_THRESHOLD", "0.75"))
+TM_MAX_REFERENCES = int(os.getenv("TM_MAX_REFERENCES", "5"))
+TM_MAX_SEGMENTS = int(os.getenv("TM_MAX_SEGMENTS", "2000000"))
+# Сколько кандидатов из LSH сравнивается точно
+TM_CANDIDATES = int(os.getenv("TM_CANDIDATES", "20"))
+# Более короткие предложения не передаются модели как нечёткие образцы
+TM_MIN_FUZZY_CHARS = int(os.getenv("TM_MIN_FUZZY_CHARS", "20"))
+
+# 16 полос по 4 строки: предложения с Жаккаром триграмм 0.6 находятся с вероятностью ~0.9,
+# а случайные совпадения дают порядка сотни кандидатов на миллион предложений
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_SIZE = 3
+EVICT_EVERY = 1000
+# Время последнего попадания записывается пачкой раз в столько попаданий
+TOUCH_BATCH = 200
+
+_PRIME = np.uint64(4294967311)  # простое число больше 2^32
+_perm_rng = np.random.RandomState(20240601)
+_PERM_A = _perm_rng.randint(1, 2 ** 31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)[:, None]
+_PERM_B = _perm_rng.randint(0, 2 ** 31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)[:, None]
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?。！？؟।])\s+")
+
+
+def split_sentences(text):
+    """Делит текст на предложения, возвращая пары (предложение, разделитель после него)"""
+    pieces, position = [], 0
+    for match in _SENTENCE_RE.finditer(text):
+        pieces.append((text[position:match.start()], match.group(0)))
+        position = match.end()
+    pieces.append((text[position:], ""))
+    return [(sentence, separator) for sentence, separator in pieces if sentence.strip()]
+
+
+def minhash(text):
+    """MinHash-сигнатура по символьным триграммам текста в нижнем регистре"""
+    text = text.lower()
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((_PERM_A * hashes + _PERM_B) % _PRIME).min(axis=1)
+
+
+def band_buckets(pair, signature):
+    """Хеши полос сигнатуры; языковая пара входит в хеш, поэтому пары не пересекаются"""
+    buckets = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+        digest = hashlib.blake2b(f"{pair}\0{band}".encode("utf-8") + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "big", signed=True))
+    return buckets
+
+
+def similarity(a, b):
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def source_key(pair, source):
+    """Ключ дословного совпадения: языковая пара и нормализованный исходный текст"""
+    return hashlib.sha256(f"{pair}\0{source}".encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """Хранилище пар предложений в SQLite. Методы синхронные и вызываются через asyncio.to_thread."""
+
+    def __init__(self, path=TM_DB_PATH, max_segments=TM_MAX_SEGMENTS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_segments = max_segments
+        self.stats = {"lookups": 0, "direct": 0, "context": 0, "misses": 0, "added": 0}
+        self._lock = threading.Lock()
+        self._inserts_since_evict = 0
+        self._touched = {}  # id предложения -> время попадания, ещё не записанное в базу
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tm_segments ("
+            " id INTEGER PRIMARY KEY,"
+            " source_key TEXT NOT NULL UNIQUE,"
+            " pair TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " target TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tm_buckets ("
+            " bucket INTEGER NOT NULL,"
+            " segment_id INTEGER NOT NULL,"
+            " PRIMARY KEY (bucket, segment_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tm_buckets_segment ON tm_buckets (segment_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tm_segments_updated ON tm_segments (updated_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def pair_key(source_language, target_language):
+        return f"{source_language.strip().lower()}->{target_language.strip().lower()}"
+
+    def add(self, source_text, translated_text, source_language, target_language):
+        """
+        Сохраняет перевод по предложениям. Если число предложений в исходном тексте
+        и переводе не совпадает, сохраняется весь текст целиком
+        """
+        pair = self.pair_key(source_language, target_language)
+        sources = split_sentences(source_text)
+        targets = split_sentences(translated_text)
+        if len(sources) == len(targets):
+            pairs = [(source, target) for (source, _), (target, _) in zip(sources, targets)]
+        else:
+            pairs = [(source_text, translated_text)]
+        now = time.time()
+        with self._lock:
+            for source, target in pairs:
+                source, target = normalize_text(source), normalize_text(target)
+                key = source_key(pair, source)
+                self._conn.execute(
+                    "INSERT INTO tm_segments (source_key, pair, source, target, updated_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (source_key) DO UPDATE SET target = excluded.target, updated_at = excluded.updated_at",
+                    (key, pair, source, target, now),
+                )
+                segment_id = self._conn.execute(
+                    "SELECT id FROM tm_segments WHERE source_key = ?", (key,)
+                ).fetchone()[0]
+                self._touched.pop(segment_id, None)
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO tm_buckets (bucket, segment_id) VALUES (?, ?)",
+                    [(bucket, segment_id) for bucket in band_buckets(pair, minhash(source))],
+                )
+            self._flush_touched()
+            self._conn.commit()
+            self.stats["added"] += len(pairs)
+            self._inserts_since_evict += len(pairs)
+            if self._inserts_since_evict >= EVICT_EVERY:
+                self._inserts_since_evict = 0
+                self._evict()
+
+    def _flush_touched(self):
+        """Записывает время последних попаданий; коммит делает вызывающий"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE tm_segments SET updated_at = ? WHERE id = ?",
+                [(touched_at, segment_id) for segment_id, touched_at in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        """Удаляет сверх max_segments предложения, которые дольше всех не сохранялись и не находились"""
+        count = self._conn.execute("SELECT COUNT(*) FROM tm_segments").fetchone()[0]
+        if count <= self.max_segments:
+            return
+        ids = self._conn.execute(
+            "SELECT id FROM tm_segments ORDER BY updated_at, id LIMIT ?", (count - self.max_segments,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM tm_buckets WHERE segment_id = ?", ids)
+        self._conn.executemany("DELETE FROM tm_segments WHERE id = ?", ids)
+        self._conn.commit()
+        logger.info(f"Translation memory evicted {len(ids)} segments")
+
+    def _exact_match(self, pair, sentence):
+        """Дословно совпадающее сохранённое предложение: (исходный текст, перевод) или None"""
+        row = self._conn.execute(
+            "SELECT id, source, target FROM tm_segments WHERE source_key = ?", (source_key(pair, sentence),)
+        ).fetchone()
+        if row is None:
+            return None
+        self._touched[row[0]] = time.time()
+        if len(self._touched) >= TOUCH_BATCH:
+            self._flush_touched()
+            self._conn.commit()
+        return row[1], row[2]
+
+    def _best_match(self, pair, sentence):
+        """Самое похожее сохранённое предложение: (сходство, исходный текст, перевод) или None"""
+        buckets = band_buckets(pair, minhash(sentence))
+        placeholders = ", ".join("?" for _ in buckets)
+        rows = self._conn.execute(
+            "SELECT s.source, s.target FROM tm_buckets b JOIN tm_segments s ON s.id = b.segment_id"
+            f" WHERE b.bucket IN ({placeholders}) AND s.pair = ?"
+            " GROUP BY s.id ORDER BY COUNT(*) DESC LIMIT ?",
+            (*buckets, pair, TM_CANDIDATES),
+        ).fetchall()
+        best = None
+        for source, target in rows:
+            score = similarity(sentence, source)
+            if best is None or score > best[0]:
+                best = (score, source, target)
+        return best
+
+    def lookup(self, text, source_language, target_language):
+        """
+        Ищет предложения текста в памяти.
+        Возвращает (перевод, образцы): перевод - собранный текст, если все предложения
+        найдены дословно, иначе None; образцы - список пар (исходный текст, перевод)
+        для найденных и похожих предложений
+        """
+        pair = self.pair_key(source_language, target_language)
+        translations, references = [], []
+        direct = True
+        sentences = split_sentences(text)
+        with self._lock:
+            self.stats["lookups"] += 1
+            # Перевод, который не удалось разбить по предложениям, хранится целиком
+            if len(sentences) > 1:
+                exact = self._exact_match(pair, normalize_text(text))
+                if exact is not None:
+                    sentences, translations = [], [exact[1]]
+            for sentence, separator in sentences:
+                sentence = normalize_text(sentence)
+                exact = self._exact_match(pair, sentence)
+                if exact is not None:
+                    translations.append(exact[1] + separator)
+                    if len(references) < TM_MAX_REFERENCES:
+                        references.append(exact)
+                    continue
+                # Похожее предложение никогда не отдаётся как ответ, только как образец для модели
+                direct = False
+                if len(sentence) < TM_MIN_FUZZY_CHARS or len(references) >= TM_MAX_REFERENCES:
+                    continue
+                match = self._best_match(pair, sentence)
+                if match is not None and match[0] >= TM_CONTEXT_THRESHOLD:
+                    references.append((match[1], match[2]))
+
+            if direct and translations:
+                self.stats["direct"] += 1
+                metrics.TM_LOOKUPS.labels(result="direct").inc()
+                return "".join(translations).strip(), []
+            result = "context" if references else "miss"
+            self.stats["context" if references else "misses"] += 1
+        metrics.TM_LOOKUPS.labels(result=result).inc()
+        return None, references
+
+    def get_stats(self):
+        with self._lock:
+            segments = self._conn.execute("SELECT COUNT(*) FROM tm_segments").fetchone()[0]
+            return {**self.stats, "segments": segments}
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
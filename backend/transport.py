@@ -0,0 +1,111 @@
+"""
+Транспортный слой для OpenRouter: один долгоживущий асинхронный HTTP-клиент
+на всё время жизни приложения.
+
+И клиент OpenAI SDK, и запасной путь через "сырой" HTTP используют один и тот же
+пул соединений, поэтому keep-alive и TLS-сессии переиспользуются между запросами.
+"""
+import os
+import logging
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+
+# Параметры пула соединений (настраиваются через переменные окружения)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+_http_client = None
+_openai_clients = {}
+
+
+def _http2_available():
+    """HTTP/2 включается только если установлен пакет h2"""
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.info("Package h2 is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+async def startup():
+    """Создаёт общий пул соединений. Вызывается при старте приложения."""
+    global _http_client
+    if _http_client is not None:
+        return
+    http2 = _http2_available()
+    _http_client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+    logger.info(
+        f"HTTP transport started: base_url={OPENROUTER_BASE_URL}, "
+        f"max_connections={HTTP_MAX_CONNECTIONS}, keepalive={HTTP_MAX_KEEPALIVE_CONNECTIONS}, "
+        f"http2={http2}"
+    )
+
+
+async def shutdown():
+    """Закрывает пул соединений. Вызывается при остановке приложения."""
+    global _http_client
+    _openai_clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("HTTP transport stopped")
+
+
+def get_http_client():
+    """Возвращает общий httpx.AsyncClient"""
+    if _http_client is None:
+        raise RuntimeError("HTTP transport is not started")
+    return _http_client
+
+
+def get_openai_client(api_key, max_retries=OPENAI_MAX_RETRIES):
+    """
+    Возвращает AsyncOpenAI, работающий поверх общего пула соединений.
+    Клиент кешируется по ключу API и числу повторов, чтобы не пересоздавать его на каждый запрос.
+    """
+    client = _openai_clients.get((api_key, max_retries))
+    if client is None:
+        client = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=api_key,
+            http_client=get_http_client(),
+            max_retries=max_retries,
+            timeout=HTTP_TIMEOUT,
+        )
+        _openai_clients[(api_key, max_retries)] = client
+    return client
+
+
+async def post_chat_completion(payload, api_key, site_url, site_name):
+    """Прямой POST на /chat/completions через тот же пул соединений"""
+    return await get_http_client().post(
+        f"{OPENROUTER_BASE_URL}/chat/completions",
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": site_url,
+            "X-Title": site_name,
+        },
+        json=payload,
+    )
@@ -0,0 +1,223 @@
+"""
+Проверка ответа модели перед тем, как считать его переводом.
+
+Шаблоны метакомментариев компилируются один раз при импорте и применяются
+к тексту, приведённому к нижнему регистру один раз. Письменность текста
+определяется гистограммой кодовых точек на NumPy по таблице диапазонов
+Unicode, без посимвольных циклов на Python.
+"""
+import logging
+import os
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Доля букв "чужой" письменности исходного языка, после которой перевод отклоняется
+SCRIPT_FOREIGN_MAX = float(os.getenv("SCRIPT_FOREIGN_MAX", "0.3"))
+# Минимальная доля букв письменности целевого языка, если она отличается от исходной
+SCRIPT_TARGET_MIN = float(os.getenv("SCRIPT_TARGET_MIN", "0.3"))
+
+# Слова и конструкции, указывающие на метакомментарии переводчика
+META_PATTERNS = [
+    r'translation[:\s]',
+    r'translated[:\s]',
+    r'here is[:\s]',
+    r'перевод[:\s]',
+    r'\[.*?\]',  # Текст в квадратных скобках
+    r'\(.*?\)'   # Текст в круглых скобках
+]
+
+
+def _combine(indexes):
+    """
+    Одно регулярное выражение-альтернатива из шаблонов META_PATTERNS с номерами indexes.
+    Без групп: с ними re теряет быстрый поиск первого символа и работает в разы медленнее
+    """
+    return re.compile("|".join(META_PATTERNS[index] for index in indexes))
+
+
+# Текст приводится к нижнему регистру один раз, поэтому шаблоны компилируются без
+# re.IGNORECASE. Все шаблоны объединены в одну альтернативу: текст просматривается один раз
+_META_RE = _combine(range(len(META_PATTERNS)))
+# Отдельные шаблоны нужны, только когда в ответе что-то нашлось: чтобы назвать шаблон
+# и проверить исходный текст
+_META_RES = [re.compile(pattern) for pattern in META_PATTERNS]
+_META_SUBSETS = {}  # набор номеров шаблонов -> их альтернатива
+_WORD_RE = re.compile(r"\w+")
+
+# Диапазоны Unicode для письменностей языков интерфейса
+SCRIPT_RANGES = {
+    "latin": "A-Za-zÀ-ÖØ-öø-ɏḀ-ỿ",
+    "cyrillic": "Ѐ-ԯ",
+    "han": "㐀-䶿一-鿿豈-﫿",
+    "kana": "぀-ヿㇰ-ㇿｦ-ﾟ",
+    "hangul": "ᄀ-ᇿ㄰-㆏가-힯",
+    "arabic": "؀-ۿݐ-ݿࢠ-ࣿﭐ-﷿ﹰ-﻿",
+    "devanagari": "ऀ-ॿ",
+}
+
+
+
+def _build_script_table(script_ranges):
+    """
+    Превращает диапазоны в отсортированные границы для np.searchsorted и
+    номер письменности для каждого промежутка между границами (-1 - не буква письменности)
+    """
+    spans = []
+    for script_id, ranges in enumerate(script_ranges.values()):
+        for start, end in re.findall(r"(.)-(.)", ranges):
+            spans.append((ord(start), ord(end) + 1, script_id))
+    spans.sort()
+    bounds, bin_scripts = [], [-1]
+    for start, end, script_id in spans:
+        if bounds and bounds[-1] == start:
+            bin_scripts[-1] = script_id
+        else:
+            bounds.append(start)
+            bin_scripts.append(script_id)
+        bounds.append(end)
+        bin_scripts.append(-1)
+    return np.array(bounds, dtype=np.uint32), np.array(bin_scripts)
+
+
+SCRIPTS = list(SCRIPT_RANGES)
+_SCRIPT_BOUNDS, _BIN_SCRIPTS = _build_script_table(SCRIPT_RANGES)
+
+# Письменности, которыми пишут на каждом языке
+LANGUAGE_SCRIPTS = {
+    "english": ("latin",),
+    "spanish": ("latin",),
+    "french": ("latin",),
+    "german": ("latin",),
+    "italian": ("latin",),
+    "portuguese": ("latin",),
+    "russian": ("cyrillic",),
+    "ukrainian": ("cyrillic",),
+    "bulgarian": ("cyrillic",),
+    "serbian": ("cyrillic",),
+    "chinese": ("han",),
+    "japanese": ("han", "kana"),
+    "korean": ("hangul", "han"),
+    "arabic": ("arabic",),
+    "hindi": ("devanagari",),
+}
+
+
+def normalize(text):
+    """Схлопывает пробельные символы, как re.sub(r'\\s+', ' ', text.strip())"""
+    return " ".join(text.split())
+
+
+def find_meta_commentary(text, source_text=None):
+    """
+    Возвращает шаблон метакомментария, найденный в тексте, или None.
+    Шаблоны, которые находятся и в исходном тексте (ссылка Markdown, тег субтитров
+    "[MUSIC PLAYING]", "Price (USD)"), не проверяются: скобки в переводе тогда
+    перенесены из исходного текста, а не добавлены моделью.
+    Работает и на начале ответа, поэтому используется для ранней проверки потока
+    """
+    text = text.lower()
+    match = _META_RE.search(text)
+    if match is None:
+        return None
+    indexes = range(len(META_PATTERNS))
+    if source_text:
+        # Редкий случай: что-то нашлось, и нужно исключить шаблоны, которые есть в исходном тексте
+        source_text = source_text.lower()
+        indexes = tuple(index for index, compiled in enumerate(_META_RES) if not compiled.search(source_text))
+        if len(indexes) < len(META_PATTERNS):
+            if not indexes:
+                return None
+            if indexes not in _META_SUBSETS:
+                _META_SUBSETS[indexes] = _combine(indexes)
+            match = _META_SUBSETS[indexes].search(text)
+            if match is None:
+                return None
+    found = match.group()
+    return next(META_PATTERNS[index] for index in indexes if _META_RES[index].fullmatch(found))
+
+
+def script_histogram(text):
+    """Количество символов каждой письменности из SCRIPT_RANGES за один проход"""
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    bins = np.bincount(np.searchsorted(_SCRIPT_BOUNDS, codepoints, side="right"), minlength=len(_BIN_SCRIPTS))
+    counts = np.bincount(_BIN_SCRIPTS[_BIN_SCRIPTS >= 0], weights=bins[_BIN_SCRIPTS >= 0], minlength=len(SCRIPTS))
+    return dict(zip(SCRIPTS, counts.astype(int).tolist()))
+
+
+def _script_reason(counts, foreign_scripts, target_scripts, target_language):
+    """Причина отклонения по гистограмме письменностей или None"""
+    # Доли считаются только от букв: цифры и пунктуация не говорят о языке текста
+    total = sum(counts.values())
+    if not total:
+        return None
+
+    # Слишком много букв письменности исходного языка
+    for script in foreign_scripts:
+        if counts[script] > total * SCRIPT_FOREIGN_MAX:
+            return f"too many {script} characters for {target_language}"
+
+    # Слишком мало букв письменности целевого языка
+    if sum(counts[script] for script in target_scripts) < total * SCRIPT_TARGET_MIN:
+        return f"too few {'/'.join(target_scripts)} characters for {target_language}"
+    return None
+
+
+def _drop_source_words(translated_text, source_text):
+    """Убирает из перевода слова, которые есть в исходном тексте (названия, модели, коды)"""
+    source_words = set(_WORD_RE.findall(source_text.lower()))
+    return _WORD_RE.sub(lambda match: "" if match.group().lower() in source_words else match.group(), translated_text)
+
+
+def check_script(translated_text, source_language, target_language, source_text=None):
+    """
+    Проверяет, что перевод написан письменностью целевого языка.
+    Ожидает текст с уже схлопнутыми пробелами. Если передан исходный текст, слова,
+    перенесённые из него без перевода ("iPhone 15 Pro Max"), в долях не учитываются.
+    Возвращает причину отклонения или None.
+    """
+    source_scripts = LANGUAGE_SCRIPTS.get(source_language.lower())
+    target_scripts = LANGUAGE_SCRIPTS.get(target_language.lower())
+    if not source_scripts or not target_scripts:
+        return None
+    foreign_scripts = [script for script in source_scripts if script not in target_scripts]
+    if not foreign_scripts:
+        return None
+
+    reason = _script_reason(script_histogram(translated_text), foreign_scripts, target_scripts, target_language)
+    if reason is None or not source_text:
+        return reason
+    # Разбор по словам дороже гистограммы, поэтому выполняется, только если быстрая проверка не прошла
+    remaining = _drop_source_words(translated_text, source_text)
+    counts = script_histogram(remaining)
+    if not sum(counts.values()):
+        # Перевод целиком состоит из слов исходного текста - это не перевод
+        return reason
+    return _script_reason(counts, foreign_scripts, target_scripts, target_language)
+
+
+def check_translation(source_text, translated_text, source_language, target_language):
+    """
+    Проверяет, является ли перевод валидным:
+    - Не совпадает с исходным текстом
+    - Не содержит пояснений и комментариев переводчика
+    - Не пустой
+    - Написан письменностью целевого языка
+    Возвращает причину отклонения или None, если перевод валиден.
+    """
+    translated_clean = normalize(translated_text or "")
+    if not translated_clean:
+        return "translation is empty"
+
+    # Сравнение без учёта регистра; lower() вызывается, только если длины совпадают
+    source_clean = normalize(source_text)
+    if len(source_clean) == len(translated_clean) and source_clean.lower() == translated_clean.lower():
+        return "output matches input exactly"
+
+    pattern = find_meta_commentary(translated_clean, source_clean)
+    if pattern:
+        return f"meta commentary matching pattern {pattern}"
+
+    return check_script(translated_clean, source_language, target_language, source_clean)
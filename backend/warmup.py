@@ -0,0 +1,230 @@
+"""
+Прогрев кеша переводов по журналу запросов.
+
+Успешные запросы /translate и /translate/stream дописываются в журнал
+REQUEST_LOG_PATH (JSONL: text, source_language, target_language, ts). При старте
+и затем каждые WARMUP_INTERVAL секунд журнал WARMUP_LOG_PATH читается потоково,
+для пар (текст, языковая пара) считается частота, и самые частые переводятся
+заранее, не больше WARMUP_BUDGET за проход. Записи, уже лежащие на диске,
+при этом поднимаются в память процесса, поэтому после перезапуска первые
+запросы не ходят даже в дисковый кеш.
+
+При нескольких воркерах переводит только тот, кто взял аренду в общем
+хранилище состояния (state), остальные лишь поднимают записи в свою память.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LOG_PATH = os.getenv("REQUEST_LOG_PATH", "")
+# При превышении размера журнал переименовывается в .1 (предыдущий .1 удаляется)
+REQUEST_LOG_MAX_BYTES = int(os.getenv("REQUEST_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+# Длинные тексты не записываются: они редко повторяются дословно
+REQUEST_LOG_MAX_CHARS = int(os.getenv("REQUEST_LOG_MAX_CHARS", "2000"))
+# Строки копятся в памяти и пишутся в файл в потоке раз в столько секунд
+REQUEST_LOG_FLUSH_INTERVAL = float(os.getenv("REQUEST_LOG_FLUSH_INTERVAL", "1.0"))
+# Если запись не успевает, строки сверх этого числа отбрасываются
+REQUEST_LOG_MAX_PENDING = int(os.getenv("REQUEST_LOG_MAX_PENDING", "10000"))
+
+WARMUP_LOG_PATH = os.getenv("WARMUP_LOG_PATH", REQUEST_LOG_PATH)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+# Период повторного прогрева, 0 - только при старте
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "0"))
+# Сколько переводов, которых нет в кеше, можно заказать у моделей за один проход
+WARMUP_BUDGET = int(os.getenv("WARMUP_BUDGET", "200"))
+# Сколько самых частых записей проверяется в кеше за проход
+WARMUP_TOP = int(os.getenv("WARMUP_TOP", "2000"))
+WARMUP_MIN_COUNT = int(os.getenv("WARMUP_MIN_COUNT", "2"))
+# Предел различных записей при подсчёте; при превышении отбрасываются встреченные один раз
+WARMUP_MAX_TRACKED = int(os.getenv("WARMUP_MAX_TRACKED", "100000"))
+
+# Обратное направление после успешного перевода (кнопка смены языков в интерфейсе):
+# seed - исходный текст кладётся в кеш как перевод результата обратно, без вызова модели;
+# translate - результат переводится обратно моделью в фоне; off - выключено
+SPECULATIVE_REVERSE = os.getenv("SPECULATIVE_REVERSE", "seed").lower()
+SPECULATIVE_MODES = ("seed", "translate", "off")
+# Сколько фоновых обратных переводов выполняется одновременно (лишние пропускаются)
+SPECULATIVE_PARALLELISM = int(os.getenv("SPECULATIVE_PARALLELISM", "2"))
+
+if SPECULATIVE_REVERSE not in SPECULATIVE_MODES:
+    logger.warning(f"Unknown SPECULATIVE_REVERSE: {SPECULATIVE_REVERSE}. Using seed.")
+    SPECULATIVE_REVERSE = "seed"
+
+LEASE_NAME = "warmup:lease"
+
+stats = {"runs": 0, "last_run": None, "reverse_seeded": 0, "reverse_translated": 0, "reverse_skipped": 0}
+
+
+class RequestLog:
+    """
+    Журнал запросов в JSONL; пишут все воркеры, строки дописываются в режиме append.
+    append только добавляет строку в буфер, в файл её пишет задача run в отдельном потоке,
+    поэтому обработчик запроса не ждёт диска
+    """
+
+    def __init__(self, path=REQUEST_LOG_PATH, max_bytes=REQUEST_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = []
+        self.written = 0
+        self.dropped = 0
+
+    def append(self, text, source_language, target_language):
+        if len(text) > REQUEST_LOG_MAX_CHARS or not text.strip():
+            return
+        if len(self._pending) >= REQUEST_LOG_MAX_PENDING:
+            self.dropped += 1
+            return
+        record = {"text": text, "source_language": source_language, "target_language": target_language,
+                  "ts": round(time.time(), 3)}
+        self._pending.append(json.dumps(record, ensure_ascii=False) + "\n")
+
+    async def run(self, interval=REQUEST_LOG_FLUSH_INTERVAL):
+        """Фоновая запись буфера в файл"""
+        while True:
+            await asyncio.sleep(interval)
+            if not self._pending:
+                continue
+            lines, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, lines)
+            except OSError as e:
+                logger.warning(f"Failed to write request log: {str(e)}")
+
+    def _write(self, lines):
+        # Строки пишутся одним вызовом: при нескольких воркерах они не перемешиваются внутри строки
+        self._file.write("".join(lines))
+        self._file.flush()
+        self.written += len(lines)
+        if self._file.tell() > self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        try:
+            # Другой воркер мог уже переименовать файл - тогда просто открываем новый
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except OSError as e:
+            logger.warning(f"Request log rotation failed: {str(e)}")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        """Дописывает остаток буфера и закрывает файл; вызывается после остановки run"""
+        lines, self._pending = self._pending, []
+        try:
+            if lines:
+                self._write(lines)
+        except OSError as e:
+            logger.warning(f"Failed to write request log: {str(e)}")
+        self._file.close()
+
+
+def read_log(path):
+    """(текст, исходный язык, язык перевода) из журнала и его предыдущей части; битые строки пропускаются"""
+    for name in (path + ".1", path):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    yield record["text"], record["source_language"], record["target_language"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+
+def top_entries(records, limit=WARMUP_TOP, min_count=WARMUP_MIN_COUNT, max_tracked=WARMUP_MAX_TRACKED):
+    """Самые частые записи: список ((текст, исходный язык, язык перевода), число), частые первыми"""
+    counts = Counter()
+    for text, source_language, target_language in records:
+        if source_language.strip().lower() == target_language.strip().lower():
+            continue
+        counts[(text, source_language, target_language)] += 1
+        if len(counts) > max_tracked:
+            # Редкие записи всё равно не попадут в прогрев
+            for entry in [entry for entry, count in counts.items() if count == 1]:
+                del counts[entry]
+    return [(entry, count) for entry, count in counts.most_common(limit) if count >= min_count]
+
+
+async def acquire_lease(store, ttl):
+    """True, если этот процесс прогревает кеш в ближайшие ttl секунд"""
+
+    def take(records, now):
+        lease = records[LEASE_NAME]
+        if lease is not None and lease["until"] > now:
+            return False
+        records[LEASE_NAME] = {"until": now + ttl}
+        return True
+
+    return await store.transact([LEASE_NAME], take)
+
+
+async def warm_cache(entries, lookup, translate_pair, budget=WARMUP_BUDGET, translate=True):
+    """
+    Прогревает кеш записями entries (см. top_entries).
+
+    lookup(текст, исходный язык, язык перевода) -> bool - есть ли перевод в кеше (и поднять его в память),
+    не учитываясь в статистике попаданий кеша;
+    translate_pair(исходный язык, язык перевода, тексты) -> число переведённых - перевод и запись в кеш.
+    Без translate записи только проверяются в кеше. Возвращает статистику прохода.
+    """
+    started = time.perf_counter()
+    run = {"entries": len(entries), "cached": 0, "requested": 0, "translated": 0, "translate": translate}
+    pending = {}
+    for (text, source_language, target_language), _ in entries:
+        if await lookup(text, source_language, target_language):
+            run["cached"] += 1
+            continue
+        if translate and run["requested"] < budget:
+            pending.setdefault((source_language, target_language), []).append(text)
+            run["requested"] += 1
+
+    # Тексты одной языковой пары уходят пакетами, пары - параллельно
+    translated = await asyncio.gather(*(
+        translate_pair(source_language, target_language, texts)
+        for (source_language, target_language), texts in pending.items()
+    ))
+    run.update(translated=sum(translated), elapsed_s=round(time.perf_counter() - started, 3))
+    stats["runs"] += 1
+    stats["last_run"] = run
+    return run
+
+
+async def run_periodic(warm_once, interval=WARMUP_INTERVAL, on_startup=WARMUP_ON_STARTUP):
+    """Запускает warm_once() при старте и затем каждые interval секунд; ошибки прохода не останавливают цикл"""
+    if not on_startup and interval <= 0:
+        return
+    if not on_startup:
+        await asyncio.sleep(interval)
+    while True:
+        try:
+            await warm_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cache warm-up failed: {str(e)}")
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+def get_stats():
+    return {
+        "request_log": REQUEST_LOG_PATH or None,
+        "warmup_log": WARMUP_LOG_PATH or None,
+        "interval_s": WARMUP_INTERVAL,
+        "budget": WARMUP_BUDGET,
+        "speculative_reverse": SPECULATIVE_REVERSE,
+        **stats,
+    }
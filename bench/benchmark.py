@@ -0,0 +1,227 @@
+"""
+Воспроизводимый бенчмарк backend против локального мока OpenRouter.
+
+Поднимает мок и backend с чистыми кешем и очередью заданий, прогоняет
+сценарии (translate, batch, stream, multi) на заданных уровнях конкурентности и
+выводит JSON: пропускная способность, p50/p95/p99 задержки, доля ошибок и
+число upstream-вызовов на запрос (по счётчикам мока). Для потока отдельно
+считается время до первого фрагмента.
+
+Запуск из корня репозитория:
+    python bench/benchmark.py --scenarios translate batch stream --concurrency 1 8 32 \\
+        --latency 0.3 --latency-dist lognormal --error-rate 0.05 --meta-rate 0.05 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from load_test import ROOT, start_server, wait_ready
+
+SCENARIOS = ("translate", "batch", "stream", "multi")
+# Языки интерфейса frontend, кроме исходного
+TARGET_LANGUAGES = ("Spanish", "French", "German", "Italian", "Portuguese", "Russian", "Chinese", "Japanese",
+                    "Korean", "Arabic", "Hindi")
+
+
+def percentile(values, q):
+    """Процентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies):
+    return {f"p{q}_s": round(percentile(latencies, q), 4) if latencies else None for q in (50, 95, 99)}
+
+
+def request_text(scenario, concurrency, worker, i):
+    # Уникальный текст на каждый запрос, чтобы не измерять кеш
+    return f"Hello world number {i} from worker {worker} at level {concurrency} of {scenario}"
+
+
+async def call_translate(client, base_url, text, args):
+    response = await client.post(f"{base_url}/translate", json={
+        "text": text, "source_language": "English", "target_language": "Russian", "strategy": args.strategy,
+    })
+    return response.status_code == 200, None
+
+
+async def call_batch(client, base_url, text, args):
+    response = await client.post(f"{base_url}/translate/batch", json={
+        "segments": [f"{text}, segment {n}" for n in range(args.batch_size)],
+        "source_language": "English", "target_language": "Russian", "strategy": args.strategy,
+    })
+    if response.status_code != 200:
+        return False, None
+    return response.json()["stats"]["failed"] == 0, None
+
+
+async def call_stream(client, base_url, text, args):
+    started = time.perf_counter()
+    first_delta = None
+    event = None
+    async with client.stream("POST", f"{base_url}/translate/stream", json={
+        "text": text, "source_language": "English", "target_language": "Russian",
+    }) as response:
+        if response.status_code != 200:
+            return False, None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "delta" and first_delta is None:
+                    first_delta = time.perf_counter() - started
+    return event == "done", first_delta
+
+
+async def call_multi(client, base_url, text, args):
+    response = await client.post(f"{base_url}/translate/multi", json={
+        "text": text, "source_language": "English", "target_languages": list(TARGET_LANGUAGES[:args.targets]),
+        "strategy": args.strategy,
+    })
+    if response.status_code != 200:
+        return False, None
+    return not response.json()["stats"]["failed"], None
+
+
+CALLS = {"translate": call_translate, "batch": call_batch, "stream": call_stream, "multi": call_multi}
+
+
+async def mock_calls(client, mock_url):
+    stats = (await client.get(f"{mock_url}/mock/stats")).json()
+    return stats.get("calls", 0), stats.get("rate_limited", 0)
+
+
+async def run_level(client, base_url, mock_url, scenario, concurrency, args):
+    latencies, first_deltas = [], []
+    failures = 0
+
+    async def worker(worker_id):
+        nonlocal failures
+        for i in range(args.requests_per_worker):
+            started = time.perf_counter()
+            try:
+                ok, first_delta = await CALLS[scenario](
+                    client, base_url, request_text(scenario, concurrency, worker_id, i), args
+                )
+            except httpx.HTTPError:
+                ok, first_delta = False, None
+            latencies.append(time.perf_counter() - started)
+            if first_delta is not None:
+                first_deltas.append(first_delta)
+            if not ok:
+                failures += 1
+
+    calls_before, limited_before = await mock_calls(client, mock_url)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    calls_after, limited_after = await mock_calls(client, mock_url)
+    upstream_calls = calls_after - calls_before
+
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "failures": failures,
+        "error_rate": round(failures / len(latencies), 4),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        **summarize(latencies),
+        "upstream_calls": upstream_calls,
+        "upstream_calls_per_request": round(upstream_calls / len(latencies), 3),
+        "upstream_429": limited_after - limited_before,
+    }
+    if scenario == "stream":
+        result["first_delta"] = summarize(first_deltas)
+    return result
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="llm-translator-bench-")
+    env = dict(os.environ)
+    env.update({
+        "MOCK_LATENCY": str(args.latency),
+        "MOCK_LATENCY_DIST": args.latency_dist,
+        "MOCK_LATENCY_SPREAD": str(args.latency_spread),
+        "MOCK_ERROR_RATE": str(args.error_rate),
+        "MOCK_META_RATE": str(args.meta_rate),
+        "MOCK_ECHO_RATE": str(args.echo_rate),
+        "MOCK_STREAM_DELAY": str(args.stream_delay),
+        "MOCK_SEED": str(args.seed),
+        "MOCK_RPM": str(args.mock_rpm),
+        "RATE_LIMIT_ENABLED": "true" if args.rate_limit_rpm > 0 else "false",
+        "RATE_LIMIT_RPM": str(args.rate_limit_rpm),
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v1",
+        "CACHE_DB_PATH": os.path.join(workdir, "translation_cache.sqlite3"),
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "TM_DB_PATH": os.path.join(workdir, "translation_memory.sqlite3"),
+        "LOG_LEVEL": "ERROR",
+    })
+    env.setdefault("OPENROUTER_API_KEY", "mock-key")
+
+    mock = start_server("mock_openrouter:app", args.mock_port, os.path.join(ROOT, "bench"), env)
+    backend = start_server("app:app", args.backend_port, os.path.join(ROOT, "backend"), env)
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    base_url = f"http://127.0.0.1:{args.backend_port}"
+    results = []
+    try:
+        await wait_ready(f"{mock_url}/docs")
+        await wait_ready(f"{base_url}/health")
+
+        limits = httpx.Limits(max_connections=max(args.concurrency) + 1)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    result = await run_level(client, base_url, mock_url, scenario, concurrency, args)
+                    print(json.dumps(result), file=sys.stderr)
+                    results.append(result)
+    finally:
+        for process in (backend, mock):
+            process.terminate()
+            process.wait()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests-per-worker", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=20, help="Сегментов в одном запросе batch")
+    parser.add_argument("--targets", type=int, default=len(TARGET_LANGUAGES),
+                        help="Языков в одном запросе multi (до %d)" % len(TARGET_LANGUAGES))
+    parser.add_argument("--strategy", default=None, help="Стратегия обхода моделей (sequential, hedged, race)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Средняя задержка мока, сек")
+    parser.add_argument("--latency-dist", default="fixed", choices=("fixed", "uniform", "lognormal", "exponential"))
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов мока с ошибкой")
+    parser.add_argument("--meta-rate", type=float, default=0.0, help="Доля ответов с метакомментарием")
+    parser.add_argument("--echo-rate", type=float, default=0.0, help="Доля ответов, повторяющих исходный текст")
+    parser.add_argument("--stream-delay", type=float, default=0.02, help="Пауза между словами потока, сек")
+    parser.add_argument("--mock-rpm", type=int, default=0, help="Квота мока, запросов в минуту на модель")
+    parser.add_argument("--rate-limit-rpm", type=float, default=0,
+                        help="Лимит backend, запросов в минуту на модель (0 - ограничитель выключен)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120, help="Таймаут клиента, сек")
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout)")
+    parser.add_argument("--mock-port", type=int, default=9000)
+    parser.add_argument("--backend-port", type=int, default=8000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""
+Сравнение перевода длинных документов одним запросом (mode=single)
+и по фрагментам (mode=document) на синтетических текстах.
+
+Мок отвечает с задержкой, пропорциональной длине промпта, как настоящая модель.
+
+Запуск из корня репозитория:
+    python bench/document_benchmark.py --sizes 10000 30000 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+from load_test import ROOT, start_server, wait_ready
+
+WORDS = ("the quick brown fox jumps over lazy dog while translation engines process "
+         "long documents split into chunks with sentence aware boundaries").split()
+
+
+def synthetic_document(size, seed):
+    rng = random.Random(seed)
+    paragraphs, length = [], 0
+    while length < size:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20)))
+            sentences.append(sentence.capitalize() + ".")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)[:size]
+
+
+async def translate(client, url, text, mode):
+    started = time.perf_counter()
+    try:
+        response = await client.post(url, json={
+            "text": text,
+            "source_language": "English",
+            "target_language": "Russian",
+            "mode": mode,
+        })
+    except httpx.TimeoutException:
+        # Так же ведёт себя frontend: запрос длиннее таймаута клиента считается неудачным
+        return {"mode": mode, "status": "timeout", "wall_time_s": round(time.perf_counter() - started, 3)}
+    elapsed = time.perf_counter() - started
+    data = response.json() if response.status_code == 200 else {}
+    return {
+        "mode": mode,
+        "status": response.status_code,
+        "wall_time_s": round(elapsed, 3),
+        "chunks": data.get("chunks", 1),
+    }
+
+
+async def main(args):
+    env = dict(os.environ)
+    env["MOCK_LATENCY"] = str(args.latency)
+    env["MOCK_LATENCY_PER_1K_CHARS"] = str(args.latency_per_1k)
+    env["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{args.mock_port}/api/v1"
+    env["CACHE_ENABLED"] = "false"
+    env["TM_ENABLED"] = "false"
+    env["RATE_LIMIT_ENABLED"] = "false"
+    env.setdefault("OPENROUTER_API_KEY", "mock-key")
+
+    mock = start_server("mock_openrouter:app", args.mock_port, os.path.join(ROOT, "bench"), env)
+    backend = start_server("app:app", args.backend_port, os.path.join(ROOT, "backend"), env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{args.mock_port}/docs")
+        await wait_ready(f"http://127.0.0.1:{args.backend_port}/health")
+
+        url = f"http://127.0.0.1:{args.backend_port}/translate"
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            for size in args.sizes:
+                text = synthetic_document(size, seed=size)
+                for mode in ("single", "document"):
+                    print({"chars": size, **await translate(client, url, text, mode)})
+    finally:
+        for process in (backend, mock):
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 30000, 100000])
+    parser.add_argument("--latency", type=float, default=0.5, help="Базовая задержка мока, сек")
+    parser.add_argument("--latency-per-1k", type=float, default=0.3, help="Задержка мока на 1000 символов, сек")
+    parser.add_argument("--timeout", type=float, default=60, help="Таймаут клиента, сек")
+    parser.add_argument("--mock-port", type=int, default=9000)
+    parser.add_argument("--backend-port", type=int, default=8000)
+    asyncio.run(main(parser.parse_args()))
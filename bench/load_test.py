@@ -0,0 +1,115 @@
+"""
+Нагрузочный тест backend против локального мока OpenRouter.
+
+Скрипт поднимает мок и backend в отдельных процессах, затем отправляет
+запросы на /translate с разными уровнями конкурентности. Если backend
+обрабатывает upstream-вызовы асинхронно, пропускная способность растёт
+вместе с конкурентностью, а не упирается в 1 / MOCK_LATENCY. Текст каждого
+запроса уникален, а кеш и память переводов лежат во временном каталоге,
+поэтому измеряются обращения к моделям, а не попадания в кеш.
+
+Запуск из корня репозитория:
+    python bench/load_test.py --latency 0.5 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(module, port, cwd, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+        cwd=cwd,
+        env=env,
+    )
+
+
+async def wait_ready(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+async def run_level(client, url, concurrency, requests_per_worker):
+    latencies = []
+    failures = 0
+
+    async def worker(n):
+        nonlocal failures
+        for i in range(requests_per_worker):
+            started = time.perf_counter()
+            response = await client.post(url, json={
+                "text": f"Hello world, request {concurrency}-{n}-{i}",
+                "source_language": "English",
+                "target_language": "Russian",
+            })
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "failures": failures,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_s": round(latencies[len(latencies) // 2], 3),
+        "max_s": round(latencies[-1], 3),
+    }
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="llm-translator-load-")
+    env = dict(os.environ)
+    env["MOCK_LATENCY"] = str(args.latency)
+    env["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{args.mock_port}/api/v1"
+    env["RATE_LIMIT_ENABLED"] = "false"
+    env["CACHE_DB_PATH"] = os.path.join(workdir, "translation_cache.sqlite3")
+    env["JOBS_DB_PATH"] = os.path.join(workdir, "jobs.sqlite3")
+    env["TM_DB_PATH"] = os.path.join(workdir, "translation_memory.sqlite3")
+    env.setdefault("OPENROUTER_API_KEY", "mock-key")
+
+    mock = start_server("mock_openrouter:app", args.mock_port, os.path.join(ROOT, "bench"), env)
+    backend = start_server("app:app", args.backend_port, os.path.join(ROOT, "backend"), env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{args.mock_port}/docs")
+        await wait_ready(f"http://127.0.0.1:{args.backend_port}/health")
+
+        url = f"http://127.0.0.1:{args.backend_port}/translate"
+        limits = httpx.Limits(max_connections=max(args.concurrency))
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            for concurrency in args.concurrency:
+                result = await run_level(client, url, concurrency, args.requests_per_worker)
+                print(result)
+    finally:
+        for process in (backend, mock):
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="Задержка ответа мока, сек")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests-per-worker", type=int, default=4)
+    parser.add_argument("--mock-port", type=int, default=9000)
+    parser.add_argument("--backend-port", type=int, default=8000)
+    asyncio.run(main(parser.parse_args()))
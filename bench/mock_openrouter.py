@@ -0,0 +1,209 @@
+"""
+Локальный мок OpenRouter /api/v1/chat/completions для нагрузочных тестов.
+
+Задержка берётся из распределения (fixed, uniform, lognormal, exponential),
+часть ответов можно заменить ошибками или невалидными переводами
+(метакомментарий, эхо исходного текста). Счётчики вызовов доступны на
+GET /mock/stats, чтобы считать число upstream-вызовов на запрос.
+
+Запуск:
+    MOCK_LATENCY=0.5 MOCK_ERROR_RATE=0.05 uvicorn mock_openrouter:app --port 9000
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict, deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Средняя задержка ответа (для lognormal - медиана)
+MOCK_LATENCY = float(os.getenv("MOCK_LATENCY", "0.5"))
+MOCK_LATENCY_DIST = os.getenv("MOCK_LATENCY_DIST", "fixed").lower()
+# Разброс: для uniform - доля от MOCK_LATENCY в обе стороны, для lognormal - sigma
+MOCK_LATENCY_SPREAD = float(os.getenv("MOCK_LATENCY_SPREAD", "0.5"))
+# Дополнительная задержка на каждую 1000 символов промпта - имитация времени генерации
+MOCK_LATENCY_PER_1K_CHARS = float(os.getenv("MOCK_LATENCY_PER_1K_CHARS", "0"))
+# Пауза между словами в потоковом ответе
+MOCK_STREAM_DELAY = float(os.getenv("MOCK_STREAM_DELAY", "0.05"))
+# Доли ответов с ошибкой, метакомментарием и эхом исходного текста
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+MOCK_ERROR_STATUS = int(os.getenv("MOCK_ERROR_STATUS", "500"))
+MOCK_META_RATE = float(os.getenv("MOCK_META_RATE", "0"))
+MOCK_ECHO_RATE = float(os.getenv("MOCK_ECHO_RATE", "0"))
+MOCK_SEED = os.getenv("MOCK_SEED")
+# Квота запросов в минуту на модель, как у бесплатных моделей OpenRouter (0 - без квоты)
+MOCK_RPM = int(os.getenv("MOCK_RPM", "0"))
+
+# Готовые "переводы", которые проходят is_valid_translation для любого направления
+SAMPLE_OUTPUT = {
+    "russian": "Съешь же ещё этих мягких французских булок да выпей чаю",
+    "ukrainian": "Чуєш їх, доцю, га? Кумедна ж ти, прощайся без ґольфів",
+    "bulgarian": "Жълтата дюля беше щастлива и замръзна като гьон",
+    "serbian": "Љубазни фењерџија чађавог лица хоће да ми покаже штос",
+    "chinese": "我能吞下玻璃而不伤身体，这是一段用于测试的中文文本",
+    "japanese": "いろはにほへと ちりぬるを わかよたれそ つねならむ",
+    "korean": "다람쥐 헌 쳇바퀴에 타고파 키스의 고유조건은 입술끼리 만나야 하고",
+    "arabic": "نص حكيم له سر قاطع وذو شأن عظيم مكتوب على ثوب أخضر",
+    "hindi": "ऋषियों को सताने वाले दुष्ट राक्षसों के राजा रावण का सर्वनाश",
+}
+DEFAULT_OUTPUT = "Lorem ipsum dolor sit amet consectetur adipiscing elit"
+
+TARGET_RE = re.compile(r"to (\w+)", re.IGNORECASE)
+MARKER_RE = re.compile(r"<<<(\d+)>>>")
+SEGMENT_RE = re.compile(r"<<<(\d+)>>>\n(.*?)(?=\n<<<\d+>>>|\Z)", re.DOTALL)
+# Строка языка в промпте перевода на несколько языков: <<<N>>> Language
+LANGUAGE_LINE_RE = re.compile(r"^<<<(\d+)>>> (\w+)", re.MULTILINE)
+SOURCE_MARKER = "TEXT TO TRANSLATE:\n"
+# Переводимый текст в промптах v2
+WRAPPED_RE = re.compile(r"<text>\n(.*)\n</text>", re.DOTALL)
+
+app = FastAPI()
+rng = random.Random(MOCK_SEED)
+stats = Counter()
+recent_calls = defaultdict(deque)  # model -> время вызовов за последнюю минуту
+
+
+def _latency():
+    if MOCK_LATENCY_DIST == "uniform":
+        return rng.uniform(MOCK_LATENCY * (1 - MOCK_LATENCY_SPREAD), MOCK_LATENCY * (1 + MOCK_LATENCY_SPREAD))
+    if MOCK_LATENCY_DIST == "lognormal":
+        return rng.lognormvariate(0, MOCK_LATENCY_SPREAD) * MOCK_LATENCY
+    if MOCK_LATENCY_DIST == "exponential":
+        return rng.expovariate(1 / MOCK_LATENCY) if MOCK_LATENCY > 0 else 0
+    return MOCK_LATENCY
+
+
+def _choose_outcome():
+    """ok, error, meta или echo с заданными вероятностями"""
+    roll = rng.random()
+    for outcome, rate in (("error", MOCK_ERROR_RATE), ("meta", MOCK_META_RATE), ("echo", MOCK_ECHO_RATE)):
+        if roll < rate:
+            return outcome
+        roll -= rate
+    return "ok"
+
+
+def _target_language(messages):
+    for message in messages:
+        match = TARGET_RE.search(message.get("content", ""))
+        if match:
+            return match.group(1).lower()
+    return ""
+
+
+def _usage(prompt_chars, content):
+    # Примерно 4 символа на токен
+    prompt_tokens, completion_tokens = prompt_chars // 4 + 1, len(content) // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+async def _stream(content, model, usage):
+    for i, word in enumerate(content.split(" ")):
+        chunk = {
+            "id": "mock-completion",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(MOCK_STREAM_DELAY)
+    final = {"id": "mock-completion", "object": "chat.completion.chunk", "created": 0, "model": model,
+             "choices": [], "usage": usage}
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _answer(prompt, translation, outcome):
+    """Ответ на промпт; при outcome=echo возвращается исходный текст, при meta - с пояснением"""
+    if outcome == "echo":
+        wrapped = WRAPPED_RE.search(prompt)
+        source = wrapped.group(1) if wrapped else prompt.split(SOURCE_MARKER, 1)[-1]
+    elif outcome == "meta":
+        source = "Here is the translation: " + translation
+    else:
+        source = translation
+    # Перевод на несколько языков: под каждым маркером - "перевод" на свой язык
+    languages = LANGUAGE_LINE_RE.findall(prompt)
+    if languages:
+        return "\n".join(
+            f"<<<{marker}>>>\n" + (source if outcome != "ok" else SAMPLE_OUTPUT.get(language.lower(), DEFAULT_OUTPUT))
+            for marker, language in languages
+        )
+    # Пакетный промпт: отвечаем на каждый сегмент под его маркером
+    segments = SEGMENT_RE.findall(prompt) if MARKER_RE.search(prompt) else []
+    if segments:
+        return "\n".join(
+            f"<<<{marker}>>>\n{text.strip() if outcome == 'echo' else source}" for marker, text in segments
+        )
+    return source
+
+
+def _quota_retry_after(model):
+    """Секунды до освобождения квоты модели или None, если квота не исчерпана"""
+    if MOCK_RPM <= 0:
+        return None
+    now = time.monotonic()
+    calls = recent_calls[model]
+    while calls and calls[0] <= now - 60:
+        calls.popleft()
+    if len(calls) >= MOCK_RPM:
+        return 60 - (now - calls[0])
+    calls.append(now)
+    return None
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return dict(stats)
+
+
+@app.post("/mock/stats/reset")
+async def reset_mock_stats():
+    stats.clear()
+    return {}
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    prompt_chars = sum(len(message.get("content", "")) for message in messages)
+    stats["calls"] += 1
+    retry_after = _quota_retry_after(body.get("model", "mock"))
+    if retry_after is not None:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit exceeded", "code": 429}},
+            headers={"Retry-After": str(round(retry_after, 1))},
+        )
+    outcome = _choose_outcome()
+    stats[outcome] += 1
+    await asyncio.sleep(_latency() + MOCK_LATENCY_PER_1K_CHARS * prompt_chars / 1000)
+    if outcome == "error":
+        return JSONResponse(status_code=MOCK_ERROR_STATUS, content={"error": {"message": "Injected mock error"}})
+    translation = SAMPLE_OUTPUT.get(_target_language(messages), DEFAULT_OUTPUT)
+    # Инструкция (языки, маркеры) может быть в system, текст - в user
+    content = _answer("\n".join(message.get("content", "") for message in messages), translation, outcome)
+    if body.get("stream"):
+        return StreamingResponse(_stream(content, body.get("model", "mock"), _usage(prompt_chars, content)), media_type="text/event-stream")
+    return {
+        "id": "mock-completion",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body.get("model", "mock"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": _usage(prompt_chars, content),
+    }
@@ -0,0 +1,164 @@
+"""
+Сравнение шаблонов промптов (backend/prompts.py) на фиксированном корпусе.
+
+Каждый пример корпуса переводится каждым шаблоном напрямую через
+/chat/completions (без backend), ответ проверяется validation.check_translation.
+Отчёт в JSON: оценка токенов промпта локальным счётчиком, токены по usage ответа,
+доля ответов, прошедших проверку, и задержка.
+
+По умолчанию поднимается локальный мок OpenRouter; с --base-url и
+OPENROUTER_API_KEY те же замеры делаются на настоящей модели.
+
+Запуск из корня репозитория:
+    python bench/prompt_benchmark.py --templates v1 v2 --output prompts.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+from benchmark import percentile
+from load_test import ROOT, start_server, wait_ready
+
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+import prompts  # noqa: E402
+import validation  # noqa: E402
+
+# (текст, исходный язык, язык перевода)
+CORPUS = [
+    ("Hello world", "English", "Russian"),
+    ("Please restart the application to apply the new settings.", "English", "German"),
+    ("The meeting was moved to Thursday, 14 March, at 10:30.", "English", "French"),
+    ("Your order has been shipped and should arrive within 3 to 5 business days.", "English", "Spanish"),
+    ("Click Save to keep your changes or Cancel to discard them.", "English", "Italian"),
+    ("We could not verify your email address. Check the link and try again.", "English", "Portuguese"),
+    ("The quick brown fox jumps over the lazy dog near the river bank.", "English", "Chinese"),
+    ("Thank you for your patience while we resolve this issue.", "English", "Japanese"),
+    ("The file is too large to upload. The maximum size is 10 MB.", "English", "Korean"),
+    ("Welcome back! You have 2 unread messages.", "English", "Arabic"),
+    ("Enter the code we sent to your phone.", "English", "Hindi"),
+    ("Съешь же ещё этих мягких французских булок, да выпей чаю.", "Russian", "English"),
+    ("Документ сохранён. Вы можете закрыть это окно.", "Russian", "English"),
+    ("Der Zug hat zwanzig Minuten Verspätung.", "German", "English"),
+    ("La réunion commence dans cinq minutes.", "French", "English"),
+    (
+        "Machine translation has improved quickly, but short interface strings remain hard: they lack context, "
+        "contain placeholders and must fit into buttons. Reviewers should check terminology, tone and length "
+        "before a release, and report any string that reads unnaturally in the target language.",
+        "English", "Russian",
+    ),
+]
+
+
+async def run_template(client, base_url, api_key, version, args):
+    records = []
+
+    async def translate(text, source, target):
+        messages = prompts.TEMPLATES[version](text, source, target)
+        started = time.perf_counter()
+        response = await client.post(
+            f"{base_url}/chat/completions",
+            headers={"Authorization": f"Bearer {api_key}"},
+            json={"model": args.model, "messages": messages},
+        )
+        elapsed = time.perf_counter() - started
+        record = {
+            "estimated_prompt_tokens": prompts.estimate_prompt_tokens(messages),
+            "prompt_tokens": None, "completion_tokens": None, "valid": False, "latency": elapsed,
+        }
+        if response.status_code == 200:
+            data = response.json()
+            usage = data.get("usage") or {}
+            content = data["choices"][0]["message"]["content"]
+            record.update(
+                prompt_tokens=usage.get("prompt_tokens"),
+                completion_tokens=usage.get("completion_tokens"),
+                valid=validation.check_translation(text, content, source, target) is None,
+            )
+        records.append(record)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(item):
+        async with semaphore:
+            await translate(*item)
+
+    await asyncio.gather(*(limited(item) for _ in range(args.repeat) for item in CORPUS))
+
+    def total(field):
+        return sum(record[field] or 0 for record in records)
+
+    return {
+        "template": version,
+        "calls": len(records),
+        "estimated_prompt_tokens_per_call": round(total("estimated_prompt_tokens") / len(records), 1),
+        "prompt_tokens_per_call": round(total("prompt_tokens") / len(records), 1),
+        "completion_tokens_per_call": round(total("completion_tokens") / len(records), 1),
+        "pass_rate": round(sum(record["valid"] for record in records) / len(records), 4),
+        "p50_s": round(percentile([record["latency"] for record in records], 50), 4),
+        "p95_s": round(percentile([record["latency"] for record in records], 95), 4),
+    }
+
+
+async def main(args):
+    mock = None
+    base_url = args.base_url
+    api_key = os.getenv("OPENROUTER_API_KEY", "mock-key")
+    if base_url is None:
+        env = dict(os.environ)
+        env.update({
+            "MOCK_LATENCY": str(args.latency),
+            "MOCK_META_RATE": str(args.meta_rate),
+            "MOCK_ECHO_RATE": str(args.echo_rate),
+            "MOCK_SEED": str(args.seed),
+        })
+        mock = start_server("mock_openrouter:app", args.mock_port, os.path.join(ROOT, "bench"), env)
+        base_url = f"http://127.0.0.1:{args.mock_port}/api/v1"
+    results = []
+    try:
+        if mock is not None:
+            await wait_ready(f"http://127.0.0.1:{args.mock_port}/docs")
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            for version in args.templates:
+                result = await run_template(client, base_url, api_key, version, args)
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "tokenizer": "tiktoken" if prompts._encoding is not None else "approximate",
+        "corpus_size": len(CORPUS),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--templates", nargs="+", choices=list(prompts.TEMPLATES), default=list(prompts.TEMPLATES))
+    parser.add_argument("--model", default="deepseek/deepseek-chat:free")
+    parser.add_argument("--repeat", type=int, default=3, help="Сколько раз прогнать корпус на шаблон")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-url", default=None, help="API вместо мока, например https://openrouter.ai/api/v1")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка мока, сек")
+    parser.add_argument("--meta-rate", type=float, default=0.0, help="Доля ответов мока с метакомментарием")
+    parser.add_argument("--echo-rate", type=float, default=0.0, help="Доля ответов мока, повторяющих исходный текст")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout)")
+    parser.add_argument("--mock-port", type=int, default=9000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""
+Микробенчмарк проверки перевода на больших ответах модели.
+
+Сравнивает исходную реализацию is_valid_translation (построчная копия ниже)
+с модулем backend/validation.py на текстах разной длины и письменности.
+
+Запуск из корня репозитория:
+    python bench/validator_benchmark.py --sizes 1000 100000 1000000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import validation  # noqa: E402
+
+SAMPLES = {
+    ("English", "Russian"): "Съешь же ещё этих мягких французских булок, да выпей чаю. ",
+    ("Russian", "English"): "The quick brown fox jumps over the lazy dog near the river bank. ",
+    ("English", "Chinese"): "敏捷的棕色狐狸跳过了懒狗，然后回到森林里休息。",
+    ("English", "Arabic"): "الثعلب البني السريع يقفز فوق الكلب الكسول. ",
+    ("English", "Hindi"): "तेज़ भूरी लोमड़ी आलसी कुत्ते के ऊपर कूदती है। ",
+}
+
+
+def legacy_is_valid_translation(source_text, translated_text, source_language, target_language):
+    """Исходная реализация из backend/app.py (без логирования)"""
+    source_clean = re.sub(r'\s+', ' ', source_text.strip()).lower()
+    translated_clean = re.sub(r'\s+', ' ', translated_text.strip()).lower()
+    if source_clean == translated_clean:
+        return False
+    if not translated_clean:
+        return False
+    meta_patterns = [
+        r'translation[:\s]',
+        r'translated[:\s]',
+        r'here is[:\s]',
+        r'перевод[:\s]',
+        r'\[.*?\]',
+        r'\(.*?\)'
+    ]
+    for pattern in meta_patterns:
+        if re.search(pattern, translated_clean, re.IGNORECASE):
+            return False
+    cyrillic = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+    latin = 'abcdefghijklmnopqrstuvwxyz'
+    if source_language.lower() in ['russian', 'ukrainian', 'bulgarian', 'serbian'] and \
+       target_language.lower() in ['english', 'spanish', 'french', 'german', 'italian']:
+        cyrillic_count = sum(1 for c in translated_clean if c.lower() in cyrillic)
+        if cyrillic_count > len(translated_clean) * 0.3:
+            return False
+    elif source_language.lower() in ['english', 'spanish', 'french', 'german', 'italian'] and \
+         target_language.lower() in ['russian', 'ukrainian', 'bulgarian', 'serbian']:
+        latin_count = sum(1 for c in translated_clean if c.lower() in latin)
+        if latin_count > len(translated_clean) * 0.3:
+            return False
+    return True
+
+
+def bench(fn, args, repeat):
+    number = max(1, repeat)
+    return min(timeit.repeat(lambda: fn(*args), number=number, repeat=3)) / number
+
+
+def main(args):
+    results = []
+    for (source_language, target_language), sample in SAMPLES.items():
+        for size in args.sizes:
+            translated = (sample * (size // len(sample) + 1))[:size]
+            call = ("source text", translated, source_language, target_language)
+            repeat = max(1, args.budget // max(size, 1))
+            legacy = bench(legacy_is_valid_translation, call, repeat)
+            current = bench(validation.check_translation, call, repeat)
+            results.append({
+                "pair": f"{source_language}->{target_language}",
+                "chars": size,
+                "legacy_ms": round(legacy * 1000, 3),
+                "current_ms": round(current * 1000, 3),
+                "speedup": round(legacy / current, 1) if current else None,
+            })
+            print(json.dumps(results[-1], ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--budget", type=int, default=2000000, help="Примерное число символов на один замер")
+    parser.add_argument("--output", help="Сохранить результаты в JSON-файл")
+    main(parser.parse_args())
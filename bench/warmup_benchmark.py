@@ -0,0 +1,152 @@
+"""
+Задержка после перезапуска: холодный кеш против прогрева по журналу запросов.
+
+Генерирует журнал запросов с распределением Ципфа по фразам и языковым парам,
+затем для каждого режима поднимает мок и backend с чистым кешем и отправляет
+запросы из того же распределения. Отчёт в JSON: p50/p95 первых запросов после
+старта (холодный старт), p50/p95 повторного прогона (установившийся режим) и
+число upstream-вызовов на запрос.
+
+Режимы: cold - без прогрева; warm - прогрев по журналу при старте (warmup.py).
+
+Запуск из корня репозитория:
+    python bench/warmup_benchmark.py --phrases 200 --requests 300 --output warmup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmark import TARGET_LANGUAGES, mock_calls, percentile
+from load_test import ROOT, start_server, wait_ready
+
+
+def zipf_requests(args, count, seed):
+    """Запросы (текст, язык перевода) с частотой фразы, убывающей как 1 / ранг^s"""
+    rng = random.Random(seed)
+    phrases = [f"Interface message number {i}: your changes have been saved." for i in range(args.phrases)]
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.phrases)]
+    targets = TARGET_LANGUAGES[:args.targets]
+    return [(text, rng.choice(targets)) for text in rng.choices(phrases, weights, k=count)]
+
+
+async def replay(client, base_url, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(text, target):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(f"{base_url}/translate", json={
+                "text": text, "source_language": "English", "target_language": target,
+            })
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    await asyncio.gather(*(one(text, target) for text, target in requests))
+    return {"p50_s": round(percentile(latencies, 50), 4), "p95_s": round(percentile(latencies, 95), 4)}
+
+
+async def run_mode(mode, log_path, args):
+    workdir = tempfile.mkdtemp(prefix=f"warmup-{mode}-")
+    env = dict(os.environ)
+    env.update({
+        "MOCK_LATENCY": str(args.latency),
+        "MOCK_SEED": str(args.seed),
+        "RATE_LIMIT_ENABLED": "false",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v1",
+        "CACHE_DB_PATH": os.path.join(workdir, "translation_cache.sqlite3"),
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "TM_DB_PATH": os.path.join(workdir, "translation_memory.sqlite3"),
+        "TM_ENABLED": "false",
+        "WARMUP_LOG_PATH": log_path if mode == "warm" else "",
+        "WARMUP_BUDGET": str(args.budget),
+        "LOG_LEVEL": "ERROR",
+    })
+    env.setdefault("OPENROUTER_API_KEY", "mock-key")
+
+    mock = start_server("mock_openrouter:app", args.mock_port, os.path.join(ROOT, "bench"), env)
+    backend = start_server("app:app", args.backend_port, os.path.join(ROOT, "backend"), env)
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    base_url = f"http://127.0.0.1:{args.backend_port}"
+    try:
+        await wait_ready(f"{mock_url}/docs")
+        await wait_ready(f"{base_url}/health")
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            started = time.perf_counter()
+            if mode == "warm":
+                while not (await client.get(f"{base_url}/warmup/stats")).json()["runs"]:
+                    await asyncio.sleep(0.1)
+            warmup_s = time.perf_counter() - started
+            warmup_calls, _ = await mock_calls(client, mock_url)
+
+            requests = zipf_requests(args, args.requests, args.seed + 1)
+            cold = await replay(client, base_url, requests, args.concurrency)
+            cold_calls = (await mock_calls(client, mock_url))[0] - warmup_calls
+            steady = await replay(client, base_url, requests, args.concurrency)
+            warmup_stats = (await client.get(f"{base_url}/warmup/stats")).json()
+    finally:
+        for process in (backend, mock):
+            process.terminate()
+            process.wait()
+
+    return {
+        "mode": mode,
+        "warmup_s": round(warmup_s, 3),
+        "warmup_upstream_calls": warmup_calls,
+        "warmup": warmup_stats["last_run"],
+        "requests": len(requests),
+        "first_run": cold,
+        "first_run_upstream_calls_per_request": round(cold_calls / len(requests), 3),
+        "steady": steady,
+    }
+
+
+async def main(args):
+    log_dir = tempfile.mkdtemp(prefix="warmup-log-")
+    log_path = os.path.join(log_dir, "requests.jsonl")
+    with open(log_path, "w") as f:
+        for text, target in zipf_requests(args, args.log_size, args.seed):
+            f.write(json.dumps({"text": text, "source_language": "English", "target_language": target}) + "\n")
+
+    results = []
+    for mode in args.modes:
+        result = await run_mode(mode, log_path, args)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=("cold", "warm"), default=["cold", "warm"])
+    parser.add_argument("--phrases", type=int, default=200, help="Различных фраз в журнале")
+    parser.add_argument("--targets", type=int, default=3, help="Языков перевода (до %d)" % len(TARGET_LANGUAGES))
+    parser.add_argument("--zipf", type=float, default=1.1, help="Показатель распределения Ципфа")
+    parser.add_argument("--log-size", type=int, default=5000, help="Строк в журнале запросов")
+    parser.add_argument("--requests", type=int, default=300, help="Запросов после старта")
+    parser.add_argument("--budget", type=int, default=200, help="WARMUP_BUDGET")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.3, help="Задержка мока, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout)")
+    parser.add_argument("--mock-port", type=int, default=9000)
+    parser.add_argument("--backend-port", type=int, default=8000)
+    asyncio.run(main(parser.parse_args()))
@@ -1,7 +1,20 @@
 import streamlit as st
 import requests
 import json
+import os
+import queue
+import threading
 import time
+from urllib.parse import unquote
+from requests.adapters import HTTPAdapter
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+# How long a health check result is reused across reruns and sessions
+HEALTH_CHECK_TTL = int(os.getenv("HEALTH_CHECK_TTL", "30"))
+# Translations kept per browser session for instant repeats
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "100"))
+# File types accepted by the backend /translate/file endpoint
+FILE_TYPES = ["txt", "md", "srt", "vtt", "json", "po"]
 
 # Configure the page
 st.set_page_config(
@@ -31,11 +44,25 @@ if 'translated_text' not in st.session_state:
     st.session_state.translated_text = ""
 if 'source_text' not in st.session_state:
     st.session_state.source_text = ""
+if 'translation_cache' not in st.session_state:
+    st.session_state.translation_cache = {}
+if 'translated_file' not in st.session_state:
+    st.session_state.translated_file = None
+
+@st.cache_resource
+def get_session():
+    """One pooled HTTP session for all reruns and users, so requests reuse keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
+@st.cache_data(ttl=HEALTH_CHECK_TTL, show_spinner=False)
 def check_backend_health():
     """Check if the backend service is available"""
     try:
-        response = requests.get("http://backend:8000/health", timeout=5)
+        response = get_session().get(f"{BACKEND_URL}/health", timeout=5)
         if response.status_code == 200:
             health_data = response.json()
             if health_data.get("status") == "warning":
@@ -45,11 +72,12 @@ def check_backend_health():
     except requests.exceptions.RequestException as e:
         return False, f"Backend service is not available: {str(e)}"
 
-def translate_text(text, source_lang, target_lang):
+def stream_translation(text, source_lang, target_lang, session):
     """
-    Send a translation request to the backend service
+    Stream a translation from the backend as server-sent events.
+    Yields (event, data) tuples: model, delta, reset, progress, done or error.
     """
-    url = "http://backend:8000/translate"
+    url = f"{BACKEND_URL}/translate/stream"
     data = {
         "text": text,
         "source_language": source_lang,
@@ -57,37 +85,116 @@ def translate_text(text, source_lang, target_lang):
     }
     
     try:
-        # Add timeout to prevent hanging requests
-        response = requests.post(url, json=data, timeout=30)
-        
-        # Check for successful response
-        if response.status_code == 200:
-            response_data = response.json()
-            translated_text = response_data.get("translated_text")
-            model_used = response_data.get("model_used", "Unknown model")
-            return translated_text, model_used, None
-        
-        # Handle error responses with proper error messages
-        error_detail = "Unknown error"
+        # Read timeout applies between events, not to the whole translation
+        with session.post(url, json=data, stream=True, timeout=(5, 60)) as response:
+            if response.status_code != 200:
+                error_detail = f"HTTP error: {response.status_code}"
+                try:
+                    error_detail = response.json().get("detail", error_detail)
+                except ValueError:
+                    pass
+                yield "error", {"detail": error_detail}
+                return
+            
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event:
+                    yield event, json.loads(line[len("data:"):])
+                    event = None
+    except requests.exceptions.ConnectTimeout:
+        yield "error", {"detail": "Connection timeout: The backend service took too long to respond. Please try again later."}
+    except requests.exceptions.ReadTimeout:
+        yield "error", {"detail": "Read timeout: The translation stream stalled. Please try again."}
+    except requests.exceptions.ConnectionError:
+        yield "error", {"detail": "Connection error: Could not connect to the backend service. Please check if the service is running."}
+    except requests.exceptions.RequestException as e:
+        yield "error", {"detail": f"Request error: {str(e)}"}
+
+def stream_in_background(text, source_lang, target_lang):
+    """
+    Read the translation stream in a worker thread so the script thread only renders.
+    Returns a queue of (event, data) tuples that ends with (None, None).
+    """
+    events = queue.Queue()
+    # Cached resources are resolved in the script thread, the worker thread has no Streamlit context
+    session = get_session()
+    
+    def reader():
         try:
-            error_json = response.json()
-            if "detail" in error_json:
-                error_detail = error_json["detail"]
-        except:
-            error_detail = f"HTTP error: {response.status_code}"
-        
-        return None, None, error_detail
-        
+            for item in stream_translation(text, source_lang, target_lang, session):
+                events.put(item)
+        finally:
+            events.put((None, None))
+    
+    threading.Thread(target=reader, daemon=True).start()
+    return events
+
+def translate_file(uploaded_file, source_lang, target_lang, on_progress):
+    """
+    Upload a file to the backend and read the translated file as it streams back.
+    Returns (file name, content, mime type, error).
+    """
+    url = f"{BACKEND_URL}/translate/file"
+    params = {
+        "source_language": source_lang,
+        "target_language": target_lang,
+        "filename": uploaded_file.name
+    }
+    
+    try:
+        uploaded_file.seek(0)
+        # The file object is sent in chunks; the read timeout applies between translated parts
+        with get_session().post(url, params=params, data=uploaded_file, stream=True, timeout=(5, 120)) as response:
+            if response.status_code != 200:
+                error_detail = f"HTTP error: {response.status_code}"
+                try:
+                    error_detail = response.json().get("detail", error_detail)
+                except ValueError:
+                    pass
+                return None, None, None, error_detail
+            
+            parts, received = [], 0
+            for part in response.iter_content(chunk_size=65536):
+                parts.append(part)
+                received += len(part)
+                on_progress(received)
+            disposition = response.headers.get("Content-Disposition", "")
+            file_name = unquote(disposition.split("''", 1)[1]) if "''" in disposition else uploaded_file.name
+            mime = response.headers.get("Content-Type", "text/plain").split(";")[0]
+            return file_name, b"".join(parts), mime, None
     except requests.exceptions.ConnectTimeout:
-        return None, None, "Connection timeout: The backend service took too long to respond. Please try again later."
+        return None, None, None, "Connection timeout: The backend service took too long to respond. Please try again later."
     except requests.exceptions.ReadTimeout:
-        return None, None, "Read timeout: The translation request took too long to complete. Please try again with a shorter text."
+        return None, None, None, "Read timeout: The file translation stalled. Please try again."
     except requests.exceptions.ConnectionError:
-        return None, None, "Connection error: Could not connect to the backend service. Please check if the service is running."
+        return None, None, None, "Connection error: Could not connect to the backend service. Please check if the service is running."
     except requests.exceptions.RequestException as e:
-        return None, None, f"Request error: {str(e)}"
-    except Exception as e:
-        return None, None, f"Unexpected error: {str(e)}"
+        return None, None, None, f"Request error: {str(e)}"
+
+def remember_translation(key, translated_text, model_used):
+    """Store a translation in the session cache, dropping the oldest entries beyond SESSION_CACHE_SIZE"""
+    cache = st.session_state.translation_cache
+    cache.pop(key, None)
+    cache[key] = (translated_text, model_used)
+    while len(cache) > SESSION_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+
+def show_translation(translated_text, model_used, cached=False):
+    st.success("Translation complete!" + (" (from this session's history)" if cached else ""))
+    
+    # Store the translated text in session state
+    st.session_state.translated_text = translated_text
+    
+    # Display translation result
+    with result_container:
+        st.text_area("Translation result", translated_text, height=150, key="output_text")
+        
+        # Display the model that was used for translation
+        if model_used:
+            model_name = model_used.split('/')[-1].split(':')[0]
+            st.info(f"Translation performed using: {model_name}")
 
 # Function to handle language swap
 def swap_languages():
@@ -113,7 +220,7 @@ def swap_languages():
 st.title("🌐 LLM Translator")
 st.markdown("Translate text between languages using advanced LLM technology.")
 
-# Check backend health on startup
+# Check backend health (cached for HEALTH_CHECK_TTL seconds)
 backend_ok, backend_message = check_backend_health()
 if not backend_ok:
     st.warning(f"⚠️ Warning: {backend_message}")
@@ -171,47 +278,58 @@ if translate_button:
         # Check for identical languages
         if source_lang == target_lang:
             st.warning("Source and target languages are the same. No translation needed.")
+        elif (source_text, source_lang, target_lang) in st.session_state.translation_cache:
+            # Same input as earlier in this session - no backend round trip
+            show_translation(*st.session_state.translation_cache[(source_text, source_lang, target_lang)], cached=True)
         else:
-            # Show progress spinner with message
-            with st.spinner("Translating..."):
-                progress_container.info("Connecting to translation service...")
-                time.sleep(0.5)  # Small delay for better UX
-                
-                # Check connection before proceeding
-                backend_ok, backend_message = check_backend_health()
-                if not backend_ok:
-                    st.error(f"Translation service unavailable: {backend_message}")
-                else:
-                    progress_container.info("Performing translation... This may take a moment for longer texts.")
-                    
-                    # Perform translation
-                    translated_text, model_used, error = translate_text(
-                        source_text, 
-                        LANGUAGES[source_lang],
-                        LANGUAGES[target_lang]
-                    )
-                    
-                    # Clear progress message
-                    progress_container.empty()
-                    
-                    if translated_text:
-                        st.success("Translation complete!")
-                        
-                        # Store the translated text in session state
-                        st.session_state.translated_text = translated_text
-                        
-                        # Display translation result
-                        with result_container:
-                            st.text_area("Translation result", translated_text, height=150, key="output_text")
-                            
-                            # Display the model that was used for translation
-                            if model_used:
-                                model_name = model_used.split('/')[-1].split(':')[0]
-                                st.info(f"Translation performed using: {model_name}")
-                    elif error:
-                        st.error(f"Translation failed: {error}")
-                        if "API key" in error:
-                            st.info("💡 Tip: Make sure you've set up the OpenRouter API key in the .env file.")
+            progress_container.info("Performing translation... This may take a moment for longer texts.")
+            
+            # Render partial output as it streams in
+            partial_output = result_container.empty()
+            translated_text, model_used, error = "", None, None
+            started = time.perf_counter()
+            events = stream_in_background(source_text, LANGUAGES[source_lang], LANGUAGES[target_lang])
+            while True:
+                try:
+                    event, data = events.get(timeout=0.25)
+                except queue.Empty:
+                    if not translated_text:
+                        progress_container.info(f"Waiting for the model... {time.perf_counter() - started:.1f}s")
+                    continue
+                if event is None:
+                    break
+                if event == "delta":
+                    translated_text += data["text"]
+                    partial_output.markdown(translated_text + " ▌")
+                elif event == "reset":
+                    # The model failed validation mid-stream, the backend retries with the next one
+                    translated_text = ""
+                    partial_output.empty()
+                    progress_container.info("Retrying with another model...")
+                elif event == "progress":
+                    progress_container.info(f"Translating a long text... {data['done']}/{data['total']} parts done")
+                elif event == "done":
+                    model_used = data.get("model_used")
+                elif event == "error":
+                    error = data.get("detail", "Unknown error")
+            
+            # Clear progress message and partial output
+            progress_container.empty()
+            partial_output.empty()
+            
+            # Only a "done" event marks the text as complete; a dropped stream leaves it partial
+            if not error and not model_used:
+                error = "Connection error: The translation stream ended before the translation was complete."
+            if translated_text and not error:
+                remember_translation((source_text, source_lang, target_lang), translated_text, model_used)
+                show_translation(translated_text, model_used)
+            elif error:
+                if error.startswith("Connection"):
+                    # Re-check health on the next rerun instead of showing a stale "available"
+                    check_backend_health.clear()
+                st.error(f"Translation failed: {error}")
+                if "API key" in error:
+                    st.info("💡 Tip: Make sure you've set up the OpenRouter API key in the .env file.")
     else:
         st.warning("Please enter some text to translate.")
 
@@ -220,6 +338,38 @@ if not translate_button and st.session_state.translated_text:
     with result_container:
         st.text_area("Translation result", st.session_state.translated_text, height=150, key="saved_output")
         
+# File translation: the backend keeps the file format and streams the result back
+st.markdown("---")
+st.subheader("Translate a file")
+uploaded_file = st.file_uploader("Upload a file (" + ", ".join(FILE_TYPES) + ")", type=FILE_TYPES, key="file_upload")
+
+if st.button("Translate file", key="translate_file_button"):
+    if uploaded_file is None:
+        st.warning("Please upload a file to translate.")
+    elif source_lang == target_lang:
+        st.warning("Source and target languages are the same. No translation needed.")
+    else:
+        file_progress = st.empty()
+        file_progress.info(f"Translating {uploaded_file.name}...")
+        file_name, content, mime, error = translate_file(
+            uploaded_file, LANGUAGES[source_lang], LANGUAGES[target_lang],
+            lambda received: file_progress.info(f"Translating {uploaded_file.name}... {received / 1024:.0f} KB received")
+        )
+        file_progress.empty()
+        if error:
+            if error.startswith("Connection"):
+                check_backend_health.clear()
+            st.session_state.translated_file = None
+            st.error(f"File translation failed: {error}")
+        else:
+            st.session_state.translated_file = (file_name, content, mime)
+            st.success(f"File translated: {file_name}")
+
+# The download button reruns the script, so the translated file lives in session state
+if st.session_state.translated_file:
+    file_name, content, mime = st.session_state.translated_file
+    st.download_button("Download translation", content, file_name=file_name, mime=mime, key="download_file")
+
 # Footer
 st.markdown("---")
 st.caption("Powered by LLM technology via OpenRouter.")
\ No newline at end of file